@@ -0,0 +1,61 @@
+"""
+Per-tick cost of the indicators in indicators.py as the price history grows. Recomputing a batch indicator over
+the whole history on every tick grows linearly with its length, while the incremental update stays flat.
+Run from this directory with: python bench_indicators.py
+"""
+import sys
+import os
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from indicators import SMA, EMA, RSI, Bollinger, MACD, VWAP
+
+LENGTHS = (1000, 10000, 100000, 1000000)
+TICKS = 10000
+
+
+def make_prices(length: int) -> tuple:
+    rng = np.random.default_rng(0)
+    prices = 100 + np.cumsum(rng.normal(0, 0.05, length))
+    volumes = rng.integers(1, 1000, length).astype(np.float64)
+    return prices, volumes
+
+
+def main() -> None:
+    indicators = {
+        'SMA(20)': lambda: SMA(20),
+        'EMA(20)': lambda: EMA(20),
+        'RSI(14)': lambda: RSI(14),
+        'Bollinger(20, 2)': lambda: Bollinger(20),
+        'MACD(12, 26, 9)': lambda: MACD(),
+        'VWAP': lambda: VWAP(),
+    }
+
+    print(f"{'indicator':<18}{'length':>10}{'recompute us/tick':>20}{'update us/tick':>16}")
+    for name, factory in indicators.items():
+        for length in LENGTHS:
+            prices, volumes = make_prices(length + TICKS)
+            history = (prices[:length], volumes[:length]) if name == 'VWAP' else (prices[:length],)
+            ticks = list(zip(prices[length:].tolist(), volumes[length:].tolist())) if name == 'VWAP' \
+                else [(price,) for price in prices[length:].tolist()]
+
+            recompute_runs = 20
+            recompute_seconds = timeit.timeit(lambda: factory().load(*history), number=recompute_runs)
+
+            indicator = factory()
+            indicator.load(*history)
+            update = indicator.update
+            start = timeit.default_timer()
+            for tick in ticks:
+                update(*tick)
+            update_seconds = timeit.default_timer() - start
+
+            print(f'{name:<18}{length:>10}{recompute_seconds / recompute_runs * 1e6:>20.1f}'
+                  f'{update_seconds / TICKS * 1e6:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
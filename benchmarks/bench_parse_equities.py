@@ -0,0 +1,74 @@
+"""
+Micro-benchmark comparing the table-driven LEVELONE_EQUITIES parser against the original per-message key_mapping
+implementation. Run from this directory with: python bench_parse_equities.py
+"""
+from datetime import datetime, timezone
+import random
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from data_streamer import parse_equities_data, LEVELONE_EQUITIES_FIELDS
+
+
+def legacy_parse_equities_data(ticker_data: dict) -> list:
+    """
+    The parser as it was before the field tables were hoisted to module level
+    """
+    key_mapping = dict(LEVELONE_EQUITIES_FIELDS)
+
+    tickers = ticker_data['data'][0]['content']
+    revised_tickers = ['Equities']
+
+    for ticker in tickers:
+        epoch_timestamp = ticker_data['data'][0]['timestamp'] / 1000
+        timestamp = str(datetime.fromtimestamp(epoch_timestamp, tz=timezone.utc))
+        timestamp = timestamp[:19]
+        revised_ticker_data = {'timestamp': timestamp}
+        ticker_copy = {k: v for k, v in ticker.items()}
+        for key in ticker.keys():
+            if key in key_mapping.keys():
+                mapped_value = key_mapping.get(key)
+                revised_ticker_data[mapped_value] = ticker_copy.pop(key)
+
+        revised_tickers.append(revised_ticker_data)
+
+    return revised_tickers
+
+
+def make_equities_message(symbol_count: int) -> dict:
+    """
+    Builds a LEVELONE_EQUITIES data message shaped like the ones sent by the Schwab streamer
+    """
+    rng = random.Random(symbol_count)
+    content = []
+    for i in range(symbol_count):
+        ticker = {"key": f"SYM{i}", "delayed": False, "assetMainType": "EQUITY", "assetSubType": "COE",
+                  "cusip": f"{i:09d}"}
+        for key, _ in LEVELONE_EQUITIES_FIELDS[1:]:
+            ticker[key] = round(rng.uniform(1, 500), 2)
+        content.append(ticker)
+    return {"data": [{"service": "LEVELONE_EQUITIES", "timestamp": 1718035200000, "command": "SUBS",
+                      "content": content}]}
+
+
+def main() -> None:
+    for symbol_count in (1, 100, 1000):
+        message = make_equities_message(symbol_count)
+        number = max(1, 20000 // symbol_count)
+        results = {
+            'legacy': lambda: legacy_parse_equities_data(message),
+            'dict': lambda: parse_equities_data(message),
+            'records': lambda: parse_equities_data(message, 'records'),
+            'columns': lambda: parse_equities_data(message, 'columns'),
+        }
+        print(f'{symbol_count} symbols per message')
+        for name, func in results.items():
+            best = min(timeit.repeat(func, number=number, repeat=5)) / number
+            print(f'    {name:<8} {best * 1e6:10.1f} us/message {best * 1e6 / symbol_count:8.2f} us/symbol')
+
+
+if __name__ == '__main__':
+    main()
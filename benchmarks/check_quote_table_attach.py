@@ -0,0 +1,47 @@
+"""
+Cross-process check that a shared QuoteTable outlives the viewers attached to it. Each viewer is a separate Python
+process with its own resource tracker, like a chart started next to a running engine, and reads the table, closes
+it and exits. Run from this directory with: python check_quote_table_attach.py
+"""
+import subprocess
+import sys
+import os
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+from market_data_engine import QuoteTable
+
+VIEWER = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from market_data_engine import QuoteTable
+table = QuoteTable.attach(sys.argv[2])
+print(table.read('AAPL')['last'])
+table.close()
+"""
+
+
+def main() -> int:
+    table = QuoteTable.create(['AAPL'])
+    table.write('AAPL', {'last': 190.5})
+    try:
+        for viewer in range(3):
+            result = subprocess.run([sys.executable, '-c', VIEWER, SRC, table.name], capture_output=True, text=True)
+            if result.returncode != 0 or result.stdout.strip() != '190.5' or 'resource_tracker' in result.stderr:
+                print(f'Viewer {viewer} failed: {result.stdout.strip()} {result.stderr.strip()}')
+                return 1
+            try:
+                reattached = QuoteTable.attach(table.name)
+            except FileNotFoundError:
+                print(f'The table was unlinked when viewer {viewer} exited')
+                return 1
+            reattached.close()
+        print('The table survived every viewer exit')
+        return 0
+    finally:
+        table.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
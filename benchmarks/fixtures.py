@@ -0,0 +1,112 @@
+"""
+Synthetic inputs for the benchmark suite, shaped like the payloads the Schwab streamer and price history endpoint
+send. Quotes come from the mock server's SyntheticMarket and every fixture is seeded, so two runs on the same
+commit measure the same bytes
+"""
+import random
+import sys
+import os
+import json
+
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+
+import websockets
+from candles import CandleFrame
+from data_streamer import SERVICE_SCHEMAS
+from mock_schwab import SyntheticMarket
+
+START_MS = 1718028000000
+FRAME_SPACING_MS = 100
+
+
+def symbols(count: int) -> list:
+    return [f'SYM{i}' for i in range(count)]
+
+
+def equities_message(symbol_count: int, full: bool = True, seed: int = 0, now_ms: int = START_MS) -> dict:
+    """
+    Returns a decoded LEVELONE_EQUITIES data message with one quote per symbol. full quotes carry every field, as in
+    the first update after a subscription, later updates only the fields that change on every tick
+    """
+    random.seed(seed)
+    market = SyntheticMarket()
+    keys = list(SERVICE_SCHEMAS['LEVELONE_EQUITIES'].keys)
+    content = [market.quote('LEVELONE_EQUITIES', symbol, keys, full, now_ms) for symbol in symbols(symbol_count)]
+    return {'data': [{'service': 'LEVELONE_EQUITIES', 'timestamp': now_ms, 'command': 'SUBS', 'content': content}]}
+
+
+def stream_frames(frame_count: int, symbols_per_frame: int, symbol_count: int = 500, seed: int = 0) -> list:
+    """
+    Returns encoded frames as the websocket delivers them. Quote frames cycle through symbol_count symbols, the first
+    quote of a symbol is full and later ones only carry the changing fields. Every 50th frame also carries
+    CHART_EQUITY bars and every 100th frame is a heartbeat
+    """
+    random.seed(seed)
+    market = SyntheticMarket()
+    keys = list(SERVICE_SCHEMAS['LEVELONE_EQUITIES'].keys)
+    universe = symbols(symbol_count)
+    seen = set()
+    frames = []
+    for index in range(frame_count):
+        now_ms = START_MS + index * FRAME_SPACING_MS
+        if index % 100 == 99:
+            frames.append(json.dumps({'notify': [{'heartbeat': str(now_ms)}]}))
+            continue
+
+        start = index * symbols_per_frame
+        content = []
+        for offset in range(symbols_per_frame):
+            symbol = universe[(start + offset) % symbol_count]
+            content.append(market.quote('LEVELONE_EQUITIES', symbol, keys, symbol not in seen, now_ms))
+            seen.add(symbol)
+        data = [{'service': 'LEVELONE_EQUITIES', 'timestamp': now_ms, 'command': 'SUBS', 'content': content}]
+        if index % 50 == 49:
+            bars = [market.chart_bar(symbol, index, now_ms) for symbol in universe[:symbols_per_frame]]
+            data.append({'service': 'CHART_EQUITY', 'timestamp': now_ms, 'command': 'SUBS', 'content': bars})
+        frames.append(json.dumps({'data': data}))
+    return frames
+
+
+class FakeWebSocket(object):
+    """
+    Returns prepared frames from recv without any network or pacing and closes the connection after the last one
+    """
+    def __init__(self, frames: list) -> None:
+        self.frames = iter(frames)
+        self.sent = []
+
+    async def recv(self) -> str:
+        for frame in self.frames:
+            return frame
+        raise websockets.exceptions.ConnectionClosed(None, None)
+
+    async def send(self, message: str) -> None:
+        self.sent.append(message)
+
+    async def close(self) -> None:
+        pass
+
+
+def candle_frame(length: int, seed: int = 0, start_ms: int = START_MS) -> CandleFrame:
+    """
+    Returns length minute candles of a random walk, built as columns since the mock's candle list caps out well
+    below a million
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, length)))
+    open_price = np.concatenate(([100.0], close[:-1]))
+    spread = np.abs(rng.normal(0, 0.001, length))
+    return CandleFrame(start_ms + np.arange(length, dtype=np.int64) * 60000, open_price,
+                       np.maximum(open_price, close) * (1 + spread), np.minimum(open_price, close) * (1 - spread),
+                       close, rng.integers(1000, 100000, length).astype(np.float64))
+
+
+def chart_quote(price: float, now_ms: int = START_MS) -> list:
+    """
+    Returns a parsed LEVELONE_EQUITIES message for one symbol carrying the fields the chart subscribes to
+    """
+    return ['Equities', {'Symbol': 'SYM0', 'Last Price': price, 'Last Size': 100, 'Total Volume': 1000000,
+                         'Quote Time in Long': now_ms, 'Trade Time in Long': now_ms}]
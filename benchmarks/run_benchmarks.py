@@ -0,0 +1,278 @@
+"""
+Benchmark suite for the ingest, parse and render hot paths. Every case is timed with timeit over enough calls to
+last about 0.2s, repeated, and the best and median time per call are written to results/<time>-<commit>.json.
+Comparing a run against a saved baseline prints the change of every case and exits with status 1 when one got
+slower than the threshold, so a regression shows up as a number before it shows up as a complaint.
+
+Run from this directory with:
+    python run_benchmarks.py                     run everything and store the results
+    python run_benchmarks.py -k parse            only the cases whose name contains 'parse'
+    python run_benchmarks.py --save-baseline     also make this run the baseline later runs are compared against
+    python run_benchmarks.py --compare FILE      compare against FILE instead of results/baseline.json
+
+The update_plot and render_plot cases need PyQt6 and the other gui dependencies and are skipped without them
+"""
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+import contextlib
+import statistics
+import subprocess
+import platform
+import argparse
+import asyncio
+import tempfile
+import shutil
+import timeit
+import json
+import sys
+import os
+import io
+
+import numpy as np
+
+import fixtures
+from fixtures import SRC
+
+from data_streamer import Streamer, parse_equities_data
+from tick_queue import TickQueue
+from tickers import TickerUniverse
+from watchlist_table import WatchlistTable
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+BASELINE = os.path.join(RESULTS_DIR, 'baseline.json')
+TICKER_FILE = os.path.join(SRC, '..', 'data', 'tickers.json')
+
+SYMBOLS_PER_FRAME = (1, 100, 1000)
+STREAM_FRAMES = 1000
+SERIES_LENGTHS = (10000, 100000, 1000000)
+
+
+class Case(object):
+    """
+    One benchmark: func is called with no arguments and handles items (symbols, frames, points) per call
+    """
+    def __init__(self, name: str, func: Callable[[], object], items: int = 1, unit: str = 'call') -> None:
+        self.name = name
+        self.func = func
+        self.items = items
+        self.unit = unit
+
+
+def run_sync(coroutine) -> None:
+    """
+    Runs a coroutine that never suspends without the cost of an event loop
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        return
+    coroutine.close()
+    raise RuntimeError('coroutine suspended, it needs an event loop')
+
+
+def parse_cases() -> Iterator[Case]:
+    for symbol_count in SYMBOLS_PER_FRAME:
+        message = fixtures.equities_message(symbol_count)
+        for output in ('dict', 'records', 'columns'):
+            yield Case(f'parse_equities_data[{output},{symbol_count}]',
+                       lambda message=message, output=output: parse_equities_data(message, output),
+                       symbol_count, 'symbol')
+
+
+def handle_message_cases() -> Iterator[Case]:
+    """
+    Frames go through the whole listener: recv from a fake websocket, heartbeat filtering, decoding, routing,
+    parsing, metrics and a conflating TickQueue put
+    """
+    for symbols_per_frame in SYMBOLS_PER_FRAME[:2]:
+        frames = fixtures.stream_frames(STREAM_FRAMES, symbols_per_frame)
+
+        def listen(frames=frames) -> None:
+            streamer = Streamer('benchmark')
+            streamer.set_data_queue(TickQueue(policy='conflate'))
+            streamer.set_data_queue(TickQueue(policy='conflate'), 'CHART_EQUITY')
+            streamer.websocket = fixtures.FakeWebSocket(frames)
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(streamer.start_message_listener())
+
+        yield Case(f'handle_message[{symbols_per_frame} symbols/frame]', listen, STREAM_FRAMES, 'frame')
+
+
+def ticker_cases() -> Iterator[Case]:
+    """
+    ticker_list and validate_stock_data in gui.py are thin wrappers over the TickerUniverse calls timed here
+    """
+    workdir = tempfile.mkdtemp()
+    ticker_file = os.path.join(workdir, 'tickers.json')
+    shutil.copyfile(TICKER_FILE, ticker_file)
+
+    def cold_load() -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(workdir, 'tickers.cache'))
+        TickerUniverse(ticker_file).load()
+
+    def cached_load() -> None:
+        TickerUniverse(ticker_file).load()
+
+    universe = TickerUniverse(ticker_file)
+    universe.load()
+    yield Case('ticker_load[cold]', cold_load)
+    cached_load()
+    yield Case('ticker_load[cached]', cached_load)
+    yield Case('ticker_list', lambda: list(universe.symbols), len(universe), 'symbol')
+    yield Case('validate_stock_data[hit]', lambda: 'AAPL' in universe)
+    yield Case('validate_stock_data[miss]', lambda: 'NOTATICKER' in universe)
+    yield Case('ticker_complete[A]', lambda: universe.complete('A'))
+
+
+def watchlist_cases() -> Iterator[Case]:
+    """
+    Applying a parsed LEVELONE_EQUITIES message to the watchlist's WatchlistTable and collecting the changed row
+    ranges, the per message and per render tick work of a watchlist of that many rows
+    """
+    for symbol_count in SYMBOLS_PER_FRAME[1:]:
+        message = parse_equities_data(fixtures.equities_message(symbol_count))
+        table = WatchlistTable(('Last Price', 'Net Change', 'Net Percent Change', 'Bid Price', 'Ask Price',
+                                'Total Volume', 'High Price', 'Low Price'))
+        for symbol in fixtures.symbols(symbol_count):
+            table.add(symbol)
+
+        def update(table=table, message=message) -> None:
+            table.update(message[1:])
+            table.take_changed(16)
+
+        yield Case(f'watchlist_update[{symbol_count}]', update, symbol_count, 'symbol')
+
+
+def plot_cases() -> Iterator[Case]:
+    """
+    update_plot and render_plot on a MainWindow whose series holds 10k to 1M points. Streaming update_plot handles
+    one quote and render_plot is the per-frame cost the render scheduler pays for it, historical update_plot loads
+    a whole CandleFrame and renders it once
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt6 import QtWidgets
+        import gui
+    except ImportError as error:
+        print(f'Skipping update_plot and render_plot: {error}')
+        return
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    for length in SERIES_LENGTHS:
+        candles = fixtures.candle_frame(length)
+        window = gui.MainWindow(max_data_points=length)
+        window.render_scheduler.stop()
+        window.show_candles('SYM0')
+        run_sync(window.update_plot(candles, False))
+        prices = iter(np.tile(candles.close[-1000:], 1000).tolist())
+
+        def stream_tick(window=window, prices=prices) -> None:
+            run_sync(window.update_plot(fixtures.chart_quote(next(prices)), True))
+
+        def load_history(window=window, candles=candles) -> None:
+            run_sync(window.update_plot(candles, False))
+            window.render_plot()
+
+        yield Case(f'update_plot[streaming,{length}]', stream_tick)
+        yield Case(f'render_plot[{length}]', window.render_plot, length, 'point')
+        yield Case(f'update_plot[historical,{length}]', load_history, length, 'point')
+    app.processEvents()
+
+
+GROUPS = (parse_cases, handle_message_cases, ticker_cases, watchlist_cases, plot_cases)
+
+
+def measure(case: Case, repeat: int) -> dict:
+    timer = timeit.Timer(case.func)
+    number, _ = timer.autorange()
+    per_call = [total / number for total in timer.repeat(repeat, number)]
+    return {'best': min(per_call), 'median': statistics.median(per_call), 'number': number, 'repeat': repeat,
+            'items': case.items, 'unit': case.unit}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=SRC).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit or 'unknown', 'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'numpy': np.__version__, 'decoder': Streamer('benchmark').decoder_name}
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Prints the change in best time of every case the baseline also has and returns the names of those that got
+    slower by more than threshold
+    """
+    regressions = []
+    print(f"\nCompared with {baseline['environment']['commit']} ({baseline['environment']['time']})")
+    for name, result in results['cases'].items():
+        previous = baseline['cases'].get(name)
+        if previous is None:
+            continue
+        ratio = result['best'] / previous['best']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'    {name:<44}{format_time(previous["best"]):>12} -> {format_time(result["best"]):>12}'
+              f'{(ratio - 1) * 100:>+9.1f}%{flag}')
+    return regressions
+
+
+def main(pattern: Optional[str], repeat: int, compare_path: Optional[str], save_baseline: bool,
+         threshold: float) -> int:
+    os.chdir(SRC)
+    results = {'environment': environment(), 'cases': {}}
+    print(f"{'case':<44}{'best':>12}{'median':>12}{'per item':>16}")
+    for group in GROUPS:
+        for case in group():
+            if pattern and pattern not in case.name:
+                continue
+            result = measure(case, repeat)
+            results['cases'][case.name] = result
+            per_item = f'{format_time(result["best"] / case.items)}/{case.unit}' if case.items > 1 else ''
+            print(f'{case.name:<44}{format_time(result["best"]):>12}{format_time(result["median"]):>12}'
+                  f'{per_item:>16}', flush=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{results['environment']['commit']}.json")
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {path}')
+
+    regressions = []
+    compare_path = compare_path or (BASELINE if os.path.exists(BASELINE) else None)
+    if compare_path is not None:
+        with open(compare_path) as f:
+            regressions = compare(results, json.load(f), threshold)
+    if save_baseline:
+        shutil.copyfile(path, BASELINE)
+        print(f'Saved as the baseline {BASELINE}')
+    if regressions:
+        print(f'{len(regressions)} case(s) slower than {threshold:.2f}x the baseline')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the ingest, parse and render hot paths')
+    parser.add_argument('-k', dest='pattern', help='only run cases whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repeats per case, the best one is kept')
+    parser.add_argument('--compare', metavar='FILE', help='results file to compare against, default the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio against the baseline reported as a regression')
+    args = parser.parse_args()
+    sys.exit(main(args.pattern, args.repeat, args.compare, args.save_baseline, args.threshold))
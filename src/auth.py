@@ -1,19 +1,38 @@
 from typing import Optional
-from datetime import datetime, timedelta
 from requests import HTTPError
+from http_client import HTTPClient, AsyncHTTPClient, default_client
+from token_store import TokenStore, parse_created_time, ACCESS_TOKEN_LIFETIME, REFRESH_TOKEN_LIFETIME
 import server
-import threading
+import asyncio
 import time
-import requests
 import base64
-import json
+
+# OAuth error codes of a token response that mean the refresh token is expired or revoked and only a new sign in
+# can get tokens again
+EXPIRED_GRANT_ERRORS = ('invalid_grant', 'refresh_token_authentication_error')
+
 
 class TerminateTaskGroup(Exception):
     pass
 
 
+def is_expired_grant(error: HTTPError) -> bool:
+    """
+    Returns True if a failed token request was rejected because its refresh token is no longer valid
+    """
+    response = error.response
+    if response is None or response.status_code not in (400, 401):
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get('error') in EXPIRED_GRANT_ERRORS
+
+
 class APICredentials(object):
-    def __init__(self, api_key:str, secret_key:str, callback_url:str, authorization_url:str, token_url:str, token_file:str) -> None:
+    def __init__(self, api_key:str, secret_key:str, callback_url:str, authorization_url:str, token_url:str, token_file:str,
+                 client: Optional[HTTPClient] = None) -> None:
         self.appKey = api_key
         self.secretKey = secret_key
         self.callbackUrl = callback_url
@@ -25,112 +44,51 @@ class APICredentials(object):
         self.refreshToken = [None, None]
         self.json = {}
         self.token_file = token_file
+        self.tokens = TokenStore(token_file)
+        self.client = client if client is not None else default_client()
 
     def write_token_data(self) -> None:
         """
-        Writes access and refresh token data to a .json file with the token information and timestamp
+        Writes access and refresh token data to the token file with the token information and timestamp. The file is
+        replaced atomically under a file lock
         """
-        try:
-            with open(self.token_file, 'r+') as f:
-                data = f.read()
-                if data == '':
-                    raise ValueError
-                data = json.loads(data)
-
-                data["access_token"] = self.accessToken[0]
-                data["time_access_token_created"] = self.accessToken[1]
-                data["refresh_token"] = self.refreshToken[0]
-                data["time_refresh_token_created"] = self.refreshToken[1]
-
-                f.seek(0)
-                f.write(json.dumps(data))
-                f.truncate()
-
-        except FileNotFoundError:
-            print("File does not exist")
-
-        except ValueError:
-            print("File is empty")
+        self.tokens.flush()
 
     def load_token_data(self) -> Optional[dict]:
         """
-        Opens a json file and returns the data in dict format
+        Loads the token file into the token store and returns the data in dict format
         """
-        try:
-            with open(self.token_file) as f:
-                data = f.read()
-                data = json.loads(data)
-                return data
-        except FileNotFoundError:
+        if not self.tokens.load():
             return None
+        return self.tokens.as_dict()
+
+    def sync_tokens_from_store(self) -> None:
+        """
+        Copies the tokens held by the token store into accessToken and refreshToken
+        """
+        stored = self.tokens.as_dict()
+        self.accessToken = [stored['access_token'], stored['time_access_token_created']]
+        self.refreshToken = [stored['refresh_token'], stored['time_refresh_token_created']]
 
     @staticmethod
     def check_for_valid_refresh_token(token_data: Optional[dict]) -> bool:
         """
         Takes token_data determines if the refresh token is valid
         """
-        if token_data and token_data['refresh_token'] and token_data['time_refresh_token_created']:
-            current_time = datetime.now()
-            token_time = token_data['time_refresh_token_created'][:16]
-            token_time = datetime.strptime(token_time, "%Y-%m-%d %H:%M")
-            delta = current_time - token_time
-            d = timedelta(days=7)
-            if delta < d:
-                return True
-            else:
-                return False
-        else:
-            return False
+        if token_data and token_data['refresh_token']:
+            created = parse_created_time(token_data, 'refresh_token_created_at', 'time_refresh_token_created')
+            return created is not None and time.time() - created < REFRESH_TOKEN_LIFETIME
+        return False
 
     @staticmethod
     def check_for_valid_access_token(token_data: Optional[dict]) -> bool:
         """
         Takes token_data and determines if the access token is greater than 30 minutes old
         """
-        if token_data and token_data['access_token'] and token_data["time_access_token_created"]:
-            current_time = datetime.now()
-            token_time = token_data['time_access_token_created'][:16]
-            token_time = datetime.strptime(token_time, "%Y-%m-%d %H:%M")
-            delta = current_time - token_time
-            d = timedelta(minutes = 30)
-            if delta < d:
-                return True
-            else:
-                return False
-        else:
-            return False
-
-    def get_valid_token(self) -> None:
-        """
-        If refresh token is valid then assigns class variables
-        If token is not valid then starts process of acquiring new tokens
-        """
-        data = self.load_token_data()
-        if self.check_for_valid_refresh_token(data):
-            self.refreshToken[0] = data['refresh_token']
-            self.refreshToken[1] = data['time_refresh_token_created']
-            if self.check_for_valid_access_token(data):
-                self.accessToken[0] = data['access_token']
-                self.accessToken[1] = data['time_access_token_created']
-            else:
-                date_time = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
-                self.use_refresh_token()
-        else:
-            self.get_json(self.get_auth_code())
-            self.accessToken = self.get_access_token()
-            self.refreshToken = self.get_refresh_token()
-
-    def get_auth_code(self) -> str:
-        """
-        Takes the query returned from authentication server and parses it to return authentication code
-        """
-        print(self.authUrl)
-        threading.Thread(target=server.run_server, daemon=True).start()
-        while self.authCode == '':
-            if server.codes:
-                self.authCode = server.codes[-1]
-                return self.authCode
-            time.sleep(3)
+        if token_data and token_data['access_token']:
+            created = parse_created_time(token_data, 'access_token_created_at', 'time_access_token_created')
+            return created is not None and time.time() - created < ACCESS_TOKEN_LIFETIME
+        return False
 
     def encode_credentials(self) -> str:
         """
@@ -154,7 +112,7 @@ class APICredentials(object):
             "Content-Type": "application/x-www-form-urlencoded",
             "Authorization": f"Basic {self.encode_credentials()}"
         }
-        response = requests.post(self.tokenUrl, data=data, headers=headers)
+        response = self.client.post(self.tokenUrl, data=data, headers=headers)
         if response.status_code == 200:
             self.json = response.json()
             return self.json
@@ -166,18 +124,16 @@ class APICredentials(object):
         """
         Parses a json object to return access token
         """
-        self.accessToken[0] = self.json['access_token']
-        date_time = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
-        self.accessToken[1] = date_time
+        self.tokens.set_access_token(self.json['access_token'])
+        self.sync_tokens_from_store()
         return self.accessToken
 
     def get_refresh_token(self) -> list:
         """
         Parses a json object to return refresh token
         """
-        self.refreshToken[0] = self.json['refresh_token']
-        date_time = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
-        self.refreshToken[1] = date_time
+        self.tokens.set_refresh_token(self.json['refresh_token'])
+        self.sync_tokens_from_store()
         return self.refreshToken
 
     def use_refresh_token(self) -> list:
@@ -195,7 +151,7 @@ class APICredentials(object):
             "Authorization": f"Basic {self.encodedCredentials}"
         }
 
-        response = requests.post(self.tokenUrl, data = request_data, headers = headers)
+        response = self.client.post(self.tokenUrl, data = request_data, headers = headers)
 
         try:
             response.raise_for_status()
@@ -205,8 +161,204 @@ class APICredentials(object):
             #Need to call authcode
             raise
         data = response.json()
-        self.accessToken[0] = data["access_token"]
-        date_time = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M")
-        self.accessToken[1] = date_time
+        self.tokens.set_access_token(data["access_token"])
+        self.sync_tokens_from_store()
         return self.accessToken
 
+
+
+class CredentialManager(object):
+    """
+    Asyncio-native front end for APICredentials. The OAuth callback wakes it through an asyncio.Event instead of
+    polling, token requests go through the async HTTP client and the access token is refreshed in the background
+    before it expires and pushed to every subscribed consumer
+    """
+    def __init__(self, credentials: APICredentials, client: Optional[AsyncHTTPClient] = None,
+                 access_token_lifetime: float = 1800, refresh_margin: float = 300) -> None:
+        self.credentials = credentials
+        self.client = client if client is not None else AsyncHTTPClient()
+        self.access_token_lifetime = access_token_lifetime
+        self.refresh_margin = refresh_margin
+        self.access_token_expires_at = 0.0
+        self.consumers = []
+        self.refresh_task = None
+        self.loop = None
+        credentials.tokens.add_listener(self.on_tokens_adopted)
+
+    @property
+    def access_token(self) -> Optional[str]:
+        return self.credentials.accessToken[0]
+
+    def subscribe(self, consumer) -> None:
+        """
+        Registers an object with an update_access_token(token) method, such as Streamer or PriceHistory, to receive
+        every refreshed access token
+        """
+        self.consumers.append(consumer)
+
+    def unsubscribe(self, consumer) -> None:
+        if consumer in self.consumers:
+            self.consumers.remove(consumer)
+
+    def on_tokens_adopted(self, access_token: str) -> None:
+        """
+        TokenStore listener for a token refreshed by another process sharing the token file. The token store may
+        call it from its save thread, so the consumers are updated on the event loop
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not self.loop:
+                self.loop.call_soon_threadsafe(self.adopt_stored_tokens)
+                return
+        self.adopt_stored_tokens()
+
+    def adopt_stored_tokens(self) -> None:
+        """
+        Takes over the tokens held by the token store and pushes the access token to every consumer, as a local
+        refresh does
+        """
+        tokens = self.credentials.tokens
+        self.credentials.sync_tokens_from_store()
+        self.access_token_expires_at = tokens.access_token_expires_at()
+        self.notify_consumers()
+
+    async def wait_for_auth_code(self) -> str:
+        """
+        Starts the callback server and waits until it receives the authentication code
+        """
+        loop = asyncio.get_running_loop()
+        received = asyncio.Event()
+        received_codes = []
+
+        def on_code(code: str) -> None:
+            received_codes.append(code)
+            loop.call_soon_threadsafe(received.set)
+
+        server.add_code_listener(on_code)
+        try:
+            print(self.credentials.authUrl)
+            server.start_server()
+            await received.wait()
+        finally:
+            server.remove_code_listener(on_code)
+
+        self.credentials.authCode = received_codes[-1]
+        return self.credentials.authCode
+
+    async def post_token_request(self, request_data: dict) -> dict:
+        """
+        Posts request_data to the token endpoint and returns the json response
+        """
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Authorization": f"Basic {self.credentials.encode_credentials()}"
+        }
+        response = await self.client.post(self.credentials.tokenUrl, data=request_data, headers=headers)
+        if response.status_code != 200:
+            print(f"HTTP Error message: {response.text}  Status code: {response.status_code}")
+            raise HTTPError(f'Token request failed with status {response.status_code}', response=response)
+        return response.json()
+
+    async def authenticate(self) -> str:
+        """
+        Loads saved tokens or runs the OAuth flow, starts the background refresh and returns the access token
+        """
+        self.loop = asyncio.get_running_loop()
+        tokens = self.credentials.tokens
+        tokens.load()
+        if tokens.refresh_token_valid():
+            if tokens.access_token_valid(margin=self.refresh_margin):
+                self.credentials.sync_tokens_from_store()
+                self.access_token_expires_at = tokens.access_token_expires_at()
+            else:
+                await self.refresh()
+        else:
+            await self.authorize()
+
+        self.credentials.write_token_data()
+        self.start_background_refresh()
+        return self.access_token
+
+    async def authorize(self) -> str:
+        """
+        Runs the OAuth flow: waits for the authentication code from the callback server and exchanges it for a new
+        access and refresh token
+        """
+        auth_code = await self.wait_for_auth_code()
+        self.credentials.json = await self.post_token_request({
+            "grant_type": "authorization_code",
+            "code": auth_code,
+            "redirect_uri": self.credentials.callbackUrl
+        })
+        self.credentials.get_access_token()
+        self.credentials.get_refresh_token()
+        self.access_token_expires_at = time.time() + self.credentials.json.get("expires_in",
+                                                                               self.access_token_lifetime)
+        return self.access_token
+
+    async def reauthorize(self) -> str:
+        """
+        Signs in again after the refresh token expired, saves the new tokens and pushes them to every consumer
+        """
+        print('The refresh token has expired, sign in again to keep streaming')
+        await self.authorize()
+        self.credentials.write_token_data()
+        self.notify_consumers()
+        return self.access_token
+
+    async def refresh(self) -> str:
+        """
+        Uses the refresh token to get a new access token, saves it and pushes it to every consumer. If another
+        process sharing the token file already refreshed it, that token is used instead
+        """
+        tokens = self.credentials.tokens
+        if tokens.reload_if_changed() and tokens.access_token_valid(margin=self.refresh_margin):
+            # a changed access token already reached the consumers through on_tokens_adopted
+            self.credentials.sync_tokens_from_store()
+            self.access_token_expires_at = tokens.access_token_expires_at()
+            return self.access_token
+
+        data = await self.post_token_request({
+            "grant_type": "refresh_token",
+            "refresh_token": self.credentials.refreshToken[0],
+            "redirect_uri": self.credentials.callbackUrl
+        })
+        self.credentials.tokens.set_access_token(data["access_token"])
+        self.credentials.sync_tokens_from_store()
+        self.access_token_expires_at = time.time() + data.get("expires_in", self.access_token_lifetime)
+        self.notify_consumers()
+        return self.access_token
+
+    def notify_consumers(self) -> None:
+        for consumer in self.consumers:
+            consumer.update_access_token(self.access_token)
+
+    def start_background_refresh(self) -> None:
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self.refresh_loop())
+
+    async def refresh_loop(self) -> None:
+        """
+        Refreshes the access token refresh_margin seconds before it expires, retrying every 30 seconds on failure.
+        Every failure is logged and retried, so a network or server error never ends the task. When the refresh token
+        itself has expired, retrying cannot help and the OAuth flow is run again instead
+        """
+        grant_expired = False
+        while True:
+            delay = self.access_token_expires_at - self.refresh_margin - time.time()
+            await asyncio.sleep(max(0.0, delay))
+            try:
+                if grant_expired or not self.credentials.tokens.refresh_token_valid():
+                    await self.reauthorize()
+                    grant_expired = False
+                else:
+                    await self.refresh()
+            except Exception as e:
+                if isinstance(e, HTTPError) and is_expired_grant(e):
+                    grant_expired = True
+                    continue
+                print(f"Failed to refresh access token: {e!r}")
+                await asyncio.sleep(30)
@@ -0,0 +1,233 @@
+from typing import Iterable, Optional
+from candles import CandleFrame
+from series import RingBuffer
+
+"""Builds rolling OHLCV bars from CHART_EQUITY bars and LEVELONE last trade ticks"""
+
+DEFAULT_INTERVALS = (60, 300, 900, 3600)
+
+
+def combine(first: Optional[list], second: list) -> list:
+    """
+    Combines two [open, high, low, close, volume] bars, first being the earlier one
+    """
+    if first is None:
+        return list(second)
+    return [first[0], max(first[1], second[1]), min(first[2], second[2]), second[3], first[4] + second[4]]
+
+
+class BarAggregator(object):
+    """
+    Keeps one RingBuffer of bars per interval (in seconds) for a single symbol, keyed by the exchange timestamp
+    rounded down to the interval.
+
+    Every update lands in a one minute bar. Trades extend the minute they fall in and CHART_EQUITY bars replace their
+    minute with the exchange's authoritative values; chart bars whose Sequence is not newer than the last one applied
+    are dropped as duplicates. The minutes of the current bucket of every interval, other than the minute being
+    traded, are cached as one combined bar, so a trade updates each interval's last bar in constant time.
+
+    LEVELONE quotes only carry the fields that changed, so the last price, trade time and total volume are kept
+    between quotes. Once a Total Volume has been seen, trade volume is the increase of Total Volume rather than Last
+    Size, which also counts trades merged into a single quote
+    """
+    def __init__(self, intervals: Iterable[int] = DEFAULT_INTERVALS, capacity: int = 10000) -> None:
+        self.intervals = tuple(sorted(intervals))
+        self.series = {interval: RingBuffer(capacity) for interval in self.intervals}
+        self.minutes = {}
+        self.current_minute = None
+        self.rest = {}
+        self.last_sequence = None
+        self.last_price = None
+        self.last_trade_time = None
+        self.last_total_volume = None
+        self.duplicates = 0
+        self.late_trades = 0
+
+    def add_trade(self, trade_time_ms: int, price: float, size: float = 0.0) -> None:
+        """
+        Adds a last trade tick
+        """
+        minute = trade_time_ms // 60000 * 60
+        bar = self.minutes.get(minute)
+        if bar is None:
+            if self.current_minute is not None and minute < self.current_minute:
+                self.late_trades += 1
+                return
+            self.minutes[minute] = [price, price, price, price, size]
+        else:
+            if price > bar[1]:
+                bar[1] = price
+            if price < bar[2]:
+                bar[2] = price
+            bar[3] = price
+            bar[4] += size
+        self.touch(minute)
+
+    def add_chart_bar(self, sequence: int, chart_time_ms: int, open_price: float, high: float, low: float,
+                      close: float, volume: float) -> bool:
+        """
+        Adds a CHART_EQUITY minute bar. Returns False if it was a duplicate
+        """
+        if self.last_sequence is not None and sequence <= self.last_sequence:
+            self.duplicates += 1
+            return False
+        self.last_sequence = sequence
+
+        minute = chart_time_ms // 60000 * 60
+        self.minutes[minute] = [open_price, high, low, close, volume]
+        self.touch(minute)
+        return True
+
+    def add_minute_candles(self, candles: CandleFrame) -> None:
+        """
+        Adds one minute price history candles, such as the ones fetched to fill the gap left by a stream disconnect.
+        Like CHART_EQUITY bars they replace the minutes they cover. The volume of the gap is in the candles, so the
+        next Total Volume starts a new baseline instead of being counted again
+        """
+        rows = zip(candles.time.tolist(), candles.open.tolist(), candles.high.tolist(), candles.low.tolist(),
+                   candles.close.tolist(), candles.volume.tolist())
+        for time_ms, open_price, high, low, close, volume in rows:
+            minute = int(time_ms) // 60000 * 60
+            self.minutes[minute] = [open_price, high, low, close, volume]
+            self.touch(minute)
+        if len(candles):
+            self.last_price = float(candles.close[-1])
+            self.last_total_volume = None
+
+    def add_level_one_quote(self, quote: dict) -> None:
+        """
+        Adds the last trade of a parsed LEVELONE_EQUITIES quote. A trade at an unchanged price arrives without Last
+        Price, so any advance of Trade Time in Long, Last Size or Total Volume counts as a trade at the last known
+        price
+        """
+        price = quote.get('Last Price')
+        trade_time = quote.get('Trade Time in Long')
+        size = quote.get('Last Size')
+        total_volume = quote.get('Total Volume')
+
+        traded = price is not None or size is not None
+        if trade_time is not None and trade_time != self.last_trade_time:
+            traded = True
+            self.last_trade_time = trade_time
+        if price is not None:
+            self.last_price = price
+
+        if total_volume is not None:
+            if self.last_total_volume is None:
+                volume = size or 0.0
+            else:
+                volume = max(0.0, total_volume - self.last_total_volume)
+                traded = traded or volume > 0
+            self.last_total_volume = total_volume
+        elif self.last_total_volume is None:
+            volume = size or 0.0
+        else:
+            volume = 0.0
+
+        if traded and self.last_price is not None and self.last_trade_time is not None:
+            self.add_trade(self.last_trade_time, self.last_price, volume)
+
+    def add_chart_quote(self, quote: dict) -> bool:
+        """
+        Adds a parsed CHART_EQUITY quote
+        """
+        return self.add_chart_bar(quote['Sequence'], quote['Chart Time'], quote['Open Price'], quote['High Price'],
+                                  quote['Low Price'], quote['Close Price'], quote['Volume'])
+
+    def touch(self, minute: int) -> None:
+        """
+        Rewrites the bar containing minute in every interval
+        """
+        if self.current_minute is None or minute > self.current_minute:
+            self.current_minute = minute
+            self.rest = {}
+            self.prune()
+        elif minute < self.current_minute:
+            self.rest = {}
+
+        for interval in self.intervals:
+            bucket = minute - minute % interval
+            if minute == self.current_minute:
+                bar = combine(self.rest_of_bucket(interval, bucket), self.minutes[minute])
+            else:
+                bar = self.aggregate(bucket, interval)
+            self.write(interval, bucket, bar)
+
+    def rest_of_bucket(self, interval: int, bucket: int) -> Optional[list]:
+        """
+        Returns the combined bar of the minutes in bucket before the current minute, computing it once per minute
+        """
+        if interval not in self.rest:
+            bar = None
+            for minute in range(bucket, self.current_minute, 60):
+                minute_bar = self.minutes.get(minute)
+                if minute_bar is not None:
+                    bar = combine(bar, minute_bar)
+            self.rest[interval] = bar
+        return self.rest[interval]
+
+    def aggregate(self, bucket: int, interval: int) -> list:
+        bar = None
+        for minute in range(bucket, bucket + interval, 60):
+            minute_bar = self.minutes.get(minute)
+            if minute_bar is not None:
+                bar = combine(bar, minute_bar)
+        return bar
+
+    def write(self, interval: int, bucket: int, bar: list) -> None:
+        series = self.series[interval]
+        last_time = series.last_time()
+        if last_time is None or bucket > last_time:
+            series.append(bucket, bar[0], bar[1], bar[2], bar[3], bar[4])
+        elif bucket == last_time:
+            series.update_last(bar[0], bar[1], bar[2], bar[3], bar[4])
+
+    def prune(self) -> None:
+        """
+        Forgets minutes that are older than the bucket of the longest interval
+        """
+        longest = self.intervals[-1]
+        oldest = self.current_minute - self.current_minute % longest
+        for minute in [minute for minute in self.minutes if minute < oldest]:
+            del self.minutes[minute]
+
+
+class BarEngine(object):
+    """
+    Routes parsed LEVELONE_EQUITIES and CHART_EQUITY messages to one BarAggregator per symbol
+    """
+    def __init__(self, intervals: Iterable[int] = DEFAULT_INTERVALS, capacity: int = 10000) -> None:
+        self.intervals = tuple(intervals)
+        self.capacity = capacity
+        self.aggregators = {}
+
+    def aggregator(self, symbol: str) -> BarAggregator:
+        aggregator = self.aggregators.get(symbol)
+        if aggregator is None:
+            aggregator = BarAggregator(self.intervals, self.capacity)
+            self.aggregators[symbol] = aggregator
+        return aggregator
+
+    def on_message(self, parsed_message: list) -> None:
+        label = parsed_message[0]
+        if label == 'Equities':
+            for quote in parsed_message[1:]:
+                self.aggregator(quote['Symbol']).add_level_one_quote(quote)
+        elif label == 'Equity Chart':
+            for quote in parsed_message[1:]:
+                self.aggregator(quote['Symbol']).add_chart_quote(quote)
+
+
+class BarFeed(object):
+    """
+    Stands in for a Streamer data queue and hands every parsed message to a BarEngine before passing it on to queue.
+    Bars have to see each trade, so they are built here in the listener rather than behind a conflating queue that
+    merges the trades between two reads into one quote
+    """
+    def __init__(self, engine: BarEngine, queue) -> None:
+        self.engine = engine
+        self.queue = queue
+
+    async def put(self, parsed_message: list) -> None:
+        self.engine.on_message(parsed_message)
+        await self.queue.put(parsed_message)
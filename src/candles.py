@@ -0,0 +1,131 @@
+from operator import itemgetter
+from typing import Iterable, Optional, Union
+import numpy as np
+
+"""Columnar OHLCV candles backed by contiguous NumPy arrays"""
+
+CANDLE_DTYPE = np.dtype([
+    ('datetime', np.int64),
+    ('open', np.float64),
+    ('high', np.float64),
+    ('low', np.float64),
+    ('close', np.float64),
+    ('volume', np.float64),
+])
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+candle_values = itemgetter(*CANDLE_DTYPE.names)
+
+
+class CandleFrame(object):
+    """
+    Candles stored as one int64 array of epoch millisecond times and one float64 array per OHLCV column, sorted by
+    time. Slicing returns views of the same arrays and resampling and concatenation work on whole columns, so no
+    operation loops over candles in Python
+    """
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, time: np.ndarray, open_price: np.ndarray, high: np.ndarray, low: np.ndarray,
+                 close: np.ndarray, volume: np.ndarray) -> None:
+        self.time = time
+        self.open = open_price
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def empty(cls) -> 'CandleFrame':
+        return cls(np.empty(0, dtype=np.int64), *(np.empty(0) for _ in PRICE_COLUMNS))
+
+    @classmethod
+    def from_candles(cls, candles: list) -> 'CandleFrame':
+        """
+        Builds a frame from the candle dicts of a pricehistory response in a single pass over the list
+        """
+        rows = np.fromiter(map(candle_values, candles), dtype=CANDLE_DTYPE, count=len(candles))
+        return cls.from_records(rows)
+
+    @classmethod
+    def from_response(cls, response: dict) -> 'CandleFrame':
+        return cls.from_candles(response.get('candles', []))
+
+    @classmethod
+    def from_records(cls, rows: np.ndarray) -> 'CandleFrame':
+        """
+        Splits a CANDLE_DTYPE record array into contiguous columns
+        """
+        return cls(np.ascontiguousarray(rows['datetime']),
+                   *(np.ascontiguousarray(rows[name]) for name in PRICE_COLUMNS))
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'CandleFrame':
+        """
+        Selects candles by slice, index array or boolean mask. Slices are views of this frame's arrays
+        """
+        return CandleFrame(*(column[index] for column in self.columns()))
+
+    def __repr__(self) -> str:
+        return f'CandleFrame({len(self)} candles)'
+
+    def columns(self) -> tuple:
+        return self.time, self.open, self.high, self.low, self.close, self.volume
+
+    def seconds(self) -> np.ndarray:
+        """
+        Returns the candle times in epoch seconds, as used by the chart
+        """
+        return self.time / 1000
+
+    def between(self, start_ms: Optional[int] = None, end_ms: Optional[int] = None) -> 'CandleFrame':
+        """
+        Returns the candles with start_ms <= time < end_ms as a view
+        """
+        start = 0 if start_ms is None else np.searchsorted(self.time, start_ms, side='left')
+        end = len(self) if end_ms is None else np.searchsorted(self.time, end_ms, side='left')
+        return self[start:end]
+
+    def resample(self, interval_ms: int) -> 'CandleFrame':
+        """
+        Combines the candles into bars of interval_ms, each starting at a multiple of the interval
+        """
+        if len(self) == 0:
+            return CandleFrame.empty()
+        buckets = self.time - self.time % interval_ms
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        ends = np.append(starts[1:], len(self)) - 1
+        return CandleFrame(buckets[starts], self.open[starts], np.maximum.reduceat(self.high, starts),
+                           np.minimum.reduceat(self.low, starts), self.close[ends],
+                           np.add.reduceat(self.volume, starts))
+
+    @staticmethod
+    def concat(frames: Iterable['CandleFrame']) -> 'CandleFrame':
+        """
+        Joins frames into one sorted frame. When several frames have a candle at the same time the one from the
+        later frame is kept
+        """
+        frames = [frame for frame in frames if len(frame)]
+        if not frames:
+            return CandleFrame.empty()
+        columns = [np.concatenate(column) for column in zip(*(frame.columns() for frame in frames))]
+        time = columns[0]
+        if np.all(time[1:] > time[:-1]):
+            return CandleFrame(*columns)
+
+        # Sorting the reversed arrays stably puts the latest copy of a duplicated time first, which unique keeps
+        reversed_time = time[::-1]
+        order = np.argsort(reversed_time, kind='stable')
+        _, first = np.unique(reversed_time[order], return_index=True)
+        keep = order[first]
+        return CandleFrame(*(column[::-1][keep] for column in columns))
+
+    def to_candles(self) -> list:
+        """
+        Returns the candles as pricehistory style dicts
+        """
+        rows = zip(*(column.tolist() for column in self.columns()))
+        return [{'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume, 'datetime': time}
+                for time, open_price, high, low, close, volume in rows]
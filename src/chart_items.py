@@ -0,0 +1,131 @@
+from PyQt6 import QtCore, QtGui
+import pyqtgraph as pg
+import numpy as np
+from typing import Sequence
+from series import RingBuffer
+
+"""Custom pyqtgraph items for the price chart"""
+
+
+class CandlestickItem(pg.GraphicsObject):
+    """
+    Draws the bars of a RingBuffer as candlesticks. Completed bars are recorded once into a QPicture that is only
+    rebuilt when a new bar starts, and the forming bar is drawn live on every paint, so a tick only costs redrawing
+    the last candle
+    """
+    def __init__(self, series: RingBuffer, interval: float, up_color: str = 'g', down_color: str = 'r') -> None:
+        super().__init__()
+        self.series = series
+        self.interval = interval
+        self.width = interval * 0.8
+        self.up_pen = pg.mkPen(up_color)
+        self.up_brush = pg.mkBrush(up_color)
+        self.down_pen = pg.mkPen(down_color)
+        self.down_brush = pg.mkBrush(down_color)
+        self.history_picture = QtGui.QPicture()
+        self.history_count = 0
+        self.history_first_time = None
+        self.history_low = np.inf
+        self.history_high = -np.inf
+        self.bounds = QtCore.QRectF()
+
+    def draw_bar(self, painter: QtGui.QPainter, timestamp: float, open_price: float, high: float, low: float,
+                 close: float) -> None:
+        center = timestamp + self.interval / 2
+        if close >= open_price:
+            painter.setPen(self.up_pen)
+            painter.setBrush(self.up_brush)
+        else:
+            painter.setPen(self.down_pen)
+            painter.setBrush(self.down_brush)
+        painter.drawLine(QtCore.QPointF(center, low), QtCore.QPointF(center, high))
+        painter.drawRect(QtCore.QRectF(center - self.width / 2, open_price, self.width, close - open_price))
+
+    def rebuild_history(self, count: int) -> None:
+        """
+        Records every bar except the forming one into the history picture
+        """
+        times = self.series.times()[:count]
+        opens = self.series.column('open')[:count]
+        highs = self.series.column('high')[:count]
+        lows = self.series.column('low')[:count]
+        closes = self.series.column('close')[:count]
+
+        self.history_picture = QtGui.QPicture()
+        painter = QtGui.QPainter(self.history_picture)
+        for bar in zip(times.tolist(), opens.tolist(), highs.tolist(), lows.tolist(), closes.tolist()):
+            self.draw_bar(painter, *bar)
+        painter.end()
+
+        self.history_count = count
+        self.history_first_time = times[0] if count else None
+        self.history_low = lows.min() if count else np.inf
+        self.history_high = highs.max() if count else -np.inf
+
+    def refresh(self) -> None:
+        """
+        Picks up changes to the series. Call once per render frame
+        """
+        size = len(self.series)
+        if size == 0:
+            return
+
+        times = self.series.times()
+        completed = size - 1
+        if completed != self.history_count or (completed and times[0] != self.history_first_time):
+            self.rebuild_history(completed)
+
+        low = min(self.history_low, self.series.column('low')[-1])
+        high = max(self.history_high, self.series.column('high')[-1])
+        self.prepareGeometryChange()
+        self.bounds = QtCore.QRectF(times[0], low, times[-1] + self.interval - times[0], high - low)
+        self.update()
+
+    def paint(self, painter: QtGui.QPainter, *args) -> None:
+        painter.drawPicture(0, 0, self.history_picture)
+        if len(self.series):
+            self.draw_bar(painter, self.series.times()[-1], self.series.column('open')[-1],
+                          self.series.column('high')[-1], self.series.column('low')[-1],
+                          self.series.column('close')[-1])
+
+    def boundingRect(self) -> QtCore.QRectF:
+        return self.bounds
+
+
+class IndicatorOverlay(object):
+    """
+    Draws an indicator over the price chart as one curve per output line. The history is computed in one vectorized
+    pass by the indicator's load and every later tick goes through its O(1) update, with the values kept in
+    RingBuffers so redrawing never copies the history
+    """
+    def __init__(self, plot_widget: pg.PlotWidget, indicator: object, pens: Sequence, capacity: int = 10000,
+                 inputs: Sequence[str] = ('close',)) -> None:
+        self.indicator = indicator
+        self.inputs = tuple(inputs)
+        self.lines = [RingBuffer(capacity) for _ in pens]
+        self.curves = [plot_widget.plot([], [], pen=pen, connect='finite') for pen in pens]
+
+    def load(self, series: RingBuffer) -> None:
+        """
+        Recomputes the indicator over every row of series
+        """
+        result = self.indicator.load(*(series.column(name) for name in self.inputs))
+        if len(self.lines) == 1:
+            result = (result,)
+        for line, values in zip(self.lines, result):
+            line.clear()
+            line.extend(series.times(), values)
+
+    def update(self, timestamp: float, *values: float) -> None:
+        """
+        Adds one tick, values being the current values of the input columns
+        """
+        result = self.indicator.update(*values)
+        if len(self.lines) == 1:
+            result = (result,)
+        for line, value in zip(self.lines, result):
+            line.append(timestamp, value)
+
+    def render(self) -> None:
+        for line, curve in zip(self.lines, self.curves):
+            curve.setData(line.times(), line.closes())
@@ -1,20 +1,117 @@
 from datetime import datetime, timezone
+from typing import Optional
 from requests import HTTPError
-import requests
 from websockets.asyncio.client import connect
+from http_client import HTTPClient, base_url, default_client
+from tick_log import ReplayWebSocket, TickRecorder, REPLAY_STREAMER_INFO
+import metrics
 import websockets
+import itertools
+import asyncio
+import random
 import json
+import time
+import re
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+DECODE_SECONDS = metrics.histogram('stream_decode_seconds', 'Time to decode one websocket frame')
+PARSE_SECONDS = metrics.histogram('stream_parse_seconds', 'Time to parse one service entry of a data frame')
+TRANSIT_SECONDS = metrics.histogram('stream_transit_seconds', 'Streamer frame timestamp to local receive time')
+HEARTBEATS = metrics.counter('stream_messages_total', 'Stream messages received per service', service='heartbeat')
+
+# Errors of a dropped or refused connection, from connect, the login exchange or recv. They end the message listener
+# and make run_supervised reconnect with backoff. Failed logins raise ConnectionError, an OSError
+CONNECTION_ERRORS = (websockets.exceptions.WebSocketException, OSError, asyncio.TimeoutError)
+
+FRAME_PREFIXES = (
+    ('{"data"', 'data'),
+    ('{"notify"', 'notify'),
+    ('{"response"', 'response'),
+)
+
+
+def select_decoder(name: Optional[str] = None) -> tuple:
+    """
+    Returns (name, loads) for the fastest installed JSON decoder, or for the decoder named by name.
+    orjson is preferred, then msgspec, then the standard library json module
+    """
+    if name in (None, 'orjson') and orjson is not None:
+        return 'orjson', orjson.loads
+    if name in (None, 'msgspec') and msgspec is not None:
+        return 'msgspec', msgspec.json.decode
+    if name in (None, 'json'):
+        return 'json', json.loads
+    raise ValueError(f'JSON decoder {name} is not available')
+
+
+def classify_frame(message) -> str:
+    """
+    Looks only at the start of a raw websocket frame and returns 'data', 'notify', 'response' or 'unknown'
+    without decoding it
+    """
+    head = message[:16]
+    if not isinstance(head, str):
+        head = bytes(head).decode('ascii', 'ignore')
+    head = head.lstrip().replace(' ', '')
+    for prefix, kind in FRAME_PREFIXES:
+        if head.startswith(prefix):
+            return kind
+    return 'unknown'
+
+
+def is_heartbeat(message) -> bool:
+    """
+    Returns True if a notify frame only carries a heartbeat
+    """
+    if isinstance(message, str):
+        return '"heartbeat"' in message
+    return b'"heartbeat"' in message
 
 
 class Streamer(object):
-    def __init__(self, access_token: str) -> None:
+    def __init__(self, access_token: str, decoder: Optional[str] = None, client: Optional[HTTPClient] = None,
+                 api_base_url: Optional[str] = None) -> None:
             self.access_token = access_token
-            self.url = 'https://api.schwabapi.com/trader/v1/userPreference'
+            self.client = client if client is not None else default_client()
+            self.url = f"{api_base_url or base_url()}/trader/v1/userPreference"
             self.streamer_info = None
             self.websocket = None
             self.message_listener = False
             self.data_queue = None
+            self.decoder_name, self.decode = select_decoder(decoder)
+            self.last_heartbeat = None
+            self.service_queues = {}
+            self.parse_output = 'dict'
+            self.routes = {}
+            self.build_routes()
+            self.request_ids = itertools.count(2)
+            self.supervised = False
+            self.last_message_time = None
+            self.connection_stats = {'reconnects': 0, 'last_reconnect_seconds': None, 'last_gap_seconds': None,
+                                     'total_gap_seconds': 0.0}
+            self.last_request_id = 1
+            self.recorder = None
+            self.service_metrics = {
+                service: (metrics.counter('stream_messages_total', 'Stream messages received per service',
+                                          service=service),
+                          metrics.counter('stream_bytes_total', 'Stream bytes received per service', service=service))
+                for service in SERVICE_SCHEMAS}
+
+    def update_access_token(self, access_token: str) -> None:
+        """
+        Replaces the access token. The open websocket stays logged in and the new token is used for the next login
+        """
+        self.access_token = access_token
 
     def get_streamer_info(self) -> dict:
         """
@@ -25,7 +122,7 @@ class Streamer(object):
             "Authorization": f"Bearer {self.access_token}"
         }
 
-        response = requests.get(self.url, headers = headers)
+        response = self.client.get(self.url, headers = headers)
         try:
             if response.status_code == 200:
                 streamer_info = response.json()
@@ -61,18 +158,43 @@ class Streamer(object):
         login_data = json.dumps(login_request)
 
         websocket = await connect(self.streamer_info['streamerSocketUrl'])
-        await websocket.send(login_data)
-        message = await websocket.recv()
-        message = json.loads(message)
-        code = message["response"][0]["content"]["code"]
-        code_message = message["response"][0]["content"]["msg"]
+        try:
+            await websocket.send(login_data)
+            message = await websocket.recv()
+            message = self.decode(message)
+            code = message["response"][0]["content"]["code"]
+            code_message = message["response"][0]["content"]["msg"]
+        except (KeyError, IndexError, TypeError, ValueError):
+            await websocket.close()
+            print(f'Unexpected reply to the websocket login: {message!r}')
+            raise ConnectionError
+        except BaseException:
+            await websocket.close()
+            raise
 
         if code == 0:
             self.websocket = websocket
         else:
+            await websocket.close()
             print(f'Failed to connect websocket to Schwab, code is {code} and message is {code_message}')
             raise ConnectionError
 
+    def set_recorder(self, recorder: Optional[TickRecorder]) -> None:
+        """
+        Records every received frame with its receive time, or stops recording when recorder is None
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = recorder
+
+    def open_replay(self, path: str, speed: Optional[float] = 1.0) -> None:
+        """
+        Replaces the websocket with frames replayed from a TickRecorder log, so start_message_listener runs the
+        normal parse and queue pipeline without a Schwab session. See ReplayWebSocket for speed
+        """
+        self.streamer_info = dict(REPLAY_STREAMER_INFO)
+        self.websocket = ReplayWebSocket(path, speed)
+
     async def close_stream_connection(self, request_id: int) -> None:
         """
         Closes a stream connection. The request_id will be the last request sent.
@@ -89,6 +211,7 @@ class Streamer(object):
 
         logout_request = json.dumps(logout_request)
 
+        self.supervised = False
         await self.websocket.send(logout_request)
         print("Closing Connection")
         await self.websocket.close()
@@ -102,214 +225,631 @@ class Streamer(object):
         while self.message_listener:
             try:
                 message = await self.websocket.recv()
+                self.last_message_time = time.time()
+                if self.recorder is not None:
+                    self.recorder.record(message, self.last_message_time)
                 await self.handle_message(message)
             except websockets.exceptions.ConnectionClosed:
                 print("Connection Closed")
                 self.message_listener = False
                 break
+            except CONNECTION_ERRORS as e:
+                print(f'Connection lost: {e!r}')
+                self.message_listener = False
+                break
 
-    async def handle_message(self, message:str) -> list:
+    async def run_supervised(self, subscriptions=None, backfill=None, base_delay: float = 1.0,
+                             max_delay: float = 60.0) -> None:
         """
-        This takes a message provided by the message_listener and determines what service the message is for and then
-        adds it into a data queue
+        Runs the message listener and reconnects whenever the connection closes or fails with one of
+        CONNECTION_ERRORS. Reconnect attempts back off exponentially with jitter, each one repeats the ADMIN LOGIN and
+        then replays every live subscription of the SubscriptionManager. Without an open websocket the first connect
+        goes through the same backoff. backfill, if given, is awaited with the epoch seconds of the last received
+        message and of the reconnect so the gap can be filled from price history before streaming resumes
         """
-        message = json.loads(message)
-        if 'data' in message:
-            if message['data'][0]['service'] == 'LEVELONE_EQUITIES':
-                parsed_message = parse_equities_data(message)
-                print(parsed_message)
+        self.supervised = True
+        if self.websocket is None:
+            attempt = 0
+            while self.supervised:
+                try:
+                    await self.start_stream_connection()
+                    break
+                except CONNECTION_ERRORS as e:
+                    print(f'Connect attempt {attempt + 1} failed: {e!r}')
+                    await asyncio.sleep(min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0))
+                    attempt += 1
+
+        while self.supervised:
+            await self.start_message_listener()
+            if not self.supervised:
+                break
 
-                if self.data_queue:
-                    await self.data_queue.put(parsed_message)
+            disconnected_at = time.time()
+            attempt = 0
+            while self.supervised:
+                delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                await asyncio.sleep(delay)
+                try:
+                    await self.start_stream_connection()
+                    if subscriptions is not None:
+                        replay = subscriptions.replay_requests()
+                        if replay:
+                            await self.send_requests(*replay)
+                    break
+                except CONNECTION_ERRORS as e:
+                    attempt += 1
+                    print(f'Reconnect attempt {attempt} failed: {e!r}')
+
+            if not self.supervised:
+                break
+
+            reconnected_at = time.time()
+            gap_start = self.last_message_time if self.last_message_time is not None else disconnected_at
+            self.connection_stats['reconnects'] += 1
+            self.connection_stats['last_reconnect_seconds'] = reconnected_at - disconnected_at
+            self.connection_stats['last_gap_seconds'] = reconnected_at - gap_start
+            self.connection_stats['total_gap_seconds'] += reconnected_at - gap_start
+            print(f'Reconnected after {reconnected_at - disconnected_at:.1f}s, '
+                  f'gap of {reconnected_at - gap_start:.1f}s')
+
+            if backfill is not None:
+                try:
+                    await backfill(gap_start, reconnected_at)
+                except Exception as e:
+                    print(f'Failed to backfill stream gap: {e!r}')
+
+    async def handle_message(self, message:str) -> None:
+        """
+        This takes a message provided by the message_listener, parses every entry of its data array with the parser
+        registered for that service and adds the result to the service's data queue. Heartbeats are recognised from
+        the raw frame and never decoded
+        """
+        kind = classify_frame(message)
+        if kind == 'notify' and is_heartbeat(message):
+            self.last_heartbeat = time.time()
+            HEARTBEATS.inc()
+            return
+
+        received = time.time()
+        size = len(message)
+        start = time.perf_counter()
+        message = self.decode(message)
+        DECODE_SECONDS.record(time.perf_counter() - start)
+        if 'data' in message:
+            share = size / len(message['data']) if message['data'] else 0
+            for frame in message['data']:
+                route = self.routes.get(frame['service'])
+                if route is None:
+                    continue
+                parse, queue = route
+                start = time.perf_counter()
+                parsed_message = parse(frame, self.parse_output)
+                self.record_entry(frame['service'], frame.get('timestamp'), time.perf_counter() - start, share,
+                                  received)
+                if queue is not None:
+                    await queue.put(parsed_message)
         else:
             print(message)
 
-    def set_data_queue(self, queue):
+    def record_entry(self, service: str, timestamp: Optional[int], parse_seconds: float, size: float,
+                     received: float) -> None:
+        """
+        Records the parse time, the transit time and the per service message and byte counts of one data entry. size
+        is the entry's share of the raw frame and received the local time the frame arrived
         """
-        Takes in a queue and initializes it to the class
+        PARSE_SECONDS.record(parse_seconds)
+        messages, received_bytes = self.service_metrics[service]
+        messages.inc()
+        received_bytes.inc(size)
+        if timestamp is not None:
+            TRANSIT_SECONDS.record(received - timestamp / 1000)
+
+    def set_data_queue(self, queue, service: Optional[str] = None) -> None:
         """
-        self.data_queue = queue
+        Takes in a queue and initializes it to the class. With a service name the queue only receives that service's
+        parsed messages, otherwise it receives every service that has no queue of its own
+        """
+        if service is None:
+            self.data_queue = queue
+        else:
+            self.service_queues[service] = queue
+        self.build_routes()
 
-    async def request_level_one_equities(self, symbol:str, request_id:int) -> None:
+    def build_routes(self) -> None:
         """
-        Takes in a requested symbol and the request_id which should increase as each new request is made
-        and prints the requested stock data in a dictionary
-        """
-        request_data = {
-                 "requests": [{
-                   "service": "LEVELONE_EQUITIES",
-                   "requestid": request_id,
-                   "command": "SUBS",
-                   "SchwabClientCustomerId": self.streamer_info['schwabClientCustomerId'],
-                   "SchwabClientCorrelId": self.streamer_info['schwabClientCorrelId'],
-                   "parameters": {
-                    "keys": symbol,
-                    "fields": "0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,32,33,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51"
-                   }}
-                 ]}
-
-        request_data = json.dumps(request_data)
-        print(request_data)
+        Rebuilds the service name -> (parser, queue) dispatch table used by handle_message
+        """
+        self.routes = {service: (schema.parse, self.service_queues.get(service, self.data_queue))
+                       for service, schema in SERVICE_SCHEMAS.items()}
 
+    def next_request_id(self) -> int:
+        """
+        Returns a new request id. Ids increase monotonically and 1 is reserved for the ADMIN LOGIN request
+        """
+        self.last_request_id = next(self.request_ids)
+        return self.last_request_id
+
+    def build_request(self, service: str, command: str, request_id: int, parameters: dict) -> dict:
+        """
+        Returns a single stream request for service in the format expected by the Schwab streamer
+        """
+        return {
+            "service": service,
+            "requestid": request_id,
+            "command": command,
+            "SchwabClientCustomerId": self.streamer_info['schwabClientCustomerId'],
+            "SchwabClientCorrelId": self.streamer_info['schwabClientCorrelId'],
+            "parameters": parameters
+        }
+
+    async def send_requests(self, *requests_list: dict) -> None:
+        """
+        Sends one or more requests built by build_request in a single websocket frame
+        """
+        request_data = json.dumps({"requests": list(requests_list)})
         await self.websocket.send(request_data)
 
+    async def subscribe(self, service: str, keys: str, request_id: int, fields: Optional[str] = None) -> None:
+        """
+        Sends a SUBS request for the comma separated keys. Every field of the service is requested unless fields is
+        given
+        """
+        if fields is None:
+            fields = SERVICE_SCHEMAS[service].field_numbers
+        await self.send_requests(self.build_request(service, "SUBS", request_id, {"keys": keys, "fields": fields}))
 
-    async def request_level_one_options(self, request_id: int) -> None:
+    async def request_level_one_equities(self, symbol:str, request_id:int) -> None:
         """
         Takes in a requested symbol and the request_id which should increase as each new request is made
-        and prints the requested option data in a dictionary
-        """
-        request_data = {
-                 "requests": [{
-                   "service": "LEVELONE_OPTIONS",
-                   "requestid": request_id,
-                   "command": "SUBS",
-                   "SchwabClientCustomerId": self.streamer_info['schwabClientCustomerId'],
-                   "SchwabClientCorrelId": self.streamer_info['schwabClientCorrelId'],
-                   "parameters": {
-                    "keys": "AAPL  251219C00200000",
-                    "fields": "0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30,31,32,33,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55"
-                   }}
-                 ]}
-
-        request_data = json.dumps(request_data)
+        and streams the requested stock data
+        """
+        await self.subscribe("LEVELONE_EQUITIES", symbol, request_id)
 
-        await self.websocket.send(request_data)
+    async def request_level_one_options(self, symbol: str, request_id: int) -> None:
+        """
+        Takes in a requested option symbol, for example "AAPL  251219C00200000", and the request_id which should
+        increase as each new request is made and streams the requested option data
+        """
+        await self.subscribe("LEVELONE_OPTIONS", symbol, request_id)
 
-    async def request_level_one_futures(self, request_id: int) -> None:
-        pass
+    async def request_level_one_futures(self, symbol: str, request_id: int) -> None:
+        """
+        Takes in a requested futures symbol, for example "/ESZ25", and the request_id and streams the futures data
+        """
+        await self.subscribe("LEVELONE_FUTURES", symbol, request_id)
 
-    async def request_level_one_futures_options(self, request_id: int) -> None:
-        pass
+    async def request_level_one_futures_options(self, symbol: str, request_id: int) -> None:
+        """
+        Takes in a requested futures option symbol, for example "./OZCZ25C565", and the request_id and streams the
+        futures option data
+        """
+        await self.subscribe("LEVELONE_FUTURES_OPTIONS", symbol, request_id)
 
-    async def request_level_one_futures_forex(self, request_id: int) -> None:
-        pass
+    async def request_level_one_forex(self, symbol: str, request_id: int) -> None:
+        """
+        Takes in a requested currency pair, for example "EUR/USD", and the request_id and streams the forex data
+        """
+        await self.subscribe("LEVELONE_FOREX", symbol, request_id)
 
     async def request_equity_chart(self, symbol:str, request_id:int) -> None:
         """
-        Takes as symbol and request_id and request prints the equity data for that minute in time to be used for
+        Takes as symbol and request_id and streams the equity data for that minute in time to be used for
         charting candles
         """
-        request_data = {
-                 "requests": [{
-                   "service": "CHART_EQUITY",
-                   "requestid": request_id,
-                   "command": "SUBS",
-                   "SchwabClientCustomerId": self.streamer_info['schwabClientCustomerId'],
-                   "SchwabClientCorrelId": self.streamer_info['schwabClientCorrelId'],
-                   "parameters": {
-                    "keys": symbol,
-                    "fields": "0,1,2,3,4,5,6,7,8"
-                   }}
-                 ]}
-
-        request_data = json.dumps(request_data)
-        print(request_data)
+        await self.subscribe("CHART_EQUITY", symbol, request_id)
 
-        await self.websocket.send(request_data)
+class QuoteRecord(object):
+    """
+    Base class for the __slots__ records produced by FieldSchema. Fields that were not present in the stream
+    message read as None
+    """
+    __slots__ = ('timestamp',)
+    attributes = ()
+    service = ''
 
-def parse_equities_data(ticker_data:dict) -> list:
+    def __getattr__(self, name: str):
+        if name in self.attributes:
+            return None
+        raise AttributeError(name)
+
+    def as_dict(self) -> dict:
+        """
+        Returns the record as a dict of attribute names to values
+        """
+        return {name: getattr(self, name) for name in ('timestamp',) + self.attributes}
+
+    def __reduce__(self) -> tuple:
+        values = {name: getattr(self, name) for name in ('timestamp',) + self.attributes}
+        return rebuild_record, (self.service, values)
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{k}={v!r}' for k, v in self.as_dict().items() if v is not None)
+        return f'{type(self).__name__}({values})'
+
+
+def rebuild_record(service: str, values: dict) -> QuoteRecord:
+    """
+    Recreates a record from its service and values. Records are built from dynamically created classes, so pickling
+    them, for example to return them from a worker process, goes through this function
+    """
+    record = SERVICE_SCHEMAS[service].record_type()
+    for name, value in values.items():
+        if value is not None:
+            setattr(record, name, value)
+    return record
+
+
+def attribute_name(display_name: str) -> str:
+    """
+    Converts a display name such as "52 Week High" into an identifier such as "week_52_high"
+    """
+    words = re.findall(r'[a-z0-9]+', display_name.lower())
+    if words[0][0].isdigit() and len(words) > 1:
+        words[0], words[1] = words[1], words[0]
+    return '_'.join(words)
+
+
+def format_timestamp(epoch_ms: int) -> str:
+    """
+    Formats a stream timestamp in epoch milliseconds as a UTC "YYYY-MM-DD HH:MM:SS" string
+    """
+    return str(datetime.fromtimestamp(epoch_ms / 1000, tz=timezone.utc))[:19]
+
+
+class FieldSchema(object):
+    """
+    Precompiled field table for one streaming service. The lookup tables are built once at import time so parsing
+    a message only walks the fields that are actually present
+    """
+    def __init__(self, service: str, label: str, record_name: str, fields: tuple) -> None:
+        self.service = service
+        self.label = label
+        self.keys = tuple(key for key, _ in fields)
+        self.names = tuple(name for _, name in fields)
+        self.attributes = tuple(attribute_name(name) for name in self.names)
+        self.name_by_key = dict(zip(self.keys, self.names))
+        self.attribute_by_key = dict(zip(self.keys, self.attributes))
+        self.field_numbers = ','.join(str(i) for i in range(len(fields)))
+        self.record_type = type(record_name, (QuoteRecord,), {'__slots__': self.attributes,
+                                                              'attributes': self.attributes,
+                                                              'service': service})
+
+    def parse(self, frame: dict, output: str = 'dict') -> list:
+        """
+        Parses one entry of a message's data array. output selects the shape of the result:
+        'dict' returns [label, {display name: value}, ...], 'records' returns [label, record, ...] and
+        'columns' returns [label, {'timestamp': timestamp, display name: [value per symbol]}]
+        """
+        tickers = frame['content']
+        timestamp = format_timestamp(frame['timestamp'])
+
+        if output == 'dict':
+            names = self.name_by_key
+            parsed = [self.label]
+            for ticker in tickers:
+                revised_ticker_data = {'timestamp': timestamp}
+                revised_ticker_data.update({names[k]: v for k, v in ticker.items() if k in names})
+                parsed.append(revised_ticker_data)
+            return parsed
+
+        if output == 'records':
+            attributes = self.attribute_by_key
+            record_type = self.record_type
+            parsed = [self.label]
+            for ticker in tickers:
+                record = record_type()
+                record.timestamp = timestamp
+                for k, v in ticker.items():
+                    attribute = attributes.get(k)
+                    if attribute is not None:
+                        setattr(record, attribute, v)
+                parsed.append(record)
+            return parsed
+
+        if output == 'columns':
+            columns = {'timestamp': timestamp}
+            for key, name in zip(self.keys, self.names):
+                columns[name] = [ticker.get(key) for ticker in tickers]
+            return [self.label, columns]
+
+        raise ValueError(f'Unknown output format {output}')
+
+
+LEVELONE_EQUITIES_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Bid Price"),
+    ("2", "Ask Price"),
+    ("3", "Last Price"),
+    ("4", "Bid Size"),
+    ("5", "Ask Size"),
+    ("6", "Ask ID"),
+    ("7", "Bid ID"),
+    ("8", "Total Volume"),
+    ("9", "Last Size"),
+    ("10", "High Price"),
+    ("11", "Low Price"),
+    ("12", "Close Price"),
+    ("13", "Exchange ID"),
+    ("14", "Marginable"),
+    ("15", "Description"),
+    ("16", "Last ID"),
+    ("17", "Open Price"),
+    ("18", "Net Change"),
+    ("19", "52 Week High"),
+    ("20", "52 Week Low"),
+    ("21", "PE Ratio"),
+    ("22", "Annual Dividend Amount"),
+    ("23", "Dividend Yield"),
+    ("24", "NAV"),
+    ("25", "Exchange Name"),
+    ("26", "Dividend Date"),
+    ("27", "Regular Market Quote"),
+    ("28", "Regular Market Trade"),
+    ("29", "Regular Market Last Price"),
+    ("30", "Regular Market Last Size"),
+    ("31", "Regular Market Net Change"),
+    ("32", "Security Status"),
+    ("33", "Mark Price"),
+    ("34", "Quote Time in Long"),
+    ("35", "Trade Time in Long"),
+    ("36", "Regular Market Trade Time in Long"),
+    ("37", "Bid Time"),
+    ("38", "Ask Time"),
+    ("39", "Ask MIC ID"),
+    ("40", "Bid MIC ID"),
+    ("41", "Last MIC ID"),
+    ("42", "Net Percent Change"),
+    ("43", "Regular Market Percent Change"),
+    ("44", "Mark Price Net Change"),
+    ("45", "Mark Price Percent Change"),
+    ("46", "Hard to Borrow Quantity"),
+    ("47", "Hard To Borrow Rate"),
+    ("48", "Hard to Borrow"),
+    ("49", "shortable"),
+    ("50", "Post-Market Net Change"),
+    ("51", "Post-Market Percent Change"),
+)
+
+LEVELONE_EQUITIES = FieldSchema('LEVELONE_EQUITIES', 'Equities', 'EquityQuote', LEVELONE_EQUITIES_FIELDS)
+
+
+LEVELONE_OPTIONS_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Description"),
+    ("2", "Bid Price"),
+    ("3", "Ask Price"),
+    ("4", "Last Price"),
+    ("5", "High Price"),
+    ("6", "Low Price"),
+    ("7", "Close Price"),
+    ("8", "Total Volume"),
+    ("9", "Open Interest"),
+    ("10", "Volatility"),
+    ("11", "Money Intrinsic Value"),
+    ("12", "Expiration Year"),
+    ("13", "Multiplier"),
+    ("14", "Digits"),
+    ("15", "Open Price"),
+    ("16", "Bid Size"),
+    ("17", "Ask Size"),
+    ("18", "Last Size"),
+    ("19", "Net Change"),
+    ("20", "Strike Price"),
+    ("21", "Contract Type"),
+    ("22", "Underlying"),
+    ("23", "Expiration Month"),
+    ("24", "Deliverables"),
+    ("25", "Time Value"),
+    ("26", "Expiration Day"),
+    ("27", "Days to Expiration"),
+    ("28", "Delta"),
+    ("29", "Gamma"),
+    ("30", "Theta"),
+    ("31", "Vega"),
+    ("32", "Rho"),
+    ("33", "Security Status"),
+    ("34", "Theoretical Option Value"),
+    ("35", "Underlying Price"),
+    ("36", "UV Expiration Type"),
+    ("37", "Mark Price"),
+    ("38", "Quote Time in Long"),
+    ("39", "Trade Time in Long"),
+    ("40", "Exchange"),
+    ("41", "Exchange Name"),
+    ("42", "Last Trading Day"),
+    ("43", "Settlement Type"),
+    ("44", "Net Percent Change"),
+    ("45", "Mark Price Net Change"),
+    ("46", "Mark Price Percent Change"),
+    ("47", "Implied Yield"),
+    ("48", "Is Penny Pilot"),
+    ("49", "Option Root"),
+    ("50", "52 Week High"),
+    ("51", "52 Week Low"),
+    ("52", "Indicative Ask Price"),
+    ("53", "Indicative Bid Price"),
+    ("54", "Indicative Quote Time"),
+    ("55", "Exercise Type"),
+)
+
+LEVELONE_FUTURES_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Bid Price"),
+    ("2", "Ask Price"),
+    ("3", "Last Price"),
+    ("4", "Bid Size"),
+    ("5", "Ask Size"),
+    ("6", "Bid ID"),
+    ("7", "Ask ID"),
+    ("8", "Total Volume"),
+    ("9", "Last Size"),
+    ("10", "Quote Time in Long"),
+    ("11", "Trade Time in Long"),
+    ("12", "High Price"),
+    ("13", "Low Price"),
+    ("14", "Close Price"),
+    ("15", "Exchange ID"),
+    ("16", "Description"),
+    ("17", "Last ID"),
+    ("18", "Open Price"),
+    ("19", "Net Change"),
+    ("20", "Future Percent Change"),
+    ("21", "Exchange Name"),
+    ("22", "Security Status"),
+    ("23", "Open Interest"),
+    ("24", "Mark Price"),
+    ("25", "Tick"),
+    ("26", "Tick Amount"),
+    ("27", "Product"),
+    ("28", "Future Price Format"),
+    ("29", "Future Trading Hours"),
+    ("30", "Future Is Tradable"),
+    ("31", "Future Multiplier"),
+    ("32", "Future Is Active"),
+    ("33", "Future Settlement Price"),
+    ("34", "Future Active Symbol"),
+    ("35", "Future Expiration Date"),
+    ("36", "Expiration Style"),
+    ("37", "Ask Time"),
+    ("38", "Bid Time"),
+    ("39", "Quoted In Session"),
+    ("40", "Settlement Date"),
+)
+
+LEVELONE_FUTURES_OPTIONS_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Bid Price"),
+    ("2", "Ask Price"),
+    ("3", "Last Price"),
+    ("4", "Bid Size"),
+    ("5", "Ask Size"),
+    ("6", "Bid ID"),
+    ("7", "Ask ID"),
+    ("8", "Total Volume"),
+    ("9", "Last Size"),
+    ("10", "Quote Time in Long"),
+    ("11", "Trade Time in Long"),
+    ("12", "High Price"),
+    ("13", "Low Price"),
+    ("14", "Close Price"),
+    ("15", "Last ID"),
+    ("16", "Description"),
+    ("17", "Open Price"),
+    ("18", "Open Interest"),
+    ("19", "Mark Price"),
+    ("20", "Tick"),
+    ("21", "Tick Amount"),
+    ("22", "Future Multiplier"),
+    ("23", "Future Settlement Price"),
+    ("24", "Underlying Symbol"),
+    ("25", "Strike Price"),
+    ("26", "Future Expiration Date"),
+    ("27", "Expiration Style"),
+    ("28", "Contract Type"),
+    ("29", "Security Status"),
+    ("30", "Exchange"),
+    ("31", "Exchange Name"),
+)
+
+LEVELONE_FOREX_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Bid Price"),
+    ("2", "Ask Price"),
+    ("3", "Last Price"),
+    ("4", "Bid Size"),
+    ("5", "Ask Size"),
+    ("6", "Total Volume"),
+    ("7", "Last Size"),
+    ("8", "Quote Time in Long"),
+    ("9", "Trade Time in Long"),
+    ("10", "High Price"),
+    ("11", "Low Price"),
+    ("12", "Close Price"),
+    ("13", "Exchange"),
+    ("14", "Description"),
+    ("15", "Open Price"),
+    ("16", "Net Change"),
+    ("17", "Percent Change"),
+    ("18", "Exchange Name"),
+    ("19", "Digits"),
+    ("20", "Security Status"),
+    ("21", "Tick"),
+    ("22", "Tick Amount"),
+    ("23", "Product"),
+    ("24", "Trading Hours"),
+    ("25", "Is Tradable"),
+    ("26", "Market Maker"),
+    ("27", "52 Week High"),
+    ("28", "52 Week Low"),
+    ("29", "Mark Price"),
+)
+
+CHART_EQUITY_FIELDS = (
+    ("key", "Symbol"),
+    ("1", "Open Price"),
+    ("2", "High Price"),
+    ("3", "Low Price"),
+    ("4", "Close Price"),
+    ("5", "Volume"),
+    ("6", "Sequence"),
+    ("7", "Chart Time"),
+    ("8", "Chart Day"),
+)
+
+LEVELONE_OPTIONS = FieldSchema('LEVELONE_OPTIONS', 'Options', 'OptionQuote', LEVELONE_OPTIONS_FIELDS)
+LEVELONE_FUTURES = FieldSchema('LEVELONE_FUTURES', 'Futures', 'FutureQuote', LEVELONE_FUTURES_FIELDS)
+LEVELONE_FUTURES_OPTIONS = FieldSchema('LEVELONE_FUTURES_OPTIONS', 'Futures Options', 'FutureOptionQuote',
+                                       LEVELONE_FUTURES_OPTIONS_FIELDS)
+LEVELONE_FOREX = FieldSchema('LEVELONE_FOREX', 'Forex', 'ForexQuote', LEVELONE_FOREX_FIELDS)
+CHART_EQUITY = FieldSchema('CHART_EQUITY', 'Equity Chart', 'ChartBar', CHART_EQUITY_FIELDS)
+
+SERVICE_SCHEMAS = {schema.service: schema for schema in (LEVELONE_EQUITIES, LEVELONE_OPTIONS, LEVELONE_FUTURES,
+                                                         LEVELONE_FUTURES_OPTIONS, LEVELONE_FOREX, CHART_EQUITY)}
+
+
+def parse_service_data(ticker_data: dict, schema: FieldSchema, output: str = 'dict') -> list:
+    """
+    Parses every entry of the message's data array that belongs to schema's service and returns them as one list
+    headed by the schema label. With output='columns' each entry contributes its own column block
+    """
+    parsed = [schema.label]
+    for frame in ticker_data['data']:
+        if frame['service'] == schema.service:
+            parsed.extend(schema.parse(frame, output)[1:])
+    return parsed
+
+def parse_equities_data(ticker_data:dict, output: str = 'dict') -> list:
     """
     This takes in ticker data and maps the keys returned from stream to their respective name
     """
-    key_mapping = {
-        "key": "Symbol",
-        "1": "Bid Price",
-        "2": "Ask Price",
-        "3": "Last Price",
-        "4": "Bid Size",
-        "5": "Ask Size",
-        "6": "Ask ID",
-        "7": "Bid ID",
-        "8": "Total Volume",
-        "9": "Last Size",
-        "10": "High Price",
-        "11": "Low Price",
-        "12": "Close Price",
-        "13": "Exchange ID",
-        "14": "Marginable",
-        "15": "Description",
-        "16": "Last ID",
-        "17": "Open Price",
-        "18": "Net Change",
-        "19": "52 Week High",
-        "20": "52 Week Low",
-        "21": "PE Ratio",
-        "22": "Annual Dividend Amount",
-        "23": "Dividend Yield",
-        "24": "NAV",
-        "25": "Exchange Name",
-        "26": "Dividend Date",
-        "27": "Regular Market Quote",
-        "28": "Regular Market Trade",
-        "29": "Regular Market Last Price",
-        "30": "Regular Market Last Size",
-        "31": "Regular Market Net Change",
-        "32": "Security Status",
-        "33": "Mark Price",
-        "34": "Quote Time in Long",
-        "35": "Trade Time in Long",
-        "36": "Regular Market Trade Time in Long",
-        "37": "Bid Time",
-        "38": "Ask Time",
-        "39": "Ask MIC ID",
-        "40": "Bid MIC ID",
-        "41": "Last MIC ID",
-        "42": "Net Percent Change",
-        "43": "Regular Market Percent Change",
-        "44": "Mark Price Net Change",
-        "45": "Mark Price Percent Change",
-        "46": "Hard to Borrow Quantity",
-        "47": "Hard To Borrow Rate",
-        "48": "Hard to Borrow",
-        "49": "shortable",
-        "50": "Post-Market Net Change",
-        "51": "Post-Market Percent Change"
-    }
-
-    tickers = ticker_data['data'][0]['content']
-    revised_tickers = ['Equities']
-
-    for ticker in tickers:
-        epoch_timestamp = ticker_data['data'][0]['timestamp'] / 1000
-        timestamp = str(datetime.fromtimestamp(epoch_timestamp, tz=timezone.utc))
-        timestamp = timestamp[:19]
-        revised_ticker_data = {'timestamp': timestamp}
-        ticker_copy = {k:v for k,v in ticker.items()}
-        for key in ticker.keys():
-            if key in key_mapping.keys():
-                mapped_value = key_mapping.get(key)
-                revised_ticker_data[mapped_value] = ticker_copy.pop(key)
-
-        revised_tickers.append(revised_ticker_data)
-
-    return revised_tickers
-
-def parse_options_data(ticker_data:dict) -> list:
-    pass
-
-def parse_futures_data(ticker_data:dict) -> list:
-    pass
-
-def parse_futures_options_data(ticker_data:dict) -> list:
-    pass
-
-def parse_forex_data(ticker_data:dict) -> list:
-    pass
-
-def parse_equity_chart_data(ticker_data:dict) -> list:
+    return parse_service_data(ticker_data, LEVELONE_EQUITIES, output)
+
+def parse_options_data(ticker_data:dict, output: str = 'dict') -> list:
+    """
+    Takes in LEVELONE_OPTIONS ticker data and maps the keys returned from stream to their respective name
+    """
+    return parse_service_data(ticker_data, LEVELONE_OPTIONS, output)
+
+def parse_futures_data(ticker_data:dict, output: str = 'dict') -> list:
+    """
+    Takes in LEVELONE_FUTURES ticker data and maps the keys returned from stream to their respective name
+    """
+    return parse_service_data(ticker_data, LEVELONE_FUTURES, output)
+
+def parse_futures_options_data(ticker_data:dict, output: str = 'dict') -> list:
+    """
+    Takes in LEVELONE_FUTURES_OPTIONS ticker data and maps the keys returned from stream to their respective name
+    """
+    return parse_service_data(ticker_data, LEVELONE_FUTURES_OPTIONS, output)
+
+def parse_forex_data(ticker_data:dict, output: str = 'dict') -> list:
+    """
+    Takes in LEVELONE_FOREX ticker data and maps the keys returned from stream to their respective name
+    """
+    return parse_service_data(ticker_data, LEVELONE_FOREX, output)
+
+def parse_equity_chart_data(ticker_data:dict, output: str = 'dict') -> list:
     """
-    Takes in ticker_data and maps its key(number) to its respective name
+    Takes in CHART_EQUITY ticker_data and maps its key(number) to its respective name
     """
-    key_mapping = {
-        "0": "key",
-        "1": "Open Price",
-        "2": "High Price",
-        "3": "Low Price",
-        "4": "Close Price",
-        "5": "Volume",
-        "6": "Sequence",
-        "7": "Chart Time",
-        "8": "Chart Day"
-    }
-    pass
\ No newline at end of file
+    return parse_service_data(ticker_data, CHART_EQUITY, output)
@@ -1,23 +1,125 @@
 import time
+import argparse
+import contextlib
 from asyncio import Event, get_running_loop
 
 import qasync
 from PyQt6 import QtWidgets
 import qdarktheme
 import pyqtgraph as pg
-from PyQt6.QtWidgets import QWidget, QHBoxLayout, QLineEdit, QComboBox, QGridLayout, QLabel, QSizePolicy, QPushButton
-from PyQt6.QtCore import Qt
-from collections import deque
+from PyQt6.QtWidgets import QWidget, QHBoxLayout, QLineEdit, QComboBox, QGridLayout, QLabel, QSizePolicy, QPushButton, QCompleter, QTableView, QHeaderView, QAbstractItemView
+from PyQt6.QtCore import Qt, QStringListModel, QTimer
+from PyQt6.QtGui import QShortcut, QKeySequence
 import numpy as np
-from auth import APICredentials
+from auth import APICredentials, CredentialManager
 from data_streamer import Streamer
 import asyncio
 from dotenv import dotenv_values
 from price_history import PriceHistory
-import json
+from http_client import base_url
+from history_cache import PriceHistoryCache
+from market_calendar import MarketCalendar
+from tickers import TickerUniverse
+from subscriptions import SubscriptionManager
+from tick_queue import TickQueue
+from tick_log import TickRecorder
+from series import RingBuffer
+from bars import BarEngine, BarFeed
+from candles import CandleFrame
+from chart_items import CandlestickItem, IndicatorOverlay
+from indicators import SMA, EMA
+from watchlist import WatchlistModel, WATCHLIST_FIELDS, quote_from_candles
+from market_data_engine import MarketDataEngine, QuoteTableReader
+import metrics
+import server
+from typing import Callable, Optional
+
+tickers = TickerUniverse('../data/tickers.json')
+
+CHART_QUOTE_FIELDS = ('Last Price', 'Last Size', 'Total Volume', 'Quote Time in Long', 'Trade Time in Long')
+
+RENDER_SECONDS = metrics.histogram('render_seconds', 'Time to push the buffered series to the chart')
+EXCHANGE_TO_SCREEN_SECONDS = metrics.histogram('exchange_to_screen_seconds',
+                                               'Quote exchange time to the render that first draws it')
+FRAMES = metrics.counter('render_frames_total', 'Frames rendered by the render scheduler')
+DROPPED_FRAMES = metrics.counter('render_dropped_frames_total', 'Render timer intervals missed by a busy event loop')
+
+WATCHLIST_HISTORY = {'periodType': 'month', 'period': '1', 'frequencyType': 'daily', 'frequency': '1'}
+
+class RenderScheduler(object):
+    """
+    Repaints on a fixed cadence instead of once per market data message. Data arrival only marks the chart dirty
+    and a QTimer calls render at most fps times per second, so UI cost no longer follows the tick rate
+    """
+    def __init__(self, render: Callable[[], None], fps: int = 60,
+                 on_stats: Optional[Callable[[dict], None]] = None) -> None:
+        self.render = render
+        self.on_stats = on_stats
+        self.interval = 1 / fps
+        self.dirty = False
+        self.frames = 0
+        self.dropped_frames = 0
+        self.fps = 0.0
+        self.last_tick = None
+        self.window_start = None
+        self.window_frames = 0
+
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.setInterval(max(1, round(1000 / fps)))
+        self.timer.timeout.connect(self.tick)
+
+    def start(self) -> None:
+        self.timer.start()
+
+    def stop(self) -> None:
+        self.timer.stop()
+
+    def mark_dirty(self) -> None:
+        """
+        Requests a repaint on the next timer tick
+        """
+        self.dirty = True
+
+    def tick(self) -> None:
+        """
+        Renders if anything changed since the last frame and keeps the frame rate and dropped frame counters. A frame
+        counts as dropped when the timer fires a whole interval late, usually because the event loop was busy
+        """
+        now = time.perf_counter()
+        if self.last_tick is not None:
+            late_intervals = int((now - self.last_tick) / self.interval) - 1
+            if late_intervals > 0:
+                self.dropped_frames += late_intervals
+                DROPPED_FRAMES.inc(late_intervals)
+        self.last_tick = now
+
+        if self.dirty:
+            self.dirty = False
+            self.render()
+            RENDER_SECONDS.record(time.perf_counter() - now)
+            self.frames += 1
+            self.window_frames += 1
+            FRAMES.inc()
+
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= 1:
+            self.fps = self.window_frames / (now - self.window_start)
+            self.window_start = now
+            self.window_frames = 0
+            if self.on_stats:
+                self.on_stats(self.stats())
+
+    def stats(self) -> dict:
+        """
+        Returns the achieved frames per second over the last second and the total frame and dropped frame counts
+        """
+        return {'fps': self.fps, 'frames': self.frames, 'dropped_frames': self.dropped_frames}
+
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self) -> None:
+    def __init__(self, max_data_points: int = 10000, fps: int = 60) -> None:
         super().__init__()
 
         qdarktheme.setup_theme()
@@ -39,11 +141,33 @@ class MainWindow(QtWidgets.QMainWindow):
         self.plot_widget.showGrid(x=True, y=True)
         self.layout.addWidget(self.plot_widget)
 
-        self.max_data_points = 10000
-        self.price_list = deque(maxlen=self.max_data_points)
-        self.time_list = deque(maxlen=self.max_data_points)
+        self.max_data_points = max_data_points
+        self.series = RingBuffer(self.max_data_points)
+
+        self.curve = self.plot_widget.plot(self.series.times(), self.series.closes(), pen='r', width=5)
+        self.plot_widget.setDownsampling(auto=True, mode='peak')
+        self.plot_widget.setClipToView(True)
+
+        self.bars = BarEngine()
+        self.candlesticks = None
+        self.chart_symbol = None
+        self.last_request = None
 
-        self.curve = self.plot_widget.plot(self.price_list, self.time_list, pen='r', width=5)
+        self.overlays = []
+        self.add_indicator(SMA(20), ['y'])
+        self.add_indicator(EMA(50), ['c'])
+
+        self.pending_exchange_times = []
+        self.render_scheduler = RenderScheduler(self.render_plot, fps, self.show_render_stats)
+        self.render_scheduler.start()
+
+        self.metrics_overlay = QLabel(self.plot_widget)
+        self.metrics_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 170); color: white; "
+                                           "font-family: monospace; padding: 4px;")
+        self.metrics_overlay.move(60, 10)
+        self.metrics_overlay.hide()
+        self.metrics_shortcut = QShortcut(QKeySequence("F3"), self)
+        self.metrics_shortcut.activated.connect(self.toggle_metrics_overlay)
 
         self.gridLayout = QGridLayout()
         self.layout.addLayout(self.gridLayout)
@@ -135,9 +259,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ticker.setPlaceholderText("Enter Stock Ticker")
         size_policy.setHeightForWidth(self.ticker.sizePolicy().hasHeightForWidth())
         self.ticker.setSizePolicy(size_policy)
-        self.ticker.setMaxLength(5)
+        self.ticker.setMaxLength(10)
         self.ticker.setAlignment(Qt.AlignmentFlag.AlignLeading|Qt.AlignmentFlag.AlignCenter|Qt.AlignmentFlag.AlignVCenter)
 
+        self.ticker_completer_model = QStringListModel()
+        self.ticker_completer = QCompleter(self.ticker_completer_model, self.ticker)
+        self.ticker_completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.ticker.setCompleter(self.ticker_completer)
+        self.ticker.textEdited.connect(self.update_ticker_completions)
+
         self.ticker_future = None
 
         self.gridLayout.addWidget(self.ticker, 0, 0, 1, 2)
@@ -160,41 +290,164 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.gridLayout.addWidget(self.submit_button, 7, 0, 1, 2)
 
+        self.watchlist = WatchlistModel(parent=self)
+
+        self.watchlist_input = QLineEdit()
+        self.watchlist_input.setPlaceholderText("Add to Watchlist")
+        self.watchlist_input.setMaxLength(10)
+        self.watchlist_input.setCompleter(QCompleter(self.ticker_completer_model, self.watchlist_input))
+        self.watchlist_input.completer().setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.watchlist_input.textEdited.connect(self.update_ticker_completions)
+        self.watchlist_input.returnPressed.connect(self.add_watchlist_symbol)
+
+        self.gridLayout.addWidget(self.watchlist_input, 8, 0, 1, 1)
+
+        self.watchlist_remove_button = QPushButton("Remove")
+        self.watchlist_remove_button.clicked.connect(self.remove_watchlist_selection)
 
-    async def update_plot(self, data: dict, streaming:bool) -> None:
+        self.gridLayout.addWidget(self.watchlist_remove_button, 8, 1, 1, 1)
+
+        self.watchlist_view = QTableView()
+        self.watchlist_view.setModel(self.watchlist)
+        self.watchlist_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.watchlist_view.setWordWrap(False)
+        self.watchlist_view.verticalHeader().hide()
+        self.watchlist_view.verticalHeader().setDefaultSectionSize(20)
+        self.watchlist_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.watchlist_view.horizontalHeader().setStretchLastSection(True)
+
+        self.gridLayout.addWidget(self.watchlist_view, 9, 0, 1, 2)
+
+
+    async def update_plot(self, data, streaming:bool) -> None:
         """
         This takes in data and streaming which determines if during market hours and then produces a stock chart in the gui
-        Streaming = True means during market hours which streams data. Streaming = False means historical data
+        Streaming = True means during market hours and data is a parsed stream message. Streaming = False means data
+        is a CandleFrame of historical candles
         """
-        if streaming == True and 'Last Price' in data[1]:
-            try:
-                timestamp = time.time()
-                self.time_list.append(timestamp)
-                time_array = np.array(list(self.time_list), dtype=np.float64)
+        if streaming:
+            self.watchlist.on_message(data)
+            for quote in data[1:]:
+                exchange_time = metrics.exchange_time(quote)
+                if exchange_time is not None:
+                    self.pending_exchange_times.append(exchange_time)
+                if isinstance(quote, dict) and quote.get('Symbol') == self.chart_symbol:
+                    try:
+                        self.append_tick(float(quote['Last Price']))
+                    except KeyError:
+                        pass
+                    except TypeError:
+                        pass
+            self.render_scheduler.mark_dirty()
 
-                price = float(data[1]['Last Price'])
-                self.price_list.append(price)
-                price_array = np.array(list(self.price_list), dtype=np.float64)
+        if not streaming:
+            self.series.extend(data.seconds(), data.close, data.open, data.high, data.low, data.volume)
+            for overlay in self.overlays:
+                overlay.load(self.series)
+            self.render_scheduler.mark_dirty()
 
-                if len(self.price_list) == len(self.time_list):
-                    self.curve.setData(time_array, price_array)
-            except KeyError:
-                pass
-            except TypeError:
-                pass
+    def append_tick(self, price: float) -> None:
+        """
+        Adds a streamed price of the charted symbol to the series and the indicator overlays
+        """
+        timestamp = time.time()
+        self.series.append(timestamp, price)
+        for overlay in self.overlays:
+            overlay.update(timestamp, *(self.series.column(name)[-1] for name in overlay.inputs))
 
-        if not streaming:
-            for element in data:
-                timestamp = element['datetime']
-                timestamp = timestamp / 1000
-                self.time_list.append(timestamp)
+    def backfill_series(self, candles: CandleFrame) -> None:
+        """
+        Appends candles newer than the last charted point, used to close the gap left by a stream disconnect
+        """
+        last_time = self.series.last_time()
+        if last_time is not None:
+            candles = candles.between(int(last_time * 1000) + 1)
+        if len(candles):
+            self.series.extend(candles.seconds(), candles.close)
+            for overlay in self.overlays:
+                overlay.load(self.series)
+            self.render_scheduler.mark_dirty()
+
+    def add_indicator(self, indicator: object, pens: list, inputs: tuple = ('close',)) -> IndicatorOverlay:
+        """
+        Overlays an indicator from indicators.py on the chart, one pen per output line. inputs names the series
+        columns passed to the indicator, e.g. ('close', 'volume') for VWAP
+        """
+        overlay = IndicatorOverlay(self.plot_widget, indicator, pens, self.max_data_points, inputs)
+        overlay.load(self.series)
+        self.overlays.append(overlay)
+        return overlay
 
-                price = float(element['close'])
-                self.price_list.append(price)
+    def show_candles(self, symbol: str, interval: int = 60) -> None:
+        """
+        Charts symbol's streaming quotes and adds a candlestick item that draws its bars of the given interval in
+        seconds
+        """
+        self.chart_symbol = symbol
+        if self.candlesticks is not None:
+            self.plot_widget.removeItem(self.candlesticks)
+        self.candlesticks = CandlestickItem(self.bars.aggregator(symbol).series[interval], interval)
+        self.plot_widget.addItem(self.candlesticks)
 
-            price_array = np.array(list(self.price_list), dtype=np.float64)
-            time_array = np.array(list(self.time_list), dtype=np.float64)
-            self.curve.setData(time_array, price_array)
+    def clear_chart(self) -> None:
+        """
+        Empties the series, the indicator overlays and the bars and removes the candlesticks, so a mode starts from a
+        blank chart instead of drawing on top of the previous one
+        """
+        self.series.clear()
+        for overlay in self.overlays:
+            overlay.load(self.series)
+        if self.candlesticks is not None:
+            self.plot_widget.removeItem(self.candlesticks)
+            self.candlesticks = None
+        self.bars = BarEngine()
+        self.chart_symbol = None
+        self.pending_exchange_times.clear()
+        self.render_scheduler.mark_dirty()
+
+    def render_plot(self) -> None:
+        """
+        Pushes the buffered series to the chart. Called by the render scheduler, never per tick. Every quote that
+        arrived since the last frame is drawn by this one, so its exchange to screen latency is recorded here
+        """
+        self.curve.setData(self.series.times(), self.series.closes())
+        for overlay in self.overlays:
+            overlay.render()
+        if self.candlesticks is not None:
+            self.candlesticks.refresh()
+        self.watchlist.flush()
+
+        if self.pending_exchange_times:
+            now = time.time()
+            for exchange_time in self.pending_exchange_times:
+                EXCHANGE_TO_SCREEN_SECONDS.record(now - exchange_time)
+            self.pending_exchange_times.clear()
+
+    def show_render_stats(self, stats: dict) -> None:
+        """
+        Shows the render scheduler's achieved frame rate and dropped frames in the status bar
+        """
+        self.statusBar().showMessage(f"{stats['fps']:.0f} FPS, {stats['dropped_frames']} dropped frames")
+        if self.metrics_overlay.isVisible():
+            self.update_metrics_overlay()
+
+    def toggle_metrics_overlay(self) -> None:
+        """
+        Shows or hides the metrics debug overlay, bound to F3
+        """
+        if self.metrics_overlay.isVisible():
+            self.metrics_overlay.hide()
+        else:
+            self.update_metrics_overlay()
+            self.metrics_overlay.show()
+            self.metrics_overlay.raise_()
+
+    def update_metrics_overlay(self) -> None:
+        """
+        Writes the latency percentiles and counters of the metrics registry into the debug overlay
+        """
+        self.metrics_overlay.setText('\n'.join(metrics.registry.summary()) or 'No metrics recorded yet')
+        self.metrics_overlay.adjustSize()
 
     async def wait_for_signal(self, signal):
         """
@@ -211,18 +464,32 @@ class MainWindow(QtWidgets.QMainWindow):
 
     async def requested_stock_data(self) -> dict:
         """
-        Waits until the submit button is pressed to acquire data from widgets
+        Waits until the submit button is pressed to acquire data from widgets. A valid request is kept in
+        last_request
         """
         await self.wait_for_signal(self.submit_button.clicked)
         if self.validate_stock_data(self.ticker.text().upper()):
             data = {'symbol': self.ticker.text().upper(),'periodType' : self.chart_period_type.currentText().lower(),
                     'period': self.chart_period.text(), 'frequencyType': self.frequency_type.currentText().lower(),
                     'frequency': self.frequency.text()}
+            self.last_request = data
             return data
         else:
             data = {}
             return data
 
+    async def chart_request(self) -> dict:
+        """
+        Returns the last submitted request, so a mode started by a market open or close keeps charting the same
+        ticker, and only waits for a submit before the first one
+        """
+        if self.last_request is not None:
+            return dict(self.last_request)
+        while True:
+            data = await self.requested_stock_data()
+            if data:
+                return data
+
     def change_frequency_type_options(self) -> None:
         """
         Sets the frequency_type combobox options based on the chart_period_type combo box selection
@@ -251,102 +518,332 @@ class MainWindow(QtWidgets.QMainWindow):
         self.start_date.setDisabled(True)
         self.end_date.setDisabled(True)
 
-    def set_plot_widget_title(self) -> None:
+    def enable_historical_equity_widgets(self) -> None:
+        """
+        Enables the widgets disabled by disable_historical_equity_widgets
+        """
+        self.frequency_type.setDisabled(False)
+        self.frequency.setDisabled(False)
+        self.chart_period_type.setDisabled(False)
+        self.chart_period.setDisabled(False)
+        self.start_date.setDisabled(False)
+        self.end_date.setDisabled(False)
+
+    def set_plot_widget_title(self, symbol: Optional[str] = None) -> None:
+        """
+        Sets the plot_widget title to symbol, by default the ticker in the input box
+        """
+        self.plot_widget.setTitle(symbol if symbol is not None else self.ticker.text().upper())
+
+    def update_ticker_completions(self, text: str) -> None:
         """
-        Sets the plot_widget title
+        Fills the ticker completer with the listed symbols that start with the typed text
         """
-        self.plot_widget.setTitle(self.ticker.text().upper())
+        self.ticker_completer_model.setStringList(tickers.complete(text))
 
     def validate_stock_data(self, symbol:str) -> bool:
-        if symbol in ticker_list():
-            return True
-        return False
+        return symbol in tickers
 
-def ticker_list():
-    with open('../data/tickers.json') as f:
-        data = json.load(f)
+    def add_watchlist_symbol(self) -> None:
+        """
+        Adds the symbol typed into the watchlist input if it is a listed ticker
+        """
+        symbol = self.watchlist_input.text().strip().upper()
+        if self.validate_stock_data(symbol):
+            self.watchlist.add_symbols([symbol])
+            self.watchlist_input.clear()
 
-    valid_tickers = []
-    for k,v in data.items():
-        ticker = v['ticker']
-        valid_tickers.append(ticker)
+    def remove_watchlist_selection(self) -> None:
+        """
+        Removes the selected rows from the watchlist
+        """
+        rows = {index.row() for index in self.watchlist_view.selectionModel().selectedRows()}
+        symbols = self.watchlist.symbols()
+        self.watchlist.remove_symbols([symbols[row] for row in rows])
 
-    return valid_tickers
+def ticker_list() -> list:
+    """
+    Returns every listed ticker symbol in sorted order
+    """
+    tickers.wait_until_loaded()
+    return list(tickers.symbols)
 
-def authenticate_user() -> str:
+async def authenticate_user() -> CredentialManager:
     """
-    This authenticates the user through the Schwab API Oauth process and then returns the access token
+    This authenticates the user through the Schwab API Oauth process without blocking the event loop and then returns
+    the credential manager, which keeps the access token refreshed in the background
     """
 
     config = dotenv_values('../.env')
     Schwab = APICredentials(config['app_key'], config['secret_key'], config['callback_url'],
-                            'https://api.schwabapi.com/v1/oauth/authorize',
-                            'https://api.schwabapi.com/v1/oauth/token', '../config/tokens/token.json')
+                            f'{base_url()}/v1/oauth/authorize',
+                            f'{base_url()}/v1/oauth/token', '../config/tokens/token.json')
     Schwab.encode_credentials()
-    Schwab.get_valid_token()
-    Schwab.write_token_data()
+    credentials = CredentialManager(Schwab)
+    await credentials.authenticate()
 
-    return Schwab.accessToken[0]
+    return credentials
 
-async def stream_data(access_token:str, ticker:str) -> None:
+async def update_graph(queue) -> None:
     """
-    This allows streaming of data from Schwab API
+    This grabs data that was set in the queue and then calls to update the plot in the gui
     """
+    while True:
+        data = await queue.get()
+        await main.update_plot(data, True)
 
-    Stream = Streamer(access_token)
-    Stream.get_streamer_info()
+async def stream_data(credentials: CredentialManager, ticker:str, historical: PriceHistory,
+                      record_path: Optional[str] = None) -> None:
+    """
+    This allows streaming of data from Schwab API. Dropped connections are reconnected and the missed minutes are
+    filled in from price history. With record_path every received frame is appended to that tick log
+    """
 
-    Stream.set_data_queue(asyncio.Queue())
+    Stream = Streamer(credentials.access_token)
+    credentials.subscribe(Stream)
+    if record_path is not None:
+        Stream.set_recorder(TickRecorder(record_path))
+    await asyncio.to_thread(Stream.get_streamer_info)
+
+    quote_queue = TickQueue(policy='conflate', name='data')
+    Stream.set_data_queue(BarFeed(main.bars, quote_queue))
 
     await Stream.start_stream_connection()
 
-    async def update_graph() -> None:
+    chart_queue = asyncio.Queue()
+    Stream.set_data_queue(BarFeed(main.bars, chart_queue), 'CHART_EQUITY')
+
+    main.set_plot_widget_title(ticker)
+    main.show_candles(ticker)
+
+    subscriptions = SubscriptionManager(Stream)
+    subscriptions.subscribe('LEVELONE_EQUITIES', [ticker], fields=CHART_QUOTE_FIELDS)
+    subscriptions.subscribe('CHART_EQUITY', [ticker])
+
+    def watch(symbols: list) -> None:
+        subscriptions.subscribe('LEVELONE_EQUITIES', symbols, fields=WATCHLIST_FIELDS)
+
+    def unwatch(symbols: list) -> None:
+        subscriptions.unsubscribe('LEVELONE_EQUITIES', [symbol for symbol in symbols if symbol != ticker])
+
+    if main.watchlist.symbols():
+        watch(main.watchlist.symbols())
+    main.watchlist.symbols_added.connect(watch)
+    main.watchlist.symbols_removed.connect(unwatch)
+
+    async def backfill(gap_start: float, gap_end: float) -> None:
         """
-        This grabs data that was set in the queue and then calls to update the plot in the gui
+        Fetches the minute candles missed while the stream was disconnected and adds them to the chart and its bars
         """
-        main.set_plot_widget_title()
+        candles = await asyncio.to_thread(historical.get_minute_candles, ticker, int(gap_start * 1000),
+                                          int(gap_end * 1000))
+        main.backfill_series(candles)
+        main.bars.aggregator(ticker).add_minute_candles(candles)
+        main.render_scheduler.mark_dirty()
+
+    task1 = asyncio.create_task(Stream.run_supervised(subscriptions, backfill))
+    task2 = asyncio.create_task(subscriptions.flush())
+    task3 = asyncio.create_task(update_graph(quote_queue))
+    task4 = asyncio.create_task(update_graph(chart_queue))
+
+    try:
+        await task1
+        await task2
+        await task3
+        await task4
+    finally:
+        main.watchlist.symbols_added.disconnect(watch)
+        main.watchlist.symbols_removed.disconnect(unwatch)
+        for task in (task1, task2, task3, task4):
+            task.cancel()
+        credentials.unsubscribe(Stream)
+        await asyncio.to_thread(Stream.set_recorder, None)
+        if Stream.supervised:
+            with contextlib.suppress(Exception):
+                await Stream.close_stream_connection(Stream.next_request_id())
+
+async def engine_data(credentials: CredentialManager, ticker: str) -> None:
+    """
+    Streams through a MarketDataEngine process instead of an in-process Streamer. The engine writes the latest quote
+    of the ticker and the watchlist symbols into shared memory and once per render interval the rows that changed
+    are read from it. The engine's symbols are fixed, so editing the watchlist restarts it with the new list. An
+    engine process that exits fails the mode
+    """
+    main.set_plot_widget_title(ticker)
+    main.show_candles(ticker)
+    restart = asyncio.Event()
+
+    def symbols_changed(symbols: list) -> None:
+        restart.set()
+
+    async def read_engine(reader: QuoteTableReader) -> None:
         while True:
-            data = await Stream.data_queue.get()
-            await main.update_plot(data, True)
-
-    def request_counter(counter: int) -> int:
-        counter = counter + 1
-        return counter
-
-    task1 = asyncio.create_task(Stream.start_message_listener())
-    task2 = asyncio.create_task(Stream.request_level_one_equities(ticker, request_counter(0)))
-    task3 = asyncio.create_task(update_graph())
-
-    await task1
-    await task2
-    await task3
-
-async def main_func():
-    access_token = authenticate_user()
-    historical = PriceHistory(access_token)
-
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    flag = True
-    #historical.get_market_hours('equity')['equity']['EQ']['isOpen']
-    if flag:
+            await asyncio.sleep(main.render_scheduler.interval)
+            quotes = reader.poll()
+            if quotes:
+                message = ['Equities', *quotes]
+                main.bars.on_message(message)
+                await main.update_plot(message, True)
+
+    main.watchlist.symbols_added.connect(symbols_changed)
+    main.watchlist.symbols_removed.connect(symbols_changed)
+    try:
         while True:
-            data = await main.requested_stock_data()
-            if data:
-                break
-        data = historical.get_stock_price_history(data)
-        data = data['candles']
-        main.set_plot_widget_title()
-        await main.update_plot(data, False)
-        #future below is just to keep program open. This future is never set or marked as done
-        await future
-    else:
-        main.disable_historical_equity_widgets()
-        data = await main.requested_stock_data()
-        await stream_data(access_token, data['symbol'])
+            restart.clear()
+            engine = MarketDataEngine(credentials.access_token, [ticker, *main.watchlist.symbols()],
+                                      credentials.credentials.token_file)
+            engine.start()
+            tasks = [asyncio.create_task(read_engine(QuoteTableReader(engine.table))),
+                     asyncio.create_task(engine.wait()), asyncio.create_task(restart.wait())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+                if engine.exitcode is not None:
+                    raise ConnectionError(f'Market data engine exited with code {engine.exitcode}')
+            finally:
+                for task in tasks:
+                    task.cancel()
+                engine.stop()
+    finally:
+        main.watchlist.symbols_added.disconnect(symbols_changed)
+        main.watchlist.symbols_removed.disconnect(symbols_changed)
+
+async def fill_watchlist(historical: PriceHistory, symbols: list) -> None:
+    """
+    Shows the last daily close of every watchlist symbol, fetched concurrently, while the market is closed
+    """
+    async for symbol, candles in historical.get_price_histories(symbols, WATCHLIST_HISTORY):
+        if candles is not None and len(candles):
+            main.watchlist.update_quotes([quote_from_candles(symbol, candles)])
+            main.render_scheduler.mark_dirty()
 
+async def historical_mode(historical: PriceHistory) -> None:
+    """
+    Charts the price history of the submitted ticker while the market is closed
+    """
+    main.enable_historical_equity_widgets()
+    main.clear_chart()
+    fills = set()
+
+    def watch(symbols: list) -> None:
+        task = asyncio.create_task(fill_watchlist(historical, symbols))
+        fills.add(task)
+        task.add_done_callback(fills.discard)
+
+    if main.watchlist.symbols():
+        watch(main.watchlist.symbols())
+    main.watchlist.symbols_added.connect(watch)
+    try:
+        request = await main.chart_request()
+        data = await asyncio.to_thread(historical.get_candle_frame, request)
+        main.set_plot_widget_title(request['symbol'])
+        await main.update_plot(data, False)
+        #event below is just to keep the mode running until the session changes. This event is never set
+        await Event().wait()
+    finally:
+        main.watchlist.symbols_added.disconnect(watch)
+        for task in list(fills):
+            task.cancel()
+
+async def replay_data(path: str, ticker: str, speed: Optional[float]) -> None:
+    """
+    Feeds a recorded tick log through the Streamer parsers and the chart without a Schwab session. speed 1 replays
+    at the recorded pace, N plays N times faster and None as fast as possible
+    """
+    Stream = Streamer('replay')
+    quote_queue = TickQueue(policy='conflate', name='data')
+    chart_queue = asyncio.Queue()
+    Stream.set_data_queue(BarFeed(main.bars, quote_queue))
+    Stream.set_data_queue(BarFeed(main.bars, chart_queue), 'CHART_EQUITY')
+    Stream.open_replay(path, speed)
+
+    main.plot_widget.setTitle(ticker)
+    main.show_candles(ticker)
+
+    tasks = [asyncio.create_task(update_graph(quote_queue)), asyncio.create_task(update_graph(chart_queue))]
+    start = time.perf_counter()
+    await Stream.start_message_listener()
+    print(f'Replayed {Stream.websocket.frames} frames in {time.perf_counter() - start:.2f}s')
+    await asyncio.gather(*tasks)
+
+async def streaming_mode(credentials: CredentialManager, historical: PriceHistory,
+                         record_path: Optional[str] = None, use_engine: bool = False) -> None:
+    """
+    Streams the submitted ticker while the market is open, in a MarketDataEngine process when use_engine is set
+    """
+    main.disable_historical_equity_widgets()
+    main.clear_chart()
+    data = await main.chart_request()
+    if use_engine:
+        await engine_data(credentials, data['symbol'])
+        return
+    await stream_data(credentials, data['symbol'], historical, record_path)
+
+async def main_func(record_path: Optional[str] = None, use_engine: bool = False, base_delay: float = 5.0,
+                    max_delay: float = 300.0):
+    credentials = await authenticate_user()
+    calendar = MarketCalendar('../data/market_calendar.json')
+    historical = PriceHistory(credentials.access_token,
+                              PriceHistoryCache('../data/price_history.sqlite3', closed_until=calendar.closed_until))
+    credentials.subscribe(historical)
+
+    async def refresh_calendar() -> None:
+        try:
+            await asyncio.to_thread(calendar.refresh, historical.get_market_hours)
+        except Exception as e:
+            print(f'Failed to refresh market hours: {e!r}')
+
+    await refresh_calendar()
+
+    #runs historical mode while the market is closed and streaming mode while it is open, switching at every open
+    #and close. The extra second keeps a timer that fires a little early from restarting the same mode. A mode that
+    #fails is logged and started again after an exponential backoff, or at the next transition if that comes first
+    failures = 0
+    while True:
+        if calendar.is_open():
+            name = 'Streaming mode'
+            mode = asyncio.create_task(streaming_mode(credentials, historical, record_path, use_engine))
+        else:
+            name = 'Historical mode'
+            mode = asyncio.create_task(historical_mode(historical))
+
+        transition = calendar.next_transition()
+        done, _ = await asyncio.wait({mode}, timeout=max(0.0, transition - time.time()) + 1)
+        if mode in done:
+            delay = max(0.0, transition - time.time()) + 1
+            error = None if mode.cancelled() else mode.exception()
+            if error is None:
+                failures = 0
+            else:
+                delay = min(delay, min(max_delay, base_delay * 2 ** failures))
+                failures += 1
+                print(f'{name} failed, restarting in {delay:.0f}s: {error!r}')
+            await asyncio.sleep(delay)
+        else:
+            failures = 0
+            mode.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await mode
+        await refresh_calendar()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stock trading charts')
+    parser.add_argument('--record', metavar='PATH', help='append every received stream frame to a tick log')
+    parser.add_argument('--replay', metavar='PATH', help='chart a recorded tick log instead of connecting to Schwab')
+    parser.add_argument('--symbol', default='AAPL', help='symbol whose candles are drawn during a replay')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--engine', action='store_true',
+                        help='stream in a separate market data engine process that shares quotes through memory')
+    parser.add_argument('--metrics', action='store_true',
+                        help='keep the local server running for the whole session so /metrics can be scraped')
+    args = parser.parse_args()
+
+    tickers.preload()
+    if args.metrics:
+        server.start_server()
+
     app = QtWidgets.QApplication([])
     event_loop = qasync.QEventLoop(app)
     asyncio.set_event_loop(event_loop)
@@ -355,5 +852,8 @@ if __name__ == '__main__':
     main.show()
 
     with event_loop:
-        event_loop.run_until_complete(main_func())
+        if args.replay:
+            event_loop.run_until_complete(replay_data(args.replay, args.symbol.upper(), args.speed or None))
+        else:
+            event_loop.run_until_complete(main_func(args.record, args.engine))
 
@@ -0,0 +1,215 @@
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+import threading
+import sqlite3
+import math
+import time
+
+"""SQLite cache for pricehistory responses keyed by the request parameters, with incremental top-up fetches"""
+
+MARKET_TIMEZONE = ZoneInfo('America/New_York')
+REQUEST_KEYS = ('symbol', 'periodType', 'period', 'frequencyType', 'frequency')
+RANGE_KEYS = ('startDate', 'endDate')
+ROLLING_PERIOD_TYPES = ('day', 'month', 'year')
+
+
+def closed_until(now: float) -> Optional[float]:
+    """
+    Returns None while the regular weekday 9:30-16:00 New York session is open, otherwise the epoch time of the next
+    open. Holidays are not known here, which only makes the cache refresh a little more often than needed
+    """
+    local = datetime.fromtimestamp(now, tz=MARKET_TIMEZONE)
+    open_time = local.replace(hour=9, minute=30, second=0, microsecond=0)
+    close_time = local.replace(hour=16, minute=0, second=0, microsecond=0)
+    if local.weekday() < 5 and open_time <= local < close_time:
+        return None
+
+    if local >= open_time:
+        open_time += timedelta(days=1)
+    while open_time.weekday() >= 5:
+        open_time += timedelta(days=1)
+    return open_time.timestamp()
+
+
+class PriceHistoryCache(object):
+    """
+    Stores candles per (symbol, periodType, period, frequencyType, frequency), plus startDate and endDate when the
+    request has them. Freshness depends on where the requested range ends, which is now unless endDate is given. A
+    range that reaches a session in progress is served for live_ttl seconds and then topped up with only the
+    candles newer than the last cached one, a range that reaches the next session is served until that session
+    opens, and a range that ended in a finished session or while the market was closed never changes. Only a
+    rolling day, month or year window drops its oldest candles on a top-up. closed_until returns None while the
+    market is open and otherwise the epoch time of the next open
+    """
+    def __init__(self, path: str, live_ttl: float = 60.0,
+                 closed_until: Callable[[float], Optional[float]] = closed_until) -> None:
+        self.path = path
+        self.live_ttl = live_ttl
+        self.closed_until = closed_until
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS requests (
+                key TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                previous_close REAL,
+                previous_close_date INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS candles (
+                key TEXT NOT NULL,
+                datetime INTEGER NOT NULL,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                volume INTEGER,
+                PRIMARY KEY (key, datetime)
+            ) WITHOUT ROWID;
+        """)
+
+    @staticmethod
+    def request_key(request_data: dict) -> str:
+        """
+        Returns the cache key for a pricehistory request
+        """
+        key = '|'.join(str(request_data[key]).lower() if key != 'symbol' else str(request_data[key]).upper()
+                       for key in REQUEST_KEYS)
+        for range_key in RANGE_KEYS:
+            if range_key in request_data:
+                key += f'|{range_key}={int(request_data[range_key])}'
+        return key
+
+    @staticmethod
+    def range_end(request_data: dict) -> float:
+        """
+        Returns the epoch seconds the requested range ends at, inf for a period that runs up to now
+        """
+        if 'endDate' in request_data:
+            return int(request_data['endDate']) / 1000
+        return math.inf
+
+    @staticmethod
+    def rolling_window(request_data: dict) -> bool:
+        """
+        Returns True if the requested range is the last period of days, months or years up to now, whose start moves
+        forward with every top-up. ytd and ranges with a startDate or endDate have a fixed start
+        """
+        return (str(request_data.get('periodType', '')).lower() in ROLLING_PERIOD_TYPES and
+                not any(range_key in request_data for range_key in RANGE_KEYS))
+
+    def expires_at(self, fetched_at: float, end: float) -> float:
+        """
+        Returns until when an entry fetched at fetched_at for a range ending at end can be served without asking the
+        API
+        """
+        next_open = self.closed_until(fetched_at)
+        if next_open is None:
+            if end >= fetched_at:
+                return fetched_at + self.live_ttl
+            same_day = (datetime.fromtimestamp(end, tz=MARKET_TIMEZONE).date() ==
+                        datetime.fromtimestamp(fetched_at, tz=MARKET_TIMEZONE).date())
+            if same_day and self.closed_until(end) is None:
+                return fetched_at + self.live_ttl
+            return math.inf
+        if end < next_open:
+            return math.inf
+        return next_open
+
+    def is_fresh(self, fetched_at: float, now: float, end: float = math.inf) -> bool:
+        """
+        Returns True if an entry fetched at fetched_at for a range ending at end can be served without asking the
+        API
+        """
+        return now - fetched_at < self.live_ttl or now < self.expires_at(fetched_at, end)
+
+    def get(self, request_data: dict, fetch: Callable[[dict], dict]) -> dict:
+        """
+        Returns the pricehistory response for request_data from the cache, topping it up or filling it with fetch
+        when needed. fetch takes request_data, optionally with startDate and endDate in epoch ms, and returns the
+        API response
+        """
+        key = self.request_key(request_data)
+        now = time.time()
+        entry = self.load_entry(key)
+
+        end = self.range_end(request_data)
+        if entry is not None and self.is_fresh(entry['fetched_at'], now, end):
+            return self.build_response(key, entry)
+
+        last_datetime = self.last_datetime(key) if entry is not None else None
+        if last_datetime is None:
+            response = fetch(request_data)
+            self.store(key, request_data['symbol'], response, now, replace=True)
+        else:
+            top_up_request = dict(request_data)
+            top_up_request['startDate'] = last_datetime
+            top_up_request['endDate'] = int(min(now, end) * 1000)
+            response = fetch(top_up_request)
+            self.store(key, request_data['symbol'], response, now, replace=False,
+                       previous_last=last_datetime if self.rolling_window(request_data) else None)
+
+        return self.build_response(key, self.load_entry(key))
+
+    def load_entry(self, key: str) -> Optional[dict]:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT symbol, fetched_at, previous_close, previous_close_date FROM requests WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return {'symbol': row[0], 'fetched_at': row[1], 'previous_close': row[2], 'previous_close_date': row[3]}
+
+    def last_datetime(self, key: str) -> Optional[int]:
+        with self.lock:
+            row = self.connection.execute('SELECT MAX(datetime) FROM candles WHERE key = ?', (key,)).fetchone()
+        return row[0]
+
+    def store(self, key: str, symbol: str, response: dict, fetched_at: float, replace: bool,
+              previous_last: Optional[int] = None) -> None:
+        """
+        Writes a response into the cache. A full fetch replaces the entry's candles. A top-up upserts the new
+        candles, and with previous_last, the last cached candle of a rolling window, also drops as many of the oldest
+        ones as the window moved forward, so the entry keeps covering the requested period
+        """
+        candles = response.get('candles', [])
+        rows = [(key, candle['datetime'], candle['open'], candle['high'], candle['low'], candle['close'],
+                 candle['volume']) for candle in candles]
+
+        with self.lock, self.connection:
+            if replace:
+                self.connection.execute('DELETE FROM candles WHERE key = ?', (key,))
+            self.connection.executemany('INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+            if previous_last is not None and rows:
+                shift = max(row[1] for row in rows) - previous_last
+                if shift > 0:
+                    first = self.connection.execute('SELECT MIN(datetime) FROM candles WHERE key = ?',
+                                                    (key,)).fetchone()[0]
+                    self.connection.execute('DELETE FROM candles WHERE key = ? AND datetime < ?',
+                                            (key, first + shift))
+
+            self.connection.execute(
+                'INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?)',
+                (key, symbol.upper(), fetched_at, response.get('previousClose'), response.get('previousCloseDate')))
+
+    def build_response(self, key: str, entry: dict) -> dict:
+        """
+        Rebuilds a pricehistory response from the cached candles
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT datetime, open, high, low, close, volume FROM candles WHERE key = ? ORDER BY datetime',
+                (key,)).fetchall()
+
+        candles = [{'open': row[1], 'high': row[2], 'low': row[3], 'close': row[4], 'volume': row[5],
+                    'datetime': row[0]} for row in rows]
+        response = {'candles': candles, 'symbol': entry['symbol'], 'empty': not candles}
+        if entry['previous_close'] is not None:
+            response['previousClose'] = entry['previous_close']
+            response['previousCloseDate'] = entry['previous_close_date']
+        return response
+
+    def close(self) -> None:
+        self.connection.close()
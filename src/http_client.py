@@ -0,0 +1,168 @@
+from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import threading
+import asyncio
+import random
+import time
+import os
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+"""Shared HTTP clients with keep-alive connection pooling, timeouts and retry with backoff on 429/5xx responses"""
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Only idempotent requests are retried after they reached the server. The OAuth token POSTs exchange a single use
+# code or refresh token, so repeating one after a 5xx or read timeout could burn it; they are only retried when the
+# connection could not be opened, which both clients do for every method
+RETRY_METHODS = frozenset({'GET'})
+
+DEFAULT_BASE_URL = 'https://api.schwabapi.com'
+
+
+def base_url() -> str:
+    """
+    Returns the root of the Schwab REST API. Set SCHWAB_BASE_URL to point every client at another server, such as
+    the local mock_schwab.py
+    """
+    return os.environ.get('SCHWAB_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket that spaces requests to stay under a per-minute quota. Up to burst requests go out at
+    once and after that one token is added every 60 / requests_per_minute seconds
+    """
+    def __init__(self, requests_per_minute: float, burst: Optional[int] = None) -> None:
+        self.rate = requests_per_minute / 60
+        self.capacity = float(burst if burst is not None else requests_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token and returns how many seconds the caller has to wait before using it
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class HTTPClient(object):
+    """
+    Wraps a requests.Session so every call to the Schwab API reuses pooled TCP+TLS connections
+    """
+    def __init__(self, timeout: tuple = (3.05, 10), retries: int = 3, backoff_factor: float = 0.5,
+                 pool_maxsize: int = 10) -> None:
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=RETRY_METHODS, respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncHTTPClient(object):
+    """
+    Async counterpart of HTTPClient for use on the qasync event loop. Uses a pooled httpx.AsyncClient when httpx is
+    installed and otherwise runs the blocking HTTPClient in a worker thread so the GUI never stalls on the network
+    """
+    def __init__(self, timeout: tuple = (3.05, 10), retries: int = 3, backoff_factor: float = 0.5,
+                 pool_maxsize: int = 10, sync_client: Optional[HTTPClient] = None) -> None:
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        if httpx is not None:
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize))
+            self.sync_client = None
+        else:
+            self.client = None
+            self.sync_client = sync_client if sync_client is not None else default_client()
+
+    def backoff(self, attempt: int, response=None) -> float:
+        """
+        Returns how long to wait before retrying, honouring a Retry-After header when the server sent one
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def request(self, method: str, url: str, **kwargs):
+        if self.client is None:
+            func = self.sync_client.get if method == 'GET' else self.sync_client.post
+            return await asyncio.to_thread(func, url, **kwargs)
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except httpx.ConnectError:
+                if attempt >= self.retries:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            if response.status_code not in RETRY_STATUSES or method not in RETRY_METHODS or attempt >= self.retries:
+                return response
+            await asyncio.sleep(self.backoff(attempt, response))
+            attempt += 1
+
+    async def get(self, url: str, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+
+
+_default_client = None
+
+
+def default_client() -> HTTPClient:
+    """
+    Returns the process wide HTTPClient shared by PriceHistory, Streamer and APICredentials unless they are given
+    their own
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = HTTPClient()
+    return _default_client
@@ -0,0 +1,280 @@
+from collections import deque
+import math
+import numpy as np
+
+"""Technical indicators in two forms: vectorized over NumPy arrays for history and O(1) per tick for streaming.
+Both forms produce the same values, with NaN while an indicator warms up"""
+
+
+def sma(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Simple moving average
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) >= period:
+        sums = np.cumsum(values)
+        sums[period:] = sums[period:] - sums[:-period]
+        result[period - 1:] = sums[period - 1:] / period
+    return result
+
+
+def ema_alpha(values: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Exponential moving average with smoothing factor alpha, seeded with the first value. The recurrence is solved
+    in closed form over blocks short enough that the scaling factors stay well inside float64 range
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = len(values)
+    result = np.empty(count)
+    if count == 0:
+        return result
+
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        return values.copy()
+    block = max(1, int(300 / -math.log(decay)))
+    previous = values[0]
+    start = 0
+    while start < count:
+        chunk = values[start:start + block]
+        exponents = np.arange(1, len(chunk) + 1)
+        powers = decay ** exponents
+        weighted = np.cumsum(alpha * chunk / powers)
+        result[start:start + len(chunk)] = powers * (previous + weighted)
+        previous = result[start + len(chunk) - 1]
+        start += block
+    return result
+
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Exponential moving average with alpha = 2 / (period + 1)
+    """
+    result = ema_alpha(values, 2.0 / (period + 1))
+    result[:period - 1] = np.nan
+    return result
+
+
+def vwap(prices: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+    """
+    Volume weighted average price accumulated from the first value
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    total_volume = np.cumsum(volumes)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total_volume > 0, np.cumsum(prices * volumes) / total_volume, prices)
+
+
+def rsi(values: np.ndarray, period: int = 14) -> np.ndarray:
+    """
+    Relative strength index with Wilder smoothing (alpha = 1 / period) of gains and losses
+    """
+    values = np.asarray(values, dtype=np.float64)
+    changes = np.diff(values, prepend=values[:1])
+    average_gain = ema_alpha(np.maximum(changes, 0.0), 1.0 / period)
+    average_loss = ema_alpha(np.maximum(-changes, 0.0), 1.0 / period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = 100.0 - 100.0 / (1.0 + average_gain / average_loss)
+    result[(average_loss == 0) & (average_gain > 0)] = 100.0
+    result[(average_loss == 0) & (average_gain == 0)] = 50.0
+    result[:period] = np.nan
+    return result
+
+
+def bollinger(values: np.ndarray, period: int = 20, deviations: float = 2.0) -> tuple:
+    """
+    Returns the (middle, upper, lower) Bollinger bands using the population standard deviation
+    """
+    values = np.asarray(values, dtype=np.float64)
+    middle = sma(values, period)
+    centered = values - (values.mean() if len(values) else 0.0)
+    squares = sma(centered * centered, period)
+    centered_mean = sma(centered, period)
+    deviation = np.sqrt(np.maximum(squares - centered_mean * centered_mean, 0.0))
+    return middle, middle + deviations * deviation, middle - deviations * deviation
+
+
+def macd(values: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple:
+    """
+    Returns the (macd, signal, histogram) lines
+    """
+    line = ema_alpha(values, 2.0 / (fast + 1)) - ema_alpha(values, 2.0 / (slow + 1))
+    signal_line = ema_alpha(line, 2.0 / (signal + 1))
+    line[:slow - 1] = np.nan
+    signal_line[:slow + signal - 2] = np.nan
+    return line, signal_line, line - signal_line
+
+
+class SMA(object):
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.window = deque()
+        self.total = 0.0
+
+    def load(self, values: np.ndarray) -> np.ndarray:
+        """
+        Computes the indicator over a whole array and continues from its end on the next update
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.window = deque(values[-self.period:].tolist())
+        self.total = float(sum(self.window))
+        return sma(values, self.period)
+
+    def update(self, value: float) -> float:
+        self.window.append(value)
+        self.total += value
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        if len(self.window) < self.period:
+            return math.nan
+        return self.total / self.period
+
+
+class EMAlpha(object):
+    """
+    Exponential moving average with an explicit smoothing factor, seeded with the first value
+    """
+    def __init__(self, alpha: float) -> None:
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value: float) -> float:
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class EMA(object):
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.average = EMAlpha(2.0 / (period + 1))
+        self.count = 0
+
+    def load(self, values: np.ndarray) -> np.ndarray:
+        result = ema_alpha(values, self.average.alpha)
+        self.average.value = float(result[-1]) if len(result) else None
+        self.count = len(result)
+        result[:self.period - 1] = np.nan
+        return result
+
+    def update(self, value: float) -> float:
+        self.count += 1
+        result = self.average.update(value)
+        return result if self.count >= self.period else math.nan
+
+
+class VWAP(object):
+    def __init__(self) -> None:
+        self.total_value = 0.0
+        self.total_volume = 0.0
+
+    def load(self, prices: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+        prices = np.asarray(prices, dtype=np.float64)
+        volumes = np.asarray(volumes, dtype=np.float64)
+        self.total_value = float(np.dot(prices, volumes))
+        self.total_volume = float(volumes.sum())
+        return vwap(prices, volumes)
+
+    def update(self, price: float, volume: float) -> float:
+        self.total_value += price * volume
+        self.total_volume += volume
+        return self.total_value / self.total_volume if self.total_volume > 0 else price
+
+
+class RSI(object):
+    def __init__(self, period: int = 14) -> None:
+        self.period = period
+        self.average_gain = EMAlpha(1.0 / period)
+        self.average_loss = EMAlpha(1.0 / period)
+        self.previous = None
+        self.count = 0
+
+    def load(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        changes = np.diff(values, prepend=values[:1])
+        gains = ema_alpha(np.maximum(changes, 0.0), self.average_gain.alpha)
+        losses = ema_alpha(np.maximum(-changes, 0.0), self.average_loss.alpha)
+        self.average_gain.value = float(gains[-1]) if len(values) else None
+        self.average_loss.value = float(losses[-1]) if len(values) else None
+        self.previous = float(values[-1]) if len(values) else None
+        self.count = len(values)
+        return rsi(values, self.period)
+
+    def update(self, value: float) -> float:
+        change = 0.0 if self.previous is None else value - self.previous
+        self.previous = value
+        self.count += 1
+        gain = self.average_gain.update(max(change, 0.0))
+        loss = self.average_loss.update(max(-change, 0.0))
+        if self.count <= self.period:
+            return math.nan
+        if loss == 0:
+            return 100.0 if gain > 0 else 50.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+
+class Bollinger(object):
+    def __init__(self, period: int = 20, deviations: float = 2.0) -> None:
+        self.period = period
+        self.deviations = deviations
+        self.window = deque()
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def load(self, values: np.ndarray) -> tuple:
+        values = np.asarray(values, dtype=np.float64)
+        self.window = deque(values[-self.period:].tolist())
+        self.total = float(sum(self.window))
+        self.total_squares = float(sum(value * value for value in self.window))
+        return bollinger(values, self.period, self.deviations)
+
+    def update(self, value: float) -> tuple:
+        self.window.append(value)
+        self.total += value
+        self.total_squares += value * value
+        if len(self.window) > self.period:
+            old = self.window.popleft()
+            self.total -= old
+            self.total_squares -= old * old
+        if len(self.window) < self.period:
+            return math.nan, math.nan, math.nan
+        middle = self.total / self.period
+        deviation = math.sqrt(max(self.total_squares / self.period - middle * middle, 0.0))
+        return middle, middle + self.deviations * deviation, middle - self.deviations * deviation
+
+
+class MACD(object):
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9) -> None:
+        self.fast = fast
+        self.slow = slow
+        self.signal_period = signal
+        self.fast_average = EMAlpha(2.0 / (fast + 1))
+        self.slow_average = EMAlpha(2.0 / (slow + 1))
+        self.signal_average = EMAlpha(2.0 / (signal + 1))
+        self.count = 0
+
+    def load(self, values: np.ndarray) -> tuple:
+        fast = ema_alpha(values, self.fast_average.alpha)
+        slow = ema_alpha(values, self.slow_average.alpha)
+        signal_line = ema_alpha(fast - slow, self.signal_average.alpha)
+        if len(fast):
+            self.fast_average.value = float(fast[-1])
+            self.slow_average.value = float(slow[-1])
+            self.signal_average.value = float(signal_line[-1])
+        self.count = len(fast)
+        return macd(values, self.fast, self.slow, self.signal_period)
+
+    def update(self, value: float) -> tuple:
+        self.count += 1
+        line = self.fast_average.update(value) - self.slow_average.update(value)
+        signal_line = self.signal_average.update(line)
+        if self.count < self.slow:
+            return math.nan, math.nan, math.nan
+        if self.count < self.slow + self.signal_period - 1:
+            return line, math.nan, math.nan
+        return line, signal_line, line - signal_line
+
@@ -0,0 +1,173 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+import threading
+import json
+import time
+import os
+from history_cache import MARKET_TIMEZONE, closed_until
+
+"""Caches the exchange's session hours on disk and answers market open and close questions without the network"""
+
+CALENDAR_VERSION = 1
+
+
+def market_date(now: float) -> str:
+    """
+    Returns the New York calendar date of an epoch time as YYYY-MM-DD
+    """
+    return datetime.fromtimestamp(now, tz=MARKET_TIMEZONE).date().isoformat()
+
+
+def parse_sessions(response: dict, market: str, session_types: Iterable[str]) -> list:
+    """
+    Returns the sorted [start, end] epoch seconds of every session of the given types in a markets response
+    """
+    sessions = set()
+    for product in response.get(market, {}).values():
+        if not product.get('isOpen'):
+            continue
+        hours = product.get('sessionHours') or {}
+        for session_type in session_types:
+            for session in hours.get(session_type, []):
+                sessions.add((datetime.fromisoformat(session['start']).timestamp(),
+                              datetime.fromisoformat(session['end']).timestamp()))
+    return [list(session) for session in sorted(sessions)]
+
+
+class MarketCalendar(object):
+    """
+    Session hours per market date, fetched once per date from the markets endpoint and kept in a json file. Lookups
+    are a bisect over the cached session boundaries. Dates that were never fetched fall back to the weekday
+    9:30-16:00 New York schedule, so the calendar still answers while offline or before its first refresh
+    """
+    def __init__(self, path: str, market: str = 'equity', days: int = 7,
+                 session_types: Iterable[str] = ('regularMarket',),
+                 fallback: Callable[[float], Optional[float]] = closed_until) -> None:
+        self.path = path
+        self.market = market
+        self.days = days
+        self.session_types = tuple(session_types)
+        self.fallback = fallback
+        self.sessions = {}
+        self.bounds = ([], [])
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get('version') == CALENDAR_VERSION and data.get('market') == self.market:
+            self.sessions = data['sessions']
+            self.rebuild()
+
+    def save(self) -> None:
+        """
+        Writes the calendar to a temporary file and renames it over the old one
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': CALENDAR_VERSION, 'market': self.market, 'sessions': self.sessions}, f)
+        os.replace(temp_path, self.path)
+
+    def rebuild(self) -> None:
+        """
+        Rebuilds the sorted session starts and ends. They are swapped in as one tuple so lookups on other threads
+        never see the two lists out of step
+        """
+        boundaries = sorted(tuple(session) for sessions in self.sessions.values() for session in sessions)
+        self.bounds = ([start for start, _ in boundaries], [end for _, end in boundaries])
+
+    def missing_dates(self, now: float) -> list:
+        today = datetime.fromtimestamp(now, tz=MARKET_TIMEZONE).date()
+        dates = [(today + timedelta(days=offset)).isoformat() for offset in range(self.days)]
+        return [date for date in dates if date not in self.sessions]
+
+    def refresh(self, fetch_hours: Callable[[str, str], dict], now: Optional[float] = None) -> int:
+        """
+        Fetches the hours of every date from today through the next days - 1 days that is not cached yet and drops
+        dates more than a week old. fetch_hours takes the market and a YYYY-MM-DD date. Returns the number of dates
+        fetched
+        """
+        now = time.time() if now is None else now
+        fetched = {}
+        for date in self.missing_dates(now):
+            try:
+                fetched[date] = parse_sessions(fetch_hours(self.market, date), self.market, self.session_types)
+            except Exception as e:
+                print(f'Failed to fetch {self.market} market hours for {date}: {e!r}')
+                break
+
+        oldest = market_date(now - 7 * 86400)
+        with self.lock:
+            self.sessions = {date: sessions for date, sessions in self.sessions.items() if date >= oldest}
+            self.sessions.update(fetched)
+            self.rebuild()
+        if fetched:
+            self.save()
+        return len(fetched)
+
+    def covers(self, now: float) -> bool:
+        return market_date(now) in self.sessions
+
+    def session(self, now: Optional[float] = None) -> Optional[tuple]:
+        """
+        Returns the (start, end) epoch seconds of the session in progress, or None while the market is closed
+        """
+        now = time.time() if now is None else now
+        if not self.covers(now):
+            if self.fallback(now) is not None:
+                return None
+            local = datetime.fromtimestamp(now, tz=MARKET_TIMEZONE)
+            return (local.replace(hour=9, minute=30, second=0, microsecond=0).timestamp(),
+                    local.replace(hour=16, minute=0, second=0, microsecond=0).timestamp())
+
+        starts, ends = self.bounds
+        index = bisect_right(starts, now) - 1
+        if index >= 0 and now < ends[index]:
+            return starts[index], ends[index]
+        return None
+
+    def is_open(self, now: Optional[float] = None) -> bool:
+        return self.session(now) is not None
+
+    def next_open(self, now: Optional[float] = None) -> float:
+        """
+        Returns the start of the first session that begins after now
+        """
+        now = time.time() if now is None else now
+        starts = self.bounds[0]
+        index = bisect_right(starts, now)
+        if index < len(starts) and self.covers(now):
+            return starts[index]
+
+        # Past the fetched dates, continue from the later of now and the end of the last cached date
+        after = now
+        if self.sessions and self.covers(now):
+            last_date = datetime.fromisoformat(max(self.sessions)) + timedelta(days=1)
+            after = max(now, last_date.replace(tzinfo=MARKET_TIMEZONE).timestamp())
+        next_open = self.fallback(after)
+        while next_open is None:
+            after = self.session(after)[1]
+            next_open = self.fallback(after)
+        return next_open
+
+    def closed_until(self, now: float) -> Optional[float]:
+        """
+        None while the market is open, otherwise the next open. Same contract as history_cache.closed_until, so a
+        PriceHistoryCache can use the calendar for its freshness decisions
+        """
+        if self.is_open(now):
+            return None
+        return self.next_open(now)
+
+    def next_transition(self, now: Optional[float] = None) -> float:
+        """
+        Returns when the market next opens or closes
+        """
+        now = time.time() if now is None else now
+        session = self.session(now)
+        return session[1] if session is not None else self.next_open(now)
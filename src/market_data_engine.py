@@ -0,0 +1,288 @@
+from multiprocessing import shared_memory, resource_tracker
+from typing import Iterable, Optional
+import multiprocessing
+import asyncio
+import sys
+import time
+import numpy as np
+
+"""Runs the streamer and parsers in their own process and publishes the latest quote per symbol in shared memory"""
+
+QUOTE_DTYPE = np.dtype([
+    ('seq', np.uint64),
+    ('symbol', 'S24'),
+    ('bid', np.float64),
+    ('ask', np.float64),
+    ('last', np.float64),
+    ('bid_size', np.float64),
+    ('ask_size', np.float64),
+    ('last_size', np.float64),
+    ('volume', np.float64),
+    ('quote_time', np.int64),
+    ('trade_time', np.int64),
+    ('updated', np.float64),
+])
+
+FIELD_COLUMNS = {
+    'Bid Price': 'bid',
+    'Ask Price': 'ask',
+    'Last Price': 'last',
+    'Bid Size': 'bid_size',
+    'Ask Size': 'ask_size',
+    'Last Size': 'last_size',
+    'Total Volume': 'volume',
+    'Quote Time in Long': 'quote_time',
+    'Trade Time in Long': 'trade_time',
+}
+
+HEADER = np.dtype([('capacity', np.uint64), ('count', np.uint64)])
+
+created_tables = set()
+
+
+class QuoteTable(object):
+    """
+    Fixed layout table of the latest quote per symbol in a multiprocessing.shared_memory block. Rows are a NumPy
+    structured array with one symbol each. Every row carries a sequence counter that the writer makes odd while it
+    updates the row and even again afterwards, so readers in other processes can copy a row without locks and retry
+    if it changed underneath them
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        capacity = int(self.header['capacity'])
+        self.rows = np.ndarray((capacity,), dtype=QUOTE_DTYPE, buffer=shm.buf, offset=HEADER.itemsize)
+        self.index = {}
+        self.refresh_index()
+
+    @classmethod
+    def create(cls, symbols: Iterable[str], name: Optional[str] = None) -> 'QuoteTable':
+        """
+        Allocates a table with one row per symbol
+        """
+        symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols))
+        size = HEADER.itemsize + max(1, len(symbols)) * QUOTE_DTYPE.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        created_tables.add(shm._name)
+        header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        header['capacity'] = len(symbols)
+        header['count'] = len(symbols)
+        del header
+
+        table = cls(shm, owner=True)
+        table.rows[:] = np.zeros(len(symbols), dtype=QUOTE_DTYPE)
+        table.rows['symbol'] = [symbol.encode() for symbol in symbols]
+        table.refresh_index()
+        return table
+
+    @classmethod
+    def attach(cls, name: str) -> 'QuoteTable':
+        """
+        Opens a table created by another process. Only the creating process may unlink the block, so the attached
+        one is kept away from the resource tracker, which would otherwise unlink it when this process exits. A block
+        created by this same process stays registered for its owner
+        """
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False), owner=False)
+        shm = shared_memory.SharedMemory(name=name)
+        if shm._name not in created_tables:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def refresh_index(self) -> None:
+        self.index = {symbol.decode(): row for row, symbol in enumerate(self.rows['symbol'])}
+
+    def write(self, symbol: str, values: dict) -> bool:
+        """
+        Updates the columns in values for symbol. Returns False if the symbol has no row
+        """
+        row = self.index.get(symbol)
+        if row is None:
+            return False
+        record = self.rows[row]
+        record['seq'] += 1
+        for column, value in values.items():
+            record[column] = value
+        record['updated'] = time.time()
+        record['seq'] += 1
+        return True
+
+    def read(self, symbol: str, retries: int = 100) -> Optional[np.void]:
+        """
+        Returns a consistent copy of symbol's row, or None if it has no row or never settled
+        """
+        row = self.index.get(symbol)
+        if row is None:
+            return None
+        rows = self.rows
+        for _ in range(retries):
+            before = int(rows['seq'][row])
+            if before % 2 == 0:
+                copy = rows[row].copy()
+                if int(rows['seq'][row]) == before:
+                    return copy
+        return None
+
+    def snapshot(self) -> np.ndarray:
+        """
+        Returns a copy of the whole table in which every row is internally consistent
+        """
+        copy = self.rows.copy()
+        for _ in range(100):
+            unstable = np.nonzero((copy['seq'] % 2 == 1) | (copy['seq'] != self.rows['seq']))[0]
+            if len(unstable) == 0:
+                break
+            copy[unstable] = self.rows[unstable]
+        return copy
+
+    def view(self) -> np.ndarray:
+        """
+        Returns the shared rows without copying. Values may change while they are read
+        """
+        return self.rows
+
+    def close(self) -> None:
+        """
+        Detaches from the shared memory and frees it if this process created it
+        """
+        del self.header
+        del self.rows
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            created_tables.discard(self.shm._name)
+
+
+class QuoteTableReader(object):
+    """
+    Finds the rows written since the last poll by their sequence counters, comparing them on the shared array
+    without copying it, and returns only those rows as parsed LEVELONE_EQUITIES quotes
+    """
+    def __init__(self, table: QuoteTable) -> None:
+        self.table = table
+        self.symbols = list(table.index)
+        self.seen = np.zeros(len(self.symbols), dtype=np.uint64)
+
+    def poll(self) -> list:
+        """
+        Returns a display-name quote dict for every row that changed since the last call. Columns still 0 were
+        never received and are left out. A row caught in the middle of a write is returned by the next poll
+        """
+        quotes = []
+        for row in np.flatnonzero(self.table.view()['seq'] != self.seen).tolist():
+            symbol = self.symbols[row]
+            record = self.table.read(symbol)
+            if record is None:
+                continue
+            self.seen[row] = record['seq']
+            quote = {'Symbol': symbol}
+            for name, column in FIELD_COLUMNS.items():
+                if record[column]:
+                    quote[name] = record[column].item()
+            quotes.append(quote)
+        return quotes
+
+
+class QuoteTableWriter(object):
+    """
+    Stands in for the data queue of a Streamer inside the engine process and writes every parsed quote straight
+    into the shared table
+    """
+    def __init__(self, table: QuoteTable) -> None:
+        self.table = table
+        self.writes = 0
+
+    async def put(self, parsed_message: list) -> None:
+        for quote in parsed_message[1:]:
+            values = {FIELD_COLUMNS[name]: value for name, value in quote.items() if name in FIELD_COLUMNS}
+            if values and self.table.write(quote.get('Symbol'), values):
+                self.writes += 1
+
+
+async def run_engine_async(table_name: str, access_token: str, symbols: list, token_file: Optional[str]) -> None:
+    """
+    Streams LEVELONE_EQUITIES for symbols into the shared table until the process is stopped. When token_file is
+    given the access token is reloaded from it whenever another process refreshes it. If the supervised stream ends
+    its exception is raised, so the process exits with an error the owner can see
+    """
+    from data_streamer import Streamer
+    from subscriptions import SubscriptionManager
+    from token_store import TokenStore
+
+    table = QuoteTable.attach(table_name)
+    streamer = Streamer(access_token)
+    streamer.set_data_queue(QuoteTableWriter(table))
+    await asyncio.to_thread(streamer.get_streamer_info)
+    await streamer.start_stream_connection()
+
+    subscriptions = SubscriptionManager(streamer)
+    subscriptions.subscribe('LEVELONE_EQUITIES', symbols, fields=list(FIELD_COLUMNS))
+    listener = asyncio.create_task(streamer.run_supervised(subscriptions))
+    await subscriptions.flush()
+
+    tokens = TokenStore(token_file) if token_file else None
+    try:
+        while not listener.done():
+            await asyncio.wait({listener}, timeout=60)
+            if tokens is not None and tokens.reload_if_changed() and tokens.access_token:
+                streamer.update_access_token(tokens.access_token)
+        listener.result()
+        print('Market data engine stream ended')
+    finally:
+        table.close()
+
+
+def run_engine(table_name: str, access_token: str, symbols: list, token_file: Optional[str]) -> None:
+    asyncio.run(run_engine_async(table_name, access_token, symbols, token_file))
+
+
+class MarketDataEngine(object):
+    """
+    Owns the shared quote table and the process that fills it. Websocket I/O and parsing happen in that process, so
+    a slow repaint in the GUI cannot delay message reception. Any number of viewer processes can attach to the
+    table by name
+    """
+    def __init__(self, access_token: str, symbols: Iterable[str], token_file: Optional[str] = None) -> None:
+        self.table = QuoteTable.create(symbols)
+        self.symbols = list(self.table.index)
+        self.access_token = access_token
+        self.token_file = token_file
+        self.process = None
+
+    @property
+    def table_name(self) -> str:
+        return self.table.name
+
+    def start(self) -> None:
+        self.process = multiprocessing.Process(
+            target=run_engine, args=(self.table.name, self.access_token, self.symbols, self.token_file),
+            daemon=True)
+        self.process.start()
+
+    @property
+    def exitcode(self) -> Optional[int]:
+        """
+        Returns the engine process's exit code, None while it runs or before it was started
+        """
+        return self.process.exitcode if self.process is not None else None
+
+    async def wait(self, interval: float = 1.0) -> Optional[int]:
+        """
+        Waits until the engine process exits and returns its exit code. The stream only ends on an error, so the
+        owner should treat any exit as a failure
+        """
+        while self.process is not None and self.process.is_alive():
+            await asyncio.sleep(interval)
+        return self.exitcode
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+        self.table.close()
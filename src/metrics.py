@@ -0,0 +1,220 @@
+from typing import Optional
+import threading
+import math
+import time
+
+"""Lightweight in-process metrics: log-linear latency histograms and counters with a Prometheus text export"""
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class Histogram(object):
+    """
+    HDR style histogram of positive values. Each power of two is split into sub_buckets linear buckets, so any
+    recorded value is reported within 1 / sub_buckets of its true value while record stays a couple of arithmetic
+    operations and memory stays fixed. Values below lowest are counted in the first bucket and values above highest
+    in the last. Negative values, such as a transit time measured against a clock that is behind the sender's, are
+    not latencies: they are only counted in negative and kept out of the buckets, count, total, min and max
+    """
+    def __init__(self, lowest: float = 1e-7, highest: float = 3600.0, sub_buckets: int = 64) -> None:
+        self.sub_buckets = sub_buckets
+        self.lowest = lowest
+        self.min_exponent = math.frexp(lowest)[1]
+        self.max_exponent = math.frexp(highest)[1]
+        self.counts = [0] * ((self.max_exponent - self.min_exponent + 1) * sub_buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.negative = 0
+
+    def index(self, value: float) -> int:
+        if value < self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value)
+        if exponent > self.max_exponent:
+            return len(self.counts) - 1
+        return (exponent - self.min_exponent) * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets)
+
+    def value_at(self, index: int) -> float:
+        """
+        Returns the middle of a bucket
+        """
+        exponent, sub_bucket = divmod(index, self.sub_buckets)
+        return math.ldexp(0.5 + (sub_bucket + 0.5) / (2 * self.sub_buckets), exponent + self.min_exponent)
+
+    def record(self, value: float) -> None:
+        if value < 0:
+            self.negative += 1
+            return
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, quantile: float) -> float:
+        """
+        Returns the value below which quantile of the recorded values fall, 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0.0
+        target = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(max(self.value_at(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.negative = 0
+
+
+class Counter(object):
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class MetricsRegistry(object):
+    """
+    Holds every histogram and counter by name and labels. Metrics are created on first use and recording never
+    locks; the registry lock guards creation and the snapshot exporters take of the metric tables, since they run on
+    the Flask thread while the event loop may be creating metrics
+    """
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    @staticmethod
+    def key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def histogram(self, name: str, help_text: str = '', **labels) -> Histogram:
+        key = self.key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+                self.help.setdefault(name, help_text)
+        return histogram
+
+    def counter(self, name: str, help_text: str = '', **labels) -> Counter:
+        key = self.key(name, labels)
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+                self.help.setdefault(name, help_text)
+        return counter
+
+    def snapshot(self) -> tuple:
+        """
+        Returns sorted copies of the (key, histogram) and (key, counter) items
+        """
+        with self.lock:
+            return sorted(self.histograms.items()), sorted(self.counters.items())
+
+    def summary(self) -> list:
+        """
+        Returns one line per metric for a debug overlay, histograms in milliseconds
+        """
+        histograms, counters = self.snapshot()
+        lines = []
+        for (name, labels), histogram in histograms:
+            if histogram.count or histogram.negative:
+                line = (f'{name}{format_labels(labels)} n={histogram.count} '
+                        f'p50={histogram.percentile(0.5) * 1e3:.2f}ms p99={histogram.percentile(0.99) * 1e3:.2f}ms '
+                        f'max={histogram.max * 1e3:.2f}ms')
+                if histogram.negative:
+                    line += f' negative={histogram.negative}'
+                lines.append(line)
+        for (name, labels), counter in counters:
+            lines.append(f'{name}{format_labels(labels)} {counter.value:,.0f}')
+        return lines
+
+    def prometheus(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format. Histograms are exported as summaries with
+        the QUANTILES, in seconds, and their negative samples as a <name>_negative_total counter
+        """
+        histograms, counters = self.snapshot()
+        lines = []
+        described = set()
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, "")}')
+                lines.append(f'# TYPE {name} summary')
+            for quantile in QUANTILES:
+                quantile_labels = labels + (('quantile', str(quantile)),)
+                lines.append(f'{name}{format_labels(quantile_labels)} {histogram.percentile(quantile):.9g}')
+            lines.append(f'{name}_sum{format_labels(labels)} {histogram.total:.9g}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        for (name, labels), histogram in histograms:
+            negative_name = f'{name}_negative_total'
+            if negative_name not in described:
+                described.add(negative_name)
+                lines.append(f'# HELP {negative_name} Negative samples of {name}, kept out of the summary')
+                lines.append(f'# TYPE {negative_name} counter')
+            lines.append(f'{negative_name}{format_labels(labels)} {histogram.negative}')
+        for (name, labels), counter in counters:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, "")}')
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{format_labels(labels)} {counter.value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+registry = MetricsRegistry()
+
+
+def histogram(name: str, help_text: str = '', **labels) -> Histogram:
+    """
+    Returns a histogram of the process wide registry
+    """
+    return registry.histogram(name, help_text, **labels)
+
+
+def counter(name: str, help_text: str = '', **labels) -> Counter:
+    """
+    Returns a counter of the process wide registry
+    """
+    return registry.counter(name, help_text, **labels)
+
+
+def exchange_time(quote) -> Optional[float]:
+    """
+    Returns the exchange time of a parsed quote in epoch seconds, using the trade time and falling back to the quote
+    time, or None when the quote carries neither. Latencies measured from it include any offset between the exchange
+    clock and this machine's clock
+    """
+    if not isinstance(quote, dict):
+        return None
+    exchange_ms = quote.get('Trade Time in Long') or quote.get('Quote Time in Long')
+    if not exchange_ms:
+        return None
+    return exchange_ms / 1000
@@ -0,0 +1,416 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from zlib import crc32
+from flask import Flask, request, redirect, jsonify
+from werkzeug.serving import make_server
+from websockets.asyncio.server import serve
+from history_cache import MARKET_TIMEZONE
+from data_streamer import SERVICE_SCHEMAS
+import websockets
+import threading
+import logging
+import argparse
+import asyncio
+import random
+import json
+import time
+
+"""Local stand-in for the Schwab REST API and streamer that serves synthetic prices and ticks for load testing.
+Run it with python mock_schwab.py and start the client with SCHWAB_BASE_URL=http://127.0.0.1:8183"""
+
+CADENCE = {'minute': 60, 'daily': 86400, 'weekly': 7 * 86400, 'monthly': 30 * 86400}
+PERIOD_DAYS = {'day': 1, 'month': 30, 'year': 365}
+MAX_CANDLES = 100000
+
+
+def field_kind(name: str) -> str:
+    """
+    Guesses how to synthesize a streamer field from its display name
+    """
+    if name == 'Symbol':
+        return 'symbol'
+    if name in ('Sequence', 'Chart Day'):
+        return 'counter'
+    if 'Time' in name or name.endswith('Date'):
+        return 'time'
+    if any(word in name for word in ('Size', 'Volume', 'Quantity', 'Interest')):
+        return 'size'
+    if name in ('Marginable', 'Shortable', 'shortable', 'Hard to Borrow', 'Regular Market Quote',
+                'Regular Market Trade', 'Is Tradable', 'Is Penny'):
+        return 'flag'
+    if any(word in name for word in ('Price', 'High', 'Low', 'Change', 'NAV', 'Rate', 'Yield', 'Amount', 'Ratio',
+                                     'Mark', 'Bid', 'Ask', 'Last', 'Close', 'Open', 'Volatility', 'Delta', 'Gamma',
+                                     'Theta', 'Vega', 'Rho', 'Value')):
+        return 'price'
+    return 'text'
+
+
+SERVICE_FIELD_KINDS = {service: {key: field_kind(name) for key, name in zip(schema.keys, schema.names)
+                                 if key != 'key'}
+                       for service, schema in SERVICE_SCHEMAS.items()}
+
+
+class SyntheticMarket(object):
+    """
+    Random walk prices per symbol, seeded from the symbol so every run and every connection sees the same market
+    """
+    def __init__(self) -> None:
+        self.prices = {}
+        self.volumes = {}
+        self.lock = threading.Lock()
+
+    def tick(self, symbol: str) -> float:
+        with self.lock:
+            price = self.prices.get(symbol)
+            if price is None:
+                price = 20 + crc32(symbol.encode()) % 480
+            price = max(0.01, price * (1 + random.gauss(0, 0.0005)))
+            self.prices[symbol] = price
+            self.volumes[symbol] = self.volumes.get(symbol, 0) + random.randint(1, 500)
+            return price
+
+    def quote(self, service: str, symbol: str, keys: list, full: bool, now_ms: int) -> dict:
+        """
+        Returns one content entry for symbol with the requested field keys. After the first update only the fields
+        that change on every tick are sent, as the real streamer does
+        """
+        kinds = SERVICE_FIELD_KINDS[service]
+        price = self.tick(symbol)
+        spread = max(0.01, round(price * 0.0002, 2))
+        content = {'key': symbol}
+        for key in keys:
+            kind = kinds.get(key)
+            if kind is None or (not full and kind in ('text', 'flag', 'symbol')):
+                continue
+            if kind == 'price':
+                content[key] = round(price + random.choice((-spread, 0.0, spread)), 2)
+            elif kind == 'size':
+                content[key] = self.volumes[symbol] if key == '8' else random.randint(1, 50) * 100
+            elif kind == 'time':
+                content[key] = now_ms
+            elif kind == 'counter':
+                content[key] = now_ms // 60000
+            elif kind == 'flag':
+                content[key] = True
+            elif kind == 'symbol':
+                content[key] = symbol
+            else:
+                content[key] = f'{symbol} mock'
+        return content
+
+    def chart_bar(self, symbol: str, sequence: int, now_ms: int) -> dict:
+        price = self.tick(symbol)
+        minute = now_ms - now_ms % 60000
+        return {'key': symbol, '1': round(price * 0.999, 2), '2': round(price * 1.001, 2),
+                '3': round(price * 0.998, 2), '4': round(price, 2), '5': random.randint(100, 10000),
+                '6': sequence, '7': minute, '8': minute // 86400000}
+
+    def candles(self, symbol: str, start_ms: int, end_ms: int, step_ms: int) -> list:
+        """
+        Returns candles from start_ms to end_ms every step_ms. The walk is seeded from the symbol and the first
+        candle time, so the same request always returns the same candles
+        """
+        first = start_ms - start_ms % step_ms + (step_ms if start_ms % step_ms else 0)
+        times = range(first, end_ms + 1, step_ms)
+        if len(times) > MAX_CANDLES:
+            times = times[-MAX_CANDLES:]
+        generator = random.Random(crc32(symbol.encode()) ^ first)
+        price = 20 + crc32(symbol.encode()) % 480
+        candles = []
+        for candle_time in times:
+            open_price = price
+            price = max(0.01, price * (1 + generator.gauss(0, 0.002)))
+            high = max(open_price, price) * (1 + abs(generator.gauss(0, 0.001)))
+            low = min(open_price, price) * (1 - abs(generator.gauss(0, 0.001)))
+            candles.append({'open': round(open_price, 2), 'high': round(high, 2), 'low': round(low, 2),
+                            'close': round(price, 2), 'volume': generator.randint(1000, 100000),
+                            'datetime': candle_time})
+        return candles
+
+
+def session_hours(date: str, always_open: bool) -> Optional[list]:
+    """
+    Returns the regular session of date as [{'start', 'end'}] in ISO format, or None on weekends
+    """
+    day = datetime.fromisoformat(date).replace(tzinfo=MARKET_TIMEZONE)
+    if always_open:
+        start, end = day, day + timedelta(days=1)
+    elif day.weekday() >= 5:
+        return None
+    else:
+        start, end = day.replace(hour=9, minute=30), day.replace(hour=16)
+    return [{'start': start.isoformat(), 'end': end.isoformat()}]
+
+
+def create_app(market: SyntheticMarket, stream_url: str, always_open: bool = False) -> Flask:
+    """
+    Builds the Flask app serving the OAuth, userPreference, pricehistory and markets endpoints
+    """
+    app = Flask(__name__)
+    issued = {'count': 0}
+
+    @app.route('/v1/oauth/authorize')
+    def authorize():
+        return redirect(f"{request.args.get('redirect_uri', '')}?code=mock-code&session=mock")
+
+    @app.route('/v1/oauth/token', methods=['POST'])
+    def token():
+        issued['count'] += 1
+        return jsonify({'access_token': f"mock-access-{issued['count']}", 'refresh_token': 'mock-refresh',
+                        'expires_in': 1800, 'token_type': 'Bearer', 'scope': 'api', 'id_token': 'mock-id'})
+
+    @app.route('/trader/v1/userPreference')
+    def user_preference():
+        return jsonify({'accounts': [], 'offers': [], 'streamerInfo': [{
+            'streamerSocketUrl': stream_url,
+            'schwabClientCustomerId': 'mock-customer',
+            'schwabClientCorrelId': 'mock-correl',
+            'schwabClientChannel': 'N9',
+            'schwabClientFunctionId': 'APIAPP'}]})
+
+    @app.route('/marketdata/v1/pricehistory')
+    def price_history():
+        symbol = request.args.get('symbol', '').upper()
+        period_type = request.args.get('periodType', 'day').lower()
+        period = int(request.args.get('period') or 1)
+        frequency_type = request.args.get('frequencyType', 'minute').lower()
+        frequency = int(request.args.get('frequency') or 1)
+
+        end_ms = int(request.args.get('endDate') or time.time() * 1000)
+        if request.args.get('startDate'):
+            start_ms = int(request.args['startDate'])
+        elif period_type == 'ytd':
+            start_ms = int(datetime(datetime.now().year, 1, 1).timestamp() * 1000)
+        else:
+            start_ms = end_ms - PERIOD_DAYS.get(period_type, 1) * period * 86400000
+
+        candles = market.candles(symbol, start_ms, end_ms, CADENCE.get(frequency_type, 60) * frequency * 1000)
+        response = {'candles': candles, 'symbol': symbol, 'empty': not candles}
+        if candles:
+            response['previousClose'] = candles[0]['open']
+            response['previousCloseDate'] = candles[0]['datetime']
+        return jsonify(response)
+
+    @app.route('/marketdata/v1/markets')
+    def markets():
+        date = request.args.get('date') or datetime.now(MARKET_TIMEZONE).date().isoformat()
+        response = {}
+        for name in request.args.get('markets', 'equity').lower().split(','):
+            hours = session_hours(date, always_open)
+            if hours is None:
+                response[name] = {name: {'date': date, 'marketType': name.upper(), 'product': name,
+                                         'isOpen': False}}
+            else:
+                response[name] = {'EQ': {'date': date, 'marketType': name.upper(), 'product': 'EQ',
+                                         'productName': name, 'isOpen': True,
+                                         'sessionHours': {'regularMarket': hours}}}
+        return jsonify(response)
+
+    return app
+
+
+class MockStreamConnection(object):
+    """
+    One client websocket. Requests are answered like the Schwab streamer and a sender loop pushes frames of
+    quotes_per_frame quotes for the subscribed LEVELONE symbols at rate frames per second, plus one CHART_EQUITY bar
+    per subscribed symbol every chart_interval seconds and a heartbeat every 10 seconds
+    """
+    def __init__(self, websocket, market: SyntheticMarket, rate: float, quotes_per_frame: int,
+                 chart_interval: float) -> None:
+        self.websocket = websocket
+        self.market = market
+        self.rate = rate
+        self.quotes_per_frame = quotes_per_frame
+        self.chart_interval = chart_interval
+        self.subscriptions = {}
+        self.sent_full = set()
+        self.logged_in = False
+        self.sequence = 0
+        self.frames_sent = 0
+
+    @staticmethod
+    def response(request_data: dict, code: int = 0, message: str = 'success') -> dict:
+        return {'service': request_data.get('service'), 'command': request_data.get('command'),
+                'requestid': str(request_data.get('requestid')),
+                'SchwabClientCorrelId': request_data.get('SchwabClientCorrelId'),
+                'timestamp': int(time.time() * 1000), 'content': {'code': code, 'msg': message}}
+
+    def apply(self, request_data: dict) -> dict:
+        """
+        Applies one request and returns its response entry
+        """
+        service = request_data.get('service')
+        command = request_data.get('command')
+        parameters = request_data.get('parameters') or {}
+        if service == 'ADMIN':
+            if command == 'LOGIN':
+                self.logged_in = True
+                return self.response(request_data, 0, 'server=mock;status=PN')
+            return self.response(request_data, 0, 'logged out')
+        if not self.logged_in:
+            return self.response(request_data, 3, 'login required')
+        if service not in SERVICE_FIELD_KINDS:
+            return self.response(request_data, 11, f'service {service} not available')
+
+        keys = [key.strip() for key in parameters.get('keys', '').split(',') if key.strip()]
+        subscription = self.subscriptions.setdefault(service, {'symbols': [], 'fields': []})
+        if 'fields' in parameters:
+            subscription['fields'] = [field.strip() for field in str(parameters['fields']).split(',')]
+        if command == 'SUBS':
+            subscription['symbols'] = list(dict.fromkeys(keys))
+        elif command == 'ADD':
+            subscription['symbols'] = list(dict.fromkeys(subscription['symbols'] + keys))
+        elif command == 'UNSUBS':
+            subscription['symbols'] = [symbol for symbol in subscription['symbols'] if symbol not in keys]
+        return self.response(request_data, 0, f'{command} command succeeded')
+
+    async def receive(self) -> None:
+        async for message in self.websocket:
+            requests_list = json.loads(message).get('requests', [])
+            responses = [self.apply(request_data) for request_data in requests_list]
+            await self.websocket.send(json.dumps({'response': responses}))
+            if any(r.get('service') == 'ADMIN' and r.get('command') == 'LOGOUT' for r in requests_list):
+                await self.websocket.close()
+                return
+
+    def quote_frames(self, now_ms: int):
+        """
+        Yields the data entries of one frame, cycling through the subscribed symbols of every LEVELONE service
+        """
+        for service, subscription in self.subscriptions.items():
+            if service == 'CHART_EQUITY' or not subscription['symbols']:
+                continue
+            symbols = subscription['symbols']
+            count = min(self.quotes_per_frame, len(symbols))
+            start = (self.frames_sent * count) % len(symbols)
+            chosen = [symbols[(start + offset) % len(symbols)] for offset in range(count)]
+            content = []
+            for symbol in chosen:
+                full = (service, symbol) not in self.sent_full
+                self.sent_full.add((service, symbol))
+                content.append(self.market.quote(service, symbol, subscription['fields'], full, now_ms))
+            yield {'service': service, 'timestamp': now_ms, 'command': 'SUBS', 'content': content}
+
+    async def send_ticks(self) -> None:
+        """
+        Sends frames on a fixed schedule. When the loop falls behind it sends without sleeping until it catches up,
+        so the configured rate is held as long as the host can keep up
+        """
+        interval = 1 / self.rate
+        next_frame = time.monotonic()
+        next_chart = next_frame
+        next_heartbeat = next_frame + 10
+        while True:
+            now = time.monotonic()
+            if now < next_frame:
+                await asyncio.sleep(next_frame - now)
+            next_frame += interval
+            now_ms = int(time.time() * 1000)
+
+            data = list(self.quote_frames(now_ms))
+            chart = self.subscriptions.get('CHART_EQUITY')
+            if chart and chart['symbols'] and time.monotonic() >= next_chart:
+                next_chart += self.chart_interval
+                content = []
+                for symbol in chart['symbols']:
+                    self.sequence += 1
+                    content.append(self.market.chart_bar(symbol, self.sequence, now_ms))
+                data.append({'service': 'CHART_EQUITY', 'timestamp': now_ms, 'command': 'SUBS', 'content': content})
+            if data:
+                await self.websocket.send(json.dumps({'data': data}))
+                self.frames_sent += 1
+            elif time.monotonic() - next_frame > 1:
+                next_frame = time.monotonic()
+
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat += 10
+                await self.websocket.send(json.dumps({'notify': [{'heartbeat': str(now_ms)}]}))
+            if self.frames_sent % 64 == 0:
+                await asyncio.sleep(0)
+
+    async def run(self) -> None:
+        sender = asyncio.create_task(self.send_ticks())
+        try:
+            await self.receive()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+
+
+class MockSchwabServer(object):
+    """
+    Runs the REST app and the streamer websocket on background threads, for use from tests and benchmarks
+    """
+    def __init__(self, host: str = '127.0.0.1', http_port: int = 8183, stream_port: int = 8184, rate: float = 100.0,
+                 quotes_per_frame: int = 10, chart_interval: float = 1.0, always_open: bool = False) -> None:
+        self.host = host
+        self.http_port = http_port
+        self.stream_port = stream_port
+        self.rate = rate
+        self.quotes_per_frame = quotes_per_frame
+        self.chart_interval = chart_interval
+        self.market = SyntheticMarket()
+        self.app = create_app(self.market, f'ws://{host}:{stream_port}', always_open)
+        self.http_server = None
+        self.stream_loop = None
+        self.stream_stop = None
+        self.threads = []
+        self.connections = []
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.http_port}'
+
+    async def handle_connection(self, websocket) -> None:
+        connection = MockStreamConnection(websocket, self.market, self.rate, self.quotes_per_frame,
+                                          self.chart_interval)
+        self.connections.append(connection)
+        await connection.run()
+
+    async def serve_stream(self, started: threading.Event) -> None:
+        self.stream_loop = asyncio.get_running_loop()
+        self.stream_stop = asyncio.Event()
+        async with serve(self.handle_connection, self.host, self.stream_port, max_size=None):
+            started.set()
+            await self.stream_stop.wait()
+
+    def start(self) -> None:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.http_server = make_server(self.host, self.http_port, self.app, threaded=True)
+        started = threading.Event()
+        self.threads = [threading.Thread(target=self.http_server.serve_forever, daemon=True),
+                        threading.Thread(target=asyncio.run, args=(self.serve_stream(started),), daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        started.wait(5)
+
+    def stop(self) -> None:
+        if self.http_server is not None:
+            self.http_server.shutdown()
+        if self.stream_loop is not None:
+            self.stream_loop.call_soon_threadsafe(self.stream_stop.set)
+        for thread in self.threads:
+            thread.join(5)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of the Schwab REST API and streamer')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--http-port', type=int, default=8183)
+    parser.add_argument('--stream-port', type=int, default=8184)
+    parser.add_argument('--rate', type=float, default=100.0, help='data frames per second per connection')
+    parser.add_argument('--quotes-per-frame', type=int, default=10, help='symbols per LEVELONE frame')
+    parser.add_argument('--chart-interval', type=float, default=1.0, help='seconds between CHART_EQUITY bars')
+    parser.add_argument('--always-open', action='store_true', help='report the market open all day, every day')
+    args = parser.parse_args()
+
+    mock = MockSchwabServer(args.host, args.http_port, args.stream_port, args.rate, args.quotes_per_frame,
+                            args.chart_interval, args.always_open)
+    mock.start()
+    print(f'Mock Schwab API at {mock.base_url}, streamer at ws://{args.host}:{args.stream_port}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
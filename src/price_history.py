@@ -1,14 +1,34 @@
-import requests
 from dotenv import dotenv_values
 from auth import APICredentials
 from requests import HTTPError
+from typing import AsyncIterator, Iterable, Optional
+from history_cache import PriceHistoryCache
+from http_client import HTTPClient, TokenBucket, base_url, default_client
+from candles import CandleFrame
+import asyncio
+
+REQUESTS_PER_MINUTE = 120
 
 
 
 class PriceHistory(object):
-    def __init__(self, access_token: str) -> None:
+    def __init__(self, access_token: str, cache: Optional[PriceHistoryCache] = None,
+                 client: Optional[HTTPClient] = None, limiter: Optional[TokenBucket] = None,
+                 api_base_url: Optional[str] = None) -> None:
+        self.access_token = access_token
+        self.cache = cache
+        self.client = client if client is not None else default_client()
+        self.limiter = limiter if limiter is not None else TokenBucket(REQUESTS_PER_MINUTE)
+        self.url = f'{api_base_url or base_url()}/marketdata/v1/'
+        self.auth_header = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+
+    def update_access_token(self, access_token: str) -> None:
+        """
+        Replaces the access token used for every following request
+        """
         self.access_token = access_token
-        self.url = 'https://api.schwabapi.com/marketdata/v1/'
         self.auth_header = {
             "Authorization": f"Bearer {self.access_token}"
         }
@@ -16,12 +36,56 @@ class PriceHistory(object):
     def get_stock_price_history(self, request_data:dict) -> dict:
         """
         This return the stock price history for the last year on daily frequency. This also shows extended
-        hours data and shows the previous close
+        hours data and shows the previous close. Responses are served from the cache when one is set
+        """
+        if self.cache is not None:
+            return self.cache.get(request_data, self.fetch_stock_price_history)
+        return self.fetch_stock_price_history(request_data)
+
+    def get_candle_frame(self, request_data: dict) -> CandleFrame:
+        """
+        Returns the stock price history as a CandleFrame
+        """
+        return CandleFrame.from_response(self.get_stock_price_history(request_data))
+
+    async def get_price_histories(self, symbols: Iterable[str], params: dict,
+                                  concurrency: int = 8) -> AsyncIterator[tuple]:
+        """
+        Fetches the price history of every symbol with the same periodType, period, frequencyType and frequency
+        params, up to concurrency requests at a time on worker threads. Yields (symbol, CandleFrame) pairs in the
+        order they complete so callers can show each one as it arrives. A symbol whose request fails is printed and
+        yielded with None. Requests that reach the API share the limiter, cache hits do not use it
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(symbol: str) -> tuple:
+            async with semaphore:
+                request_data = dict(params, symbol=symbol)
+                try:
+                    return symbol, await asyncio.to_thread(self.get_candle_frame, request_data)
+                except Exception as error:
+                    print(f'Error fetching price history for {symbol}: {error!r}')
+                    return symbol, None
+
+        tasks = [asyncio.create_task(fetch(symbol)) for symbol in dict.fromkeys(symbols)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def fetch_stock_price_history(self, request_data: dict) -> dict:
+        """
+        Requests the stock price history from the API. startDate and endDate in epoch ms are passed on when present
         """
-        print(request_data)
         url = (f"{self.url}pricehistory?symbol={request_data['symbol']}&periodType={request_data['periodType']}"
                f"&period={request_data['period']}&frequencyType={request_data['frequencyType']}&frequency={request_data['frequency']}")
-        response = requests.get(url, headers = self.auth_header)
+        for key in ('startDate', 'endDate'):
+            if key in request_data:
+                url += f"&{key}={request_data[key]}"
+        self.limiter.acquire()
+        response = self.client.get(url, headers = self.auth_header)
 
         if response.status_code == 200:
             return response.json()
@@ -29,12 +93,25 @@ class PriceHistory(object):
             print(f'Error reaching Schwab API, server response code: {response.status_code}')
             raise HTTPError
 
-    def get_market_hours(self, market:str) -> dict:
+    def get_minute_candles(self, symbol: str, start_ms: int, end_ms: int) -> CandleFrame:
+        """
+        Returns the one minute candles of symbol between start_ms and end_ms, used to fill gaps in a stream
+        """
+        request_data = {'symbol': symbol, 'periodType': 'day', 'period': 1, 'frequencyType': 'minute',
+                        'frequency': 1, 'startDate': start_ms, 'endDate': end_ms}
+        return CandleFrame.from_response(self.fetch_stock_price_history(request_data))
 
+    def get_market_hours(self, market:str, date: Optional[str] = None) -> dict:
+        """
+        Returns the session hours of market for today, or for date given as YYYY-MM-DD
+        """
         market = market.lower()
         url = f'{self.url}markets?markets={market}'
+        if date is not None:
+            url += f'&date={date}'
 
-        response = requests.get(url, headers= self.auth_header)
+        self.limiter.acquire()
+        response = self.client.get(url, headers= self.auth_header)
 
         if response.status_code == 200:
             return response.json()
@@ -0,0 +1,125 @@
+from typing import Optional
+import numpy as np
+
+"""Preallocated circular buffer for chart series that hands out contiguous NumPy views without copying"""
+
+COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity timestamp + OHLCV buffer. Every value is written twice, at its slot and capacity slots later, so
+    the most recent size values are always one contiguous slice of the backing array. Appending is O(1) and reading
+    a column never allocates, regardless of how much history is kept
+    """
+    def __init__(self, capacity: int = 10000) -> None:
+        if capacity <= 0:
+            raise ValueError('RingBuffer capacity must be positive')
+        self.capacity = capacity
+        self.data = np.zeros((len(COLUMNS), 2 * capacity), dtype=np.float64)
+        self.next = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def clear(self) -> None:
+        """
+        Empties the buffer without releasing its memory
+        """
+        self.next = 0
+        self.size = 0
+
+    def append(self, timestamp: float, open_price: float, high: Optional[float] = None, low: Optional[float] = None,
+               close: Optional[float] = None, volume: float = 0.0) -> None:
+        """
+        Appends one row. A tick can be appended with only a timestamp and price, which is used for every OHLC column
+        """
+        if high is None:
+            high = open_price
+        if low is None:
+            low = open_price
+        if close is None:
+            close = open_price
+
+        row = (timestamp, open_price, high, low, close, volume)
+        index = self.next
+        mirror = index + self.capacity
+        data = self.data
+        for column, value in enumerate(row):
+            data[column, index] = value
+            data[column, mirror] = value
+
+        self.next = index + 1 if index + 1 < self.capacity else 0
+        if self.size < self.capacity:
+            self.size += 1
+
+    def extend(self, timestamps: np.ndarray, close: np.ndarray, open_price: Optional[np.ndarray] = None,
+               high: Optional[np.ndarray] = None, low: Optional[np.ndarray] = None,
+               volume: Optional[np.ndarray] = None) -> None:
+        """
+        Appends many rows at once from column arrays. Missing OHLC columns default to close and a missing volume
+        column defaults to zero. Only the last capacity rows are kept
+        """
+        count = len(timestamps)
+        if count == 0:
+            return
+
+        columns = (timestamps,
+                   close if open_price is None else open_price,
+                   close if high is None else high,
+                   close if low is None else low,
+                   close,
+                   np.zeros(count) if volume is None else volume)
+
+        if count > self.capacity:
+            columns = tuple(np.asarray(column)[-self.capacity:] for column in columns)
+            self.next = (self.next + count - self.capacity) % self.capacity
+            count = self.capacity
+
+        indexes = (self.next + np.arange(count)) % self.capacity
+        for column, values in enumerate(columns):
+            self.data[column, indexes] = values
+            self.data[column, indexes + self.capacity] = values
+
+        self.next = (self.next + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def update_last(self, open_price: float, high: float, low: float, close: float, volume: float) -> None:
+        """
+        Overwrites the OHLCV values of the newest row in place, keeping its timestamp
+        """
+        if self.size == 0:
+            raise IndexError('update_last on an empty RingBuffer')
+        index = self.next - 1 if self.next > 0 else self.capacity - 1
+        mirror = index + self.capacity
+        data = self.data
+        for column, value in enumerate((open_price, high, low, close, volume), start=1):
+            data[column, index] = value
+            data[column, mirror] = value
+
+    def last_time(self) -> Optional[float]:
+        """
+        Returns the timestamp of the newest row, or None if the buffer is empty
+        """
+        if self.size == 0:
+            return None
+        index = self.next - 1 if self.next > 0 else self.capacity - 1
+        return float(self.data[0, index])
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Returns a contiguous read-only view of the buffered values of one column, oldest first
+        """
+        start = self.next - self.size
+        if start < 0:
+            start += self.capacity
+        view = self.data[COLUMNS.index(name), start:start + self.size]
+        view.flags.writeable = False
+        return view
+
+    def times(self) -> np.ndarray:
+        return self.column('time')
+
+    def closes(self) -> np.ndarray:
+        return self.column('close')
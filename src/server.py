@@ -1,19 +1,48 @@
 from flask import Flask, request
+import threading
+import metrics
 
 """This script runs a flask server listening to the local host on port 8182 to receive callback url and return authentication code"""
 
-codes = []
+code_listeners = []
+server_thread = None
 
 app = Flask(__name__)
 
 @app.route("/")
 def page() ->str:
     code = request.args.get("code")
-    codes.append(code)
+    if code:
+        for listener in list(code_listeners):
+            listener(code)
     return ''
 
+@app.route("/metrics")
+def metrics_page() -> tuple:
+    """ Exposes the process metrics in the Prometheus text format"""
+    return metrics.registry.prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def add_code_listener(listener) -> None:
+    """ Registers a callable that is called with every authentication code the callback receives"""
+    code_listeners.append(listener)
+
+
+def remove_code_listener(listener) -> None:
+    """ Removes a callable registered with add_code_listener"""
+    if listener in code_listeners:
+        code_listeners.remove(listener)
+
 
 def run_server()-> None:
     """ Runs HTTPS server with self-signed certificate"""
     app.run(ssl_context = ('../config/certificates/cert.pem','../config/keys/key.pem'), port=8182, debug= False)
 
+
+def start_server() -> threading.Thread:
+    """ Starts run_server in a daemon thread unless it is already running"""
+    global server_thread
+    if server_thread is None or not server_thread.is_alive():
+        server_thread = threading.Thread(target=run_server, daemon=True)
+        server_thread.start()
+    return server_thread
@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Optional
+from data_streamer import (Streamer, SERVICE_SCHEMAS, DECODE_SECONDS, HEARTBEATS, classify_frame, is_heartbeat,
+                           select_decoder)
+from http_client import HTTPClient
+from subscriptions import SubscriptionManager
+from tick_queue import TickQueue
+import asyncio
+import time
+import zlib
+
+"""Shards subscriptions across several streamer connections and merges their parsed output into one queue"""
+
+# Schwab caps the number of simultaneous streamer connections per account. Keep connections at or below the limit
+# that applies to the account in use
+MAX_STREAMER_CONNECTIONS = 4
+
+
+def decode_and_parse(message, decoder_name: str, output: str) -> tuple:
+    """
+    Decodes a raw frame and parses every data entry with a registered service. Returns the decode time and a list of
+    (service, parsed, parse time, frame timestamp) entries, or a single (None, message, 0.0, None) entry for frames
+    that are not market data. Runs in decoding worker processes, so the timings are taken here and recorded by the
+    streamer that submitted the frame
+    """
+    start = time.perf_counter()
+    message = select_decoder(decoder_name)[1](message)
+    decode_seconds = time.perf_counter() - start
+    if 'data' not in message:
+        return decode_seconds, [(None, message, 0.0, None)]
+
+    parsed = []
+    for frame in message['data']:
+        schema = SERVICE_SCHEMAS.get(frame['service'])
+        if schema is not None:
+            start = time.perf_counter()
+            parsed_message = schema.parse(frame, output)
+            parsed.append((schema.service, parsed_message, time.perf_counter() - start, frame.get('timestamp')))
+    return decode_seconds, parsed
+
+
+class ShardStreamer(Streamer):
+    """
+    Streamer that can hand decoding and parsing to a process pool. Frames are submitted in arrival order and their
+    results are forwarded in that same order, so each shard's output stays ordered while decoding runs in parallel.
+    If the pool breaks, on_broken_executor is called with it so the owner can replace it, and the frames it lost are
+    decoded in this process
+    """
+    def __init__(self, access_token: str, executor: Optional[ProcessPoolExecutor] = None, max_pending: int = 256,
+                 decoder: Optional[str] = None, client: Optional[HTTPClient] = None,
+                 on_broken_executor: Optional[Callable[[ProcessPoolExecutor], None]] = None) -> None:
+        super().__init__(access_token, decoder, client)
+        self.executor = executor
+        self.forwarding = executor is not None
+        self.on_broken_executor = on_broken_executor
+        self.pending = asyncio.Queue(maxsize=max_pending)
+
+    async def handle_message(self, message) -> None:
+        if not self.forwarding:
+            await super().handle_message(message)
+            return
+
+        if classify_frame(message) == 'notify' and is_heartbeat(message):
+            self.last_heartbeat = time.time()
+            HEARTBEATS.inc()
+            return
+
+        received = time.time()
+        future = None
+        executor = self.executor
+        if executor is not None:
+            try:
+                future = asyncio.get_running_loop().run_in_executor(executor, decode_and_parse, message,
+                                                                    self.decoder_name, self.parse_output)
+            except BrokenProcessPool:
+                self.executor_broken(executor)
+        await self.pending.put((future, executor, message, received))
+
+    def executor_broken(self, executor: ProcessPoolExecutor) -> None:
+        if self.on_broken_executor is not None:
+            self.on_broken_executor(executor)
+        elif self.executor is executor:
+            self.executor = None
+
+    async def decoded(self, future: Optional[asyncio.Future], executor: Optional[ProcessPoolExecutor],
+                      message) -> tuple:
+        """
+        Returns the result of a frame's decoding job, decoding it here when it has none or its pool broke
+        """
+        if future is not None:
+            try:
+                return await future
+            except BrokenProcessPool:
+                self.executor_broken(executor)
+        return decode_and_parse(message, self.decoder_name, self.parse_output)
+
+    async def forward_decoded(self) -> None:
+        """
+        Waits for decoded frames in submission order, records the same metrics Streamer.handle_message does and puts
+        their parsed messages on the routed queues. A frame that fails to decode or parse is logged and skipped
+        """
+        while True:
+            future, executor, message, received = await self.pending.get()
+            try:
+                decode_seconds, entries = await self.decoded(future, executor, message)
+            except Exception as e:
+                print(f'Failed to decode frame: {e!r}')
+                continue
+            DECODE_SECONDS.record(decode_seconds)
+            share = len(message) / len(entries) if entries else 0
+            for service, parsed_message, parse_seconds, timestamp in entries:
+                if service is None:
+                    print(parsed_message)
+                    continue
+                self.record_entry(service, timestamp, parse_seconds, share, received)
+                queue = self.routes[service][1]
+                if queue is not None:
+                    await queue.put(parsed_message)
+
+
+class StreamPool(object):
+    """
+    Spreads subscriptions over several Streamer connections by a stable hash of the symbol. Every shard has its own
+    websocket, listener and SubscriptionManager, and all of them feed one consumer facing queue. Messages from one
+    shard keep their order; messages from different shards interleave. With decode_workers the JSON decoding and
+    parsing of every shard runs in a shared process pool. A pool whose workers die is replaced up to
+    max_executor_restarts times, after that the shards decode in their own process
+    """
+    def __init__(self, access_token: str, connections: int = 2, queue=None, decode_workers: int = 0,
+                 client: Optional[HTTPClient] = None, max_executor_restarts: int = 3) -> None:
+        connections = max(1, min(connections, MAX_STREAMER_CONNECTIONS))
+        self.decode_workers = decode_workers
+        self.executor = ProcessPoolExecutor(decode_workers) if decode_workers else None
+        self.max_executor_restarts = max_executor_restarts
+        self.executor_restarts = 0
+        self.queue = queue if queue is not None else TickQueue()
+        self.streamers = [ShardStreamer(access_token, self.executor, client=client,
+                                        on_broken_executor=self.replace_executor) for _ in range(connections)]
+        self.subscriptions = [SubscriptionManager(streamer) for streamer in self.streamers]
+        self.tasks = []
+        for streamer in self.streamers:
+            streamer.set_data_queue(self.queue)
+
+    def replace_executor(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Called by a shard that found the decoding pool broken. Every shard reports the same pool, so only the first
+        report replaces it
+        """
+        if broken is not self.executor:
+            return
+        broken.shutdown(wait=False, cancel_futures=True)
+        if self.executor_restarts < self.max_executor_restarts:
+            self.executor_restarts += 1
+            self.executor = ProcessPoolExecutor(self.decode_workers)
+            print(f'Decoding workers died, restarted them ({self.executor_restarts}/{self.max_executor_restarts})')
+        else:
+            self.executor = None
+            print('Decoding workers keep dying, decoding in the streamer processes instead')
+        for streamer in self.streamers:
+            streamer.executor = self.executor
+
+    def shard_for(self, symbol: str) -> int:
+        """
+        Returns the index of the connection that carries symbol
+        """
+        return zlib.crc32(symbol.strip().encode()) % len(self.streamers)
+
+    def group_by_shard(self, symbols: Iterable[str]) -> dict:
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        shards = {}
+        for symbol in symbols:
+            shards.setdefault(self.shard_for(symbol), []).append(symbol)
+        return shards
+
+    def subscribe(self, service: str, symbols: Iterable[str], fields: Optional[Iterable] = None) -> None:
+        for shard, shard_symbols in self.group_by_shard(symbols).items():
+            self.subscriptions[shard].subscribe(service, shard_symbols, fields)
+
+    def unsubscribe(self, service: str, symbols: Iterable[str]) -> None:
+        for shard, shard_symbols in self.group_by_shard(symbols).items():
+            self.subscriptions[shard].unsubscribe(service, shard_symbols)
+
+    async def flush(self) -> None:
+        await asyncio.gather(*(subscriptions.flush() for subscriptions in self.subscriptions))
+
+    def update_access_token(self, access_token: str) -> None:
+        for streamer in self.streamers:
+            streamer.update_access_token(access_token)
+
+    async def start(self) -> None:
+        """
+        Fetches the streamer info once, logs every connection in and starts their supervised listeners
+        """
+        streamer_info = await asyncio.to_thread(self.streamers[0].get_streamer_info)
+        for streamer in self.streamers[1:]:
+            streamer.streamer_info = streamer_info
+
+        await asyncio.gather(*(streamer.start_stream_connection() for streamer in self.streamers))
+        for streamer, subscriptions in zip(self.streamers, self.subscriptions):
+            self.tasks.append(asyncio.create_task(streamer.run_supervised(subscriptions)))
+            if streamer.forwarding:
+                self.tasks.append(asyncio.create_task(streamer.forward_decoded()))
+        await self.flush()
+
+    async def close(self) -> None:
+        """
+        Logs every connection out, stops the listeners and shuts down the decoding workers
+        """
+        for streamer in self.streamers:
+            if streamer.websocket is not None:
+                await streamer.close_stream_connection(streamer.next_request_id())
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,160 @@
+from typing import Iterable, Optional
+from data_streamer import Streamer, SERVICE_SCHEMAS
+import asyncio
+
+"""Tracks the live symbol set of every streaming service and batches subscription changes into few stream requests"""
+
+
+class SubscriptionManager(object):
+    def __init__(self, streamer: Streamer, flush_delay: float = 0.05) -> None:
+        self.streamer = streamer
+        self.flush_delay = flush_delay
+        self.desired = {}
+        self.active = {}
+        self.desired_fields = {}
+        self.active_fields = {}
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+
+    def field_numbers(self, service: str, fields: Optional[Iterable]) -> frozenset:
+        """
+        Converts fields given as field numbers or display names into a set of field numbers. The symbol field is
+        always included and None selects every field of the service
+        """
+        schema = SERVICE_SCHEMAS[service]
+        if fields is None:
+            return frozenset(range(len(schema.keys)))
+
+        numbers = {0}
+        for field in fields:
+            if isinstance(field, str) and not field.isdigit():
+                numbers.add(schema.names.index(field))
+            else:
+                numbers.add(int(field))
+        return frozenset(numbers)
+
+    def subscribe(self, service: str, symbols: Iterable[str], fields: Optional[Iterable] = None) -> None:
+        """
+        Adds symbols to the service's live set. fields lists the field numbers or display names the caller needs;
+        the service streams the union of every caller's fields. The change is sent on the next flush
+        """
+        if service not in SERVICE_SCHEMAS:
+            raise ValueError(f'Unknown streaming service {service}')
+        if isinstance(symbols, str):
+            symbols = [symbols]
+
+        self.desired.setdefault(service, set()).update(symbol.strip() for symbol in symbols)
+        numbers = self.field_numbers(service, fields)
+        self.desired_fields[service] = self.desired_fields.get(service, frozenset()) | numbers
+        self.schedule_flush()
+
+    def unsubscribe(self, service: str, symbols: Iterable[str]) -> None:
+        """
+        Removes symbols from the service's live set. The change is sent on the next flush
+        """
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        self.desired.get(service, set()).difference_update(symbol.strip() for symbol in symbols)
+        self.schedule_flush()
+
+    def symbols(self, service: str) -> frozenset:
+        """
+        Returns the symbols currently subscribed on the stream for service
+        """
+        return frozenset(self.active.get(service, ()))
+
+    def schedule_flush(self) -> None:
+        """
+        Sends the pending changes flush_delay seconds from now, so rapid calls are coalesced into a single frame
+        """
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay,
+                                                 lambda: asyncio.ensure_future(self.scheduled_flush()))
+
+    async def scheduled_flush(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f'Failed to send subscription changes: {e!r}')
+
+    def has_pending_changes(self) -> bool:
+        """
+        Returns True if the desired symbols or fields of any service differ from what is live on the stream
+        """
+        for service, desired in self.desired.items():
+            active = self.active.get(service, set())
+            if desired != active:
+                return True
+            if active and self.active_fields.get(service) != self.desired_fields.get(service, frozenset()):
+                return True
+        return False
+
+    def build_requests(self) -> tuple:
+        """
+        Diffs the desired state against what is live on the stream and returns the SUBS/ADD/VIEW/UNSUBS requests
+        needed to reconcile them, together with the live symbols and fields per service once they are sent. The
+        live state itself is left alone, flush only commits it after the requests went out
+        """
+        stream_requests = []
+        active_symbols = {}
+        active_fields = dict(self.active_fields)
+        for service, desired in self.desired.items():
+            active = set(self.active.get(service, ()))
+            fields = self.desired_fields.get(service, frozenset())
+            field_list = ','.join(str(field) for field in sorted(fields))
+            to_add = desired - active
+            to_remove = active - desired
+
+            if to_add:
+                command = 'ADD' if active else 'SUBS'
+                stream_requests.append(self.streamer.build_request(
+                    service, command, self.streamer.next_request_id(),
+                    {"keys": ','.join(sorted(to_add)), "fields": field_list}))
+                if command == 'SUBS':
+                    active_fields[service] = fields
+                active.update(to_add)
+
+            if active and active_fields.get(service) != fields:
+                stream_requests.append(self.streamer.build_request(
+                    service, 'VIEW', self.streamer.next_request_id(), {"fields": field_list}))
+                active_fields[service] = fields
+
+            if to_remove:
+                stream_requests.append(self.streamer.build_request(
+                    service, 'UNSUBS', self.streamer.next_request_id(), {"keys": ','.join(sorted(to_remove))}))
+                active.difference_update(to_remove)
+            active_symbols[service] = active
+        return stream_requests, active_symbols, active_fields
+
+    async def flush(self) -> None:
+        """
+        Sends every pending subscription change in one websocket frame and marks it live once the send succeeded.
+        If the send fails nothing changes, so the next flush sends the same changes again
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        async with self._flush_lock:
+            stream_requests, active_symbols, active_fields = self.build_requests()
+            if stream_requests:
+                await self.streamer.send_requests(*stream_requests)
+            self.active.update(active_symbols)
+            self.active_fields = active_fields
+
+    def replay_requests(self) -> list:
+        """
+        Returns SUBS requests for every live subscription, used to restore them on a new connection. Changes that
+        never made it onto the stream are sent by a flush scheduled here
+        """
+        if self.has_pending_changes():
+            self.schedule_flush()
+        stream_requests = []
+        for service, active in self.active.items():
+            if active:
+                field_list = ','.join(str(field) for field in sorted(self.active_fields[service]))
+                stream_requests.append(self.streamer.build_request(
+                    service, 'SUBS', self.streamer.next_request_id(),
+                    {"keys": ','.join(sorted(active)), "fields": field_list}))
+        return stream_requests
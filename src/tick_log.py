@@ -0,0 +1,172 @@
+from typing import Iterator, Optional
+import websockets
+import threading
+import argparse
+import asyncio
+import struct
+import queue
+import gzip
+import time
+
+"""Records raw streamer frames with their receive times to a gzip log and replays them as a websocket stand-in"""
+
+RECORD_HEADER = struct.Struct('<dI')
+
+REPLAY_STREAMER_INFO = {
+    'streamerSocketUrl': 'replay://',
+    'schwabClientCustomerId': 'replay',
+    'schwabClientCorrelId': 'replay',
+    'schwabClientChannel': 'replay',
+    'schwabClientFunctionId': 'replay',
+}
+
+
+class TickRecorder(object):
+    """
+    Appends frames to a gzip file as records of (receive time as float64 epoch seconds, uint32 length, UTF-8 frame).
+    Records are buffered and handed in batches to a writer thread that compresses and appends them, so record never
+    blocks the event loop on zlib or disk. Every batch is closed as its own gzip member, so a log can be appended to
+    across sessions and a crash loses at most the batches not written yet. close writes everything still pending
+    """
+    def __init__(self, path: str, flush_bytes: int = 1 << 20, flush_interval: float = 5.0) -> None:
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.batches = queue.Queue()
+        self.writer = threading.Thread(target=self.write_batches, name=f'TickRecorder {path}', daemon=True)
+        self.writer.start()
+
+    def record(self, message, received_at: Optional[float] = None) -> None:
+        if isinstance(message, str):
+            message = message.encode()
+        self.buffer += RECORD_HEADER.pack(time.time() if received_at is None else received_at, len(message))
+        self.buffer += message
+        self.records += 1
+        if len(self.buffer) >= self.flush_bytes or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Hands the buffered records to the writer thread
+        """
+        if self.buffer:
+            self.batches.put(self.buffer)
+            self.buffer = bytearray()
+        self.last_flush = time.monotonic()
+
+    def write_batches(self) -> None:
+        """
+        Writer thread: compresses and appends batches in the order they were flushed until close sends None
+        """
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            try:
+                with gzip.open(self.path, 'ab', compresslevel=6) as f:
+                    f.write(batch)
+            except OSError as e:
+                print(f'Failed to write tick log {self.path}: {e!r}')
+
+    def close(self) -> None:
+        """
+        Flushes the buffer and waits until the writer thread has written every batch
+        """
+        if self.writer.is_alive():
+            self.flush()
+            self.batches.put(None)
+            self.writer.join()
+
+
+def read_ticks(path: str) -> Iterator[tuple]:
+    """
+    Yields (received_at, frame) for every record in a log written by TickRecorder. A record cut off by a crash ends
+    the log
+    """
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                received_at, length = RECORD_HEADER.unpack(header)
+                frame = f.read(length)
+            except (EOFError, gzip.BadGzipFile):
+                return
+            if len(frame) < length:
+                return
+            yield received_at, frame.decode()
+
+
+class ReplayWebSocket(object):
+    """
+    Stands in for the streamer websocket and returns recorded frames from recv. speed 1 keeps the recorded spacing,
+    speed N plays N times faster and speed None returns frames as fast as they are read. Requests passed to send
+    are kept in sent. The end of the log closes the connection like the server would
+    """
+    def __init__(self, path: str, speed: Optional[float] = 1.0) -> None:
+        self.ticks = read_ticks(path)
+        self.speed = speed
+        self.first_recorded = None
+        self.started = None
+        self.sent = []
+        self.frames = 0
+
+    async def recv(self) -> str:
+        for received_at, frame in self.ticks:
+            if self.speed:
+                if self.first_recorded is None:
+                    self.first_recorded = received_at
+                    self.started = time.monotonic()
+                delay = (received_at - self.first_recorded) / self.speed - (time.monotonic() - self.started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif self.frames % 256 == 0:
+                await asyncio.sleep(0)
+            self.frames += 1
+            return frame
+        raise websockets.exceptions.ConnectionClosed(None, None)
+
+    async def send(self, message: str) -> None:
+        self.sent.append(message)
+
+    async def close(self) -> None:
+        self.ticks.close()
+
+
+async def replay_benchmark(path: str, speed: Optional[float]) -> None:
+    """
+    Replays a log through a Streamer with counting queues and prints the ingest rate
+    """
+    from data_streamer import Streamer
+
+    class CountingQueue(object):
+        def __init__(self) -> None:
+            self.messages = 0
+            self.quotes = 0
+
+        async def put(self, parsed_message: list) -> None:
+            self.messages += 1
+            self.quotes += len(parsed_message) - 1
+
+    streamer = Streamer('replay')
+    queue = CountingQueue()
+    streamer.set_data_queue(queue)
+    streamer.open_replay(path, speed)
+    start = time.perf_counter()
+    await streamer.start_message_listener()
+    elapsed = time.perf_counter() - start
+    frames = streamer.websocket.frames
+    print(f'{frames} frames, {queue.messages} messages, {queue.quotes} quotes in {elapsed:.3f}s '
+          f'({frames / elapsed:,.0f} frames/s, {queue.quotes / elapsed:,.0f} quotes/s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a recorded tick log through the Streamer parsers')
+    parser.add_argument('path')
+    parser.add_argument('--speed', type=float, default=0, help='1 for recorded speed, N for N times, 0 for max')
+    args = parser.parse_args()
+    asyncio.run(replay_benchmark(args.path, args.speed or None))
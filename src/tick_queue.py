@@ -0,0 +1,171 @@
+from collections import deque, OrderedDict
+from typing import Optional
+import asyncio
+import time
+import metrics
+
+"""Bounded queue between the stream listener and its consumers with selectable overflow policies"""
+
+POLICIES = ('block', 'drop_oldest', 'conflate')
+
+
+def quote_symbol(quote) -> Optional[str]:
+    """
+    Returns the symbol of a parsed quote, which is either a display-name dict or a QuoteRecord
+    """
+    if isinstance(quote, dict):
+        return quote.get('Symbol')
+    return getattr(quote, 'symbol', None)
+
+
+def merge_quote(pending, quote) -> None:
+    """
+    Updates a pending quote in place with the fields of a newer one. The stream only sends fields that changed, so
+    the newer quote alone may be missing values the consumer has not seen yet
+    """
+    if isinstance(pending, dict):
+        pending.update(quote)
+        return
+    pending.timestamp = quote.timestamp
+    for attribute in quote.attributes:
+        value = getattr(quote, attribute)
+        if value is not None:
+            setattr(pending, attribute, value)
+
+
+class TickQueue(object):
+    """
+    Drop-in replacement for the asyncio.Queue passed to Streamer.set_data_queue. Items are the parsed messages
+    produced by the stream parsers, a label followed by quotes.
+
+    'block' makes put wait while maxsize items are queued, 'drop_oldest' discards the oldest message to make room
+    and 'conflate' merges updates into a single pending quote per symbol until the consumer next calls get, which
+    then receives every pending quote of one label as a single message. Conflation needs the 'dict' or 'records'
+    parser output.
+
+    A queue given a name reports how long messages wait in it, and its drops and conflations, to the metrics
+    registry. For conflated quotes the wait is measured from the first update the consumer has not seen
+    """
+    def __init__(self, maxsize: int = 1000, policy: str = 'conflate', name: Optional[str] = None) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown queue policy {policy}, expected one of {POLICIES}')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.messages = deque()
+        self.enqueued = deque()
+        self.latest = OrderedDict()
+        self.first_update = {}
+        self.puts = 0
+        self.drops = 0
+        self.conflations = 0
+        self._not_empty = asyncio.Condition()
+        self._not_full = asyncio.Condition()
+        self.name = name
+        if name is not None:
+            self.wait_histogram = metrics.histogram('queue_wait_seconds', 'Time a message waits in a data queue',
+                                                    queue=name)
+            self.drop_counter = metrics.counter('queue_drops_total', 'Messages or quotes dropped by a full queue',
+                                                queue=name)
+            self.conflation_counter = metrics.counter('queue_conflations_total',
+                                                      'Quote updates merged into a pending quote', queue=name)
+        else:
+            self.wait_histogram = None
+
+    def qsize(self) -> int:
+        if self.policy == 'conflate':
+            return len(self.latest)
+        return len(self.messages)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return self.maxsize > 0 and self.qsize() >= self.maxsize
+
+    def stats(self) -> dict:
+        """
+        Returns the current depth and the put, drop and conflation counters
+        """
+        return {'depth': self.qsize(), 'puts': self.puts, 'drops': self.drops, 'conflations': self.conflations}
+
+    async def put(self, message: list) -> None:
+        """
+        Adds a parsed message according to the queue's overflow policy
+        """
+        self.puts += 1
+        if self.policy == 'conflate':
+            self._conflate(message)
+        elif self.policy == 'drop_oldest':
+            if self.full():
+                self.messages.popleft()
+                self.enqueued.popleft()
+                self.count_drop()
+            self.messages.append(message)
+            self.enqueued.append(time.perf_counter())
+        else:
+            async with self._not_full:
+                await self._not_full.wait_for(lambda: not self.full())
+                self.messages.append(message)
+                self.enqueued.append(time.perf_counter())
+
+        async with self._not_empty:
+            self._not_empty.notify()
+
+    def _conflate(self, message: list) -> None:
+        """
+        Stores each quote of message under (label, symbol), replacing any quote the consumer has not taken yet
+        """
+        label = message[0]
+        for quote in message[1:]:
+            key = (label, quote_symbol(quote))
+            pending = self.latest.get(key)
+            if pending is not None:
+                self.conflations += 1
+                if self.wait_histogram is not None:
+                    self.conflation_counter.inc()
+                merge_quote(pending, quote)
+            else:
+                if self.full():
+                    dropped, _ = self.latest.popitem(last=False)
+                    self.first_update.pop(dropped, None)
+                    self.count_drop()
+                self.latest[key] = quote
+                self.first_update[key] = time.perf_counter()
+
+    def count_drop(self) -> None:
+        self.drops += 1
+        if self.wait_histogram is not None:
+            self.drop_counter.inc()
+
+    def get_nowait(self) -> list:
+        """
+        Returns the next message or raises asyncio.QueueEmpty
+        """
+        if self.empty():
+            raise asyncio.QueueEmpty
+
+        if self.policy != 'conflate':
+            enqueued = self.enqueued.popleft()
+            if self.wait_histogram is not None:
+                self.wait_histogram.record(time.perf_counter() - enqueued)
+            return self.messages.popleft()
+
+        label = next(iter(self.latest))[0]
+        keys = [key for key in self.latest if key[0] == label]
+        first_update = min(self.first_update.pop(key) for key in keys)
+        if self.wait_histogram is not None:
+            self.wait_histogram.record(time.perf_counter() - first_update)
+        return [label] + [self.latest.pop(key) for key in keys]
+
+    async def get(self) -> list:
+        """
+        Waits for and returns the next message
+        """
+        async with self._not_empty:
+            await self._not_empty.wait_for(lambda: not self.empty())
+            message = self.get_nowait()
+
+        if self.policy == 'block':
+            async with self._not_full:
+                self._not_full.notify()
+        return message
@@ -0,0 +1,137 @@
+from bisect import bisect_left
+from typing import Optional
+import threading
+import marshal
+import json
+import os
+
+"""Loads the SEC ticker file once and answers symbol lookups and autocomplete queries from in-memory indexes"""
+
+CACHE_VERSION = 1
+
+
+class TickerUniverse(object):
+    def __init__(self, ticker_file: str, cache_file: Optional[str] = None) -> None:
+        self.ticker_file = ticker_file
+        self.cache_file = cache_file if cache_file is not None else os.path.splitext(ticker_file)[0] + '.cache'
+        self.symbols = ()
+        self.symbol_set = frozenset()
+        self.titles = {}
+        self._loaded = threading.Event()
+        self._lock = threading.Lock()
+
+    def preload(self) -> threading.Thread:
+        """
+        Starts loading the ticker file in a daemon thread so the first lookup does not pay for it
+        """
+        thread = threading.Thread(target=self.load, daemon=True)
+        thread.start()
+        return thread
+
+    def load(self) -> None:
+        """
+        Builds the symbol indexes from the binary sidecar if it is current, otherwise parses the SEC json file
+        and rewrites the sidecar. Only the first call does any work
+        """
+        with self._lock:
+            if self._loaded.is_set():
+                return
+
+            try:
+                stat = os.stat(self.ticker_file)
+            except FileNotFoundError:
+                print(f"Ticker file {self.ticker_file} does not exist")
+                self._loaded.set()
+                return
+
+            signature = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+            cached = self._read_cache(signature)
+            if cached is None:
+                symbols, titles = self._parse_ticker_file()
+                self._write_cache(signature, symbols, titles)
+            else:
+                symbols, titles = cached
+
+            self.symbols = symbols
+            self.symbol_set = frozenset(symbols)
+            self.titles = dict(zip(symbols, titles))
+            self._loaded.set()
+
+    def _parse_ticker_file(self) -> tuple:
+        """
+        Parses the SEC company tickers json file and returns the symbols in sorted order with their titles
+        """
+        with open(self.ticker_file) as f:
+            data = json.load(f)
+
+        entries = sorted({v['ticker'].upper(): v.get('title', '') for v in data.values()}.items())
+        symbols = tuple(symbol for symbol, _ in entries)
+        titles = tuple(title for _, title in entries)
+        return symbols, titles
+
+    def _read_cache(self, signature: tuple) -> Optional[tuple]:
+        """
+        Returns the symbols and titles stored in the sidecar or None if it is missing or was built from another file
+        """
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cached_signature, symbols, titles = marshal.load(f)
+        except (FileNotFoundError, EOFError, ValueError, TypeError):
+            return None
+
+        if tuple(cached_signature) != signature:
+            return None
+        return symbols, titles
+
+    def _write_cache(self, signature: tuple, symbols: tuple, titles: tuple) -> None:
+        """
+        Writes the parsed tickers to the sidecar. Failing to write it only costs the next launch a json parse
+        """
+        temp_file = self.cache_file + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                marshal.dump((signature, symbols, titles), f)
+            os.replace(temp_file, self.cache_file)
+        except OSError as e:
+            print(f"Could not write ticker cache: {e}")
+
+    def wait_until_loaded(self) -> None:
+        """
+        Blocks until the indexes are built, loading them on the calling thread if no preload was started
+        """
+        if not self._loaded.is_set():
+            self.load()
+        self._loaded.wait()
+
+    def __contains__(self, symbol: str) -> bool:
+        self.wait_until_loaded()
+        return symbol in self.symbol_set
+
+    def __len__(self) -> int:
+        self.wait_until_loaded()
+        return len(self.symbols)
+
+    def is_valid(self, symbol: str) -> bool:
+        """
+        Returns True if symbol is a listed ticker
+        """
+        return symbol.upper() in self
+
+    def complete(self, prefix: str, limit: int = 20) -> list:
+        """
+        Returns up to limit symbols that start with prefix, in sorted order
+        """
+        self.wait_until_loaded()
+        prefix = prefix.upper()
+        if not prefix:
+            return []
+
+        matches = []
+        index = bisect_left(self.symbols, prefix)
+        while index < len(self.symbols) and len(matches) < limit:
+            symbol = self.symbols[index]
+            if not symbol.startswith(prefix):
+                break
+            matches.append(symbol)
+            index += 1
+        return matches
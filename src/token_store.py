@@ -0,0 +1,253 @@
+from datetime import datetime
+from typing import Optional
+import threading
+import tempfile
+import json
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+"""In-memory token cache with atomic, debounced and file-locked persistence to the token json file"""
+
+ACCESS_TOKEN_LIFETIME = 30 * 60
+REFRESH_TOKEN_LIFETIME = 7 * 24 * 60 * 60
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+class FileLock(object):
+    """
+    Exclusive advisory lock on a sidecar .lock file, shared by every platform process on the host
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+
+    def __enter__(self) -> 'FileLock':
+        self.file = open(self.path, 'a+')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+def parse_created_time(data: dict, epoch_key: str, legacy_key: str) -> Optional[float]:
+    """
+    Returns a token's creation time in epoch seconds, reading the legacy minute resolution string when the file
+    was written before epoch times were stored
+    """
+    created = data.get(epoch_key)
+    if created is not None:
+        return float(created)
+    legacy = data.get(legacy_key)
+    if legacy:
+        return datetime.strptime(legacy[:16], TIME_FORMAT).timestamp()
+    return None
+
+
+class TokenStore(object):
+    """
+    Holds the access and refresh tokens in memory with epoch second creation times, so validity checks need no
+    I/O or date parsing. Changes are written to disk after debounce seconds by writing a temporary file and renaming
+    it over the token file while holding a file lock. A newer token written by another process is kept rather than
+    overwritten, and whenever such a token is adopted from disk every listener is called with the new access token
+    """
+    def __init__(self, path: str, debounce: float = 0.5) -> None:
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.debounce = debounce
+        self.access_token = None
+        self.access_token_created_at = None
+        self.refresh_token = None
+        self.refresh_token_created_at = None
+        self.loaded_mtime = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self.listeners = []
+
+    def add_listener(self, listener) -> None:
+        """
+        Registers a callable that is called with the access token whenever one written by another process is
+        adopted. It may be called from the debounced save thread
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify_if_changed(self, previous_access_token: Optional[str]) -> None:
+        if self.access_token and self.access_token != previous_access_token:
+            for listener in list(self.listeners):
+                listener(self.access_token)
+
+    def load(self) -> bool:
+        """
+        Reads the token file into memory. Returns False if it does not exist or is empty
+        """
+        with FileLock(self.lock_path):
+            data = self._read()
+        if not data:
+            return False
+        previous = self.access_token
+        self._apply(data)
+        self.notify_if_changed(previous)
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reloads the tokens if another process replaced the file since it was last read. Costs one stat call
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.loaded_mtime:
+            return False
+        return self.load()
+
+    def _read(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                self.loaded_mtime = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if data == '':
+            return None
+        return json.loads(data)
+
+    def _apply(self, data: dict) -> None:
+        with self._lock:
+            self.access_token = data.get('access_token')
+            self.access_token_created_at = parse_created_time(data, 'access_token_created_at',
+                                                              'time_access_token_created')
+            self.refresh_token = data.get('refresh_token')
+            self.refresh_token_created_at = parse_created_time(data, 'refresh_token_created_at',
+                                                               'time_refresh_token_created')
+
+    def as_dict(self) -> dict:
+        """
+        Returns the tokens in the token file format, which keeps the legacy time strings next to the epoch times
+        """
+        def legacy(created: Optional[float]) -> Optional[str]:
+            return None if created is None else datetime.fromtimestamp(created).strftime(TIME_FORMAT)
+
+        return {
+            "access_token": self.access_token,
+            "time_access_token_created": legacy(self.access_token_created_at),
+            "access_token_created_at": self.access_token_created_at,
+            "refresh_token": self.refresh_token,
+            "time_refresh_token_created": legacy(self.refresh_token_created_at),
+            "refresh_token_created_at": self.refresh_token_created_at,
+        }
+
+    def access_token_valid(self, now: Optional[float] = None, margin: float = 0.0) -> bool:
+        """
+        Returns True if the access token will still be valid margin seconds from now
+        """
+        if not self.access_token or self.access_token_created_at is None:
+            return False
+        now = time.time() if now is None else now
+        return now + margin < self.access_token_created_at + ACCESS_TOKEN_LIFETIME
+
+    def refresh_token_valid(self, now: Optional[float] = None, margin: float = 0.0) -> bool:
+        """
+        Returns True if the refresh token will still be valid margin seconds from now
+        """
+        if not self.refresh_token or self.refresh_token_created_at is None:
+            return False
+        now = time.time() if now is None else now
+        return now + margin < self.refresh_token_created_at + REFRESH_TOKEN_LIFETIME
+
+    def access_token_expires_at(self) -> float:
+        if self.access_token_created_at is None:
+            return 0.0
+        return self.access_token_created_at + ACCESS_TOKEN_LIFETIME
+
+    def set_access_token(self, token: str, created_at: Optional[float] = None) -> None:
+        with self._lock:
+            self.access_token = token
+            self.access_token_created_at = time.time() if created_at is None else created_at
+        self.schedule_save()
+
+    def set_refresh_token(self, token: str, created_at: Optional[float] = None) -> None:
+        with self._lock:
+            self.refresh_token = token
+            self.refresh_token_created_at = time.time() if created_at is None else created_at
+        self.schedule_save()
+
+    def schedule_save(self) -> None:
+        """
+        Saves debounce seconds from now, so a burst of token updates becomes one write
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """
+        Writes any pending change immediately
+        """
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def save(self) -> None:
+        """
+        Atomically replaces the token file. Under the file lock the file on disk is re-read first and any token that
+        another process created more recently than ours is adopted instead of being overwritten
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with FileLock(self.lock_path):
+            on_disk = self._read() or {}
+            with self._lock:
+                self._timer = None
+                previous = self.access_token
+                disk_access = parse_created_time(on_disk, 'access_token_created_at', 'time_access_token_created')
+                if on_disk.get('access_token') and disk_access and disk_access > (self.access_token_created_at or 0):
+                    self.access_token = on_disk['access_token']
+                    self.access_token_created_at = disk_access
+                disk_refresh = parse_created_time(on_disk, 'refresh_token_created_at', 'time_refresh_token_created')
+                if on_disk.get('refresh_token') and disk_refresh and disk_refresh > (self.refresh_token_created_at or 0):
+                    self.refresh_token = on_disk['refresh_token']
+                    self.refresh_token_created_at = disk_refresh
+                data = json.dumps(self.as_dict())
+
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            self.loaded_mtime = os.stat(self.path).st_mtime_ns
+        self.notify_if_changed(previous)
@@ -0,0 +1,138 @@
+from PyQt6 import QtCore, QtGui
+from PyQt6.QtCore import Qt
+import numpy as np
+from typing import Iterable
+from candles import CandleFrame
+from watchlist_table import WatchlistTable
+
+"""Watchlist table model over a WatchlistTable that repaints changed rows once per render tick"""
+
+WATCHLIST_FIELDS = ('Last Price', 'Net Change', 'Net Percent Change', 'Bid Price', 'Ask Price', 'Total Volume',
+                    'High Price', 'Low Price')
+
+WATCHLIST_HEADERS = ('Symbol', 'Last', 'Change', '% Change', 'Bid', 'Ask', 'Volume', 'High', 'Low')
+
+FIELD_FORMATS = {'Net Change': '{:+.2f}', 'Net Percent Change': '{:+.2f}%', 'Total Volume': '{:,.0f}'}
+
+UP_COLOR = QtGui.QColor(38, 166, 91)
+DOWN_COLOR = QtGui.QColor(217, 48, 37)
+
+UPDATED_ROLES = [Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.ForegroundRole]
+
+
+def quote_from_candles(symbol: str, candles: CandleFrame) -> dict:
+    """
+    Builds a quote dict from the last two daily candles, used to fill the watchlist while the market is closed
+    """
+    close = float(candles.close[-1])
+    previous = float(candles.close[-2]) if len(candles) > 1 else float(candles.open[-1])
+    return {'Symbol': symbol, 'Last Price': close, 'Net Change': close - previous,
+            'Net Percent Change': (close - previous) / previous * 100 if previous else None,
+            'Total Volume': float(candles.volume[-1]), 'High Price': float(candles.high[-1]),
+            'Low Price': float(candles.low[-1])}
+
+
+class WatchlistModel(QtCore.QAbstractTableModel):
+    """
+    Column 0 is the symbol and the other columns are WATCHLIST_FIELDS. on_message only writes into the
+    WatchlistTable, views hear about the changes when flush emits one dataChanged per range of changed rows, so the
+    cost of a render tick follows the number of changed ranges rather than the number of quotes or cells.
+    symbols_added and symbols_removed let the running mode subscribe to or fetch the rows the user edits
+    """
+    symbols_added = QtCore.pyqtSignal(list)
+    symbols_removed = QtCore.pyqtSignal(list)
+
+    def __init__(self, fields: tuple = WATCHLIST_FIELDS, headers: tuple = WATCHLIST_HEADERS, max_gap: int = 16,
+                 parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self.table = WatchlistTable(fields)
+        self.headers = headers
+        self.max_gap = max_gap
+        self.formats = tuple(FIELD_FORMATS.get(field, '{:.2f}') for field in fields)
+        self.sign_columns = tuple(field in ('Net Change', 'Net Percent Change') for field in fields)
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.table)
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.table.fields) + 1
+
+    def data(self, index: QtCore.QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        column = index.column() - 1
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column < 0:
+                return self.table.symbols[row]
+            value = self.table.values[row, column]
+            return '' if np.isnan(value) else self.formats[column].format(value)
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            if column < 0:
+                return Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter
+            return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+        if role == Qt.ItemDataRole.ForegroundRole and column >= 0:
+            if column == self.table.direction_column:
+                direction = self.table.direction[row]
+            elif self.sign_columns[column]:
+                direction = np.sign(self.table.values[row, column])
+            else:
+                return None
+            if direction > 0:
+                return UP_COLOR
+            if direction < 0:
+                return DOWN_COLOR
+        return None
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def symbols(self) -> list:
+        return list(self.table.symbols)
+
+    def add_symbols(self, symbols: Iterable[str]) -> list:
+        """
+        Appends rows for the symbols not listed yet and returns them
+        """
+        added = [symbol for symbol in dict.fromkeys(symbols) if symbol not in self.table]
+        if added:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.table), len(self.table) + len(added) - 1)
+            for symbol in added:
+                self.table.add(symbol)
+            self.endInsertRows()
+            self.symbols_added.emit(added)
+        return added
+
+    def remove_symbols(self, symbols: Iterable[str]) -> list:
+        """
+        Deletes the rows of the listed symbols among symbols and returns them
+        """
+        removed = [symbol for symbol in dict.fromkeys(symbols) if symbol in self.table]
+        for symbol in removed:
+            row = self.table.rows[symbol]
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            self.table.remove(symbol)
+            self.endRemoveRows()
+        if removed:
+            self.symbols_removed.emit(removed)
+        return removed
+
+    def on_message(self, message: list) -> None:
+        """
+        Applies a parsed LEVELONE_EQUITIES message. Other services are ignored
+        """
+        if message[0] == 'Equities':
+            self.table.update(message[1:])
+
+    def update_quotes(self, quotes: list) -> None:
+        self.table.update(quotes)
+
+    def flush(self) -> None:
+        """
+        Tells the views which rows changed since the last flush. Called once per render tick
+        """
+        last_column = len(self.table.fields)
+        for first, last in self.table.take_changed(self.max_gap):
+            self.dataChanged.emit(self.index(first, 1), self.index(last, last_column), UPDATED_ROLES)
@@ -0,0 +1,122 @@
+from data_streamer import attribute_name
+from tick_queue import quote_symbol
+import numpy as np
+
+"""Columnar table of the latest quote fields per symbol that tracks which rows changed since it was last drained"""
+
+
+class WatchlistTable(object):
+    """
+    One float64 row per symbol and one column per field, NaN until a value arrives. A parsed message is applied
+    with one fancy-indexed assignment per field instead of per cell, and changed rows are collected as a mask so a
+    view can be told about them in a few contiguous ranges. Rows keep the order symbols were added in
+    """
+    def __init__(self, fields: tuple, capacity: int = 64, direction_field: str = 'Last Price') -> None:
+        self.fields = tuple(fields)
+        self.attributes = tuple(attribute_name(field) for field in self.fields)
+        self.values = np.full((capacity, len(self.fields)), np.nan)
+        self.changed = np.zeros(capacity, dtype=bool)
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self.direction_column = self.fields.index(direction_field) if direction_field in self.fields else None
+        self.symbols = []
+        self.rows = {}
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.rows
+
+    def add(self, symbol: str) -> int:
+        """
+        Appends an empty row for symbol and returns its index, or the existing index if it is already listed
+        """
+        row = self.rows.get(symbol)
+        if row is not None:
+            return row
+        row = len(self.symbols)
+        if row == len(self.values):
+            self.grow(2 * len(self.values))
+        self.values[row] = np.nan
+        self.direction[row] = 0
+        self.changed[row] = False
+        self.symbols.append(symbol)
+        self.rows[symbol] = row
+        return row
+
+    def grow(self, capacity: int) -> None:
+        size = len(self.symbols)
+        values = np.full((capacity, len(self.fields)), np.nan)
+        values[:size] = self.values[:size]
+        changed = np.zeros(capacity, dtype=bool)
+        changed[:size] = self.changed[:size]
+        direction = np.zeros(capacity, dtype=np.int8)
+        direction[:size] = self.direction[:size]
+        self.values, self.changed, self.direction = values, changed, direction
+
+    def remove(self, symbol: str) -> int:
+        """
+        Deletes symbol's row, shifting the rows below it up by one, and returns the index it had
+        """
+        row = self.rows.pop(symbol)
+        size = len(self.symbols)
+        for array in (self.values, self.changed, self.direction):
+            array[row:size - 1] = array[row + 1:size]
+        del self.symbols[row]
+        for index in range(row, size - 1):
+            self.rows[self.symbols[index]] = index
+        return row
+
+    def update(self, quotes: list) -> int:
+        """
+        Applies the fields present in parsed quotes, either display-name dicts or QuoteRecords, to the rows of the
+        listed symbols and returns how many quotes matched a row. Fields a quote does not carry keep their value,
+        since the stream only sends what changed
+        """
+        rows = []
+        matched = []
+        for quote in quotes:
+            row = self.rows.get(quote_symbol(quote))
+            if row is not None:
+                rows.append(row)
+                matched.append(quote)
+        if not rows:
+            return 0
+
+        rows = np.array(rows)
+        records = not isinstance(matched[0], dict)
+        for column, (field, attribute) in enumerate(zip(self.fields, self.attributes)):
+            if records:
+                received = [getattr(quote, attribute, None) for quote in matched]
+            else:
+                received = [quote.get(field) for quote in matched]
+            incoming = np.array([np.nan if value is None else value for value in received], dtype=np.float64)
+            present = ~np.isnan(incoming)
+            if not present.any():
+                continue
+            target = rows[present]
+            if column == self.direction_column:
+                moves = np.sign(incoming[present] - self.values[target, column])
+                moved = ~np.isnan(moves) & (moves != 0)
+                self.direction[target[moved]] = moves[moved]
+            self.values[target, column] = incoming[present]
+
+        self.changed[rows] = True
+        return len(rows)
+
+    def value(self, row: int, field: str) -> float:
+        return self.values[row, self.fields.index(field)]
+
+    def take_changed(self, max_gap: int = 0) -> list:
+        """
+        Returns the rows changed since the last call as (first, last) ranges and clears them. Ranges separated by
+        at most max_gap unchanged rows are merged, trading a few repainted cells for fewer notifications
+        """
+        rows = np.flatnonzero(self.changed[:len(self.symbols)])
+        if not len(rows):
+            return []
+        self.changed[rows] = False
+        breaks = np.flatnonzero(np.diff(rows) > max_gap + 1)
+        firsts = np.concatenate((rows[:1], rows[breaks + 1]))
+        lasts = np.concatenate((rows[breaks], rows[-1:]))
+        return list(zip(firsts.tolist(), lasts.tolist()))